@@ -15,12 +15,20 @@ import flask_migrate as migrate
 from eisitirio import app
 from eisitirio import system # pylint: disable=unused-import
 from eisitirio.database import db
+from eisitirio.scripts import archive_log
+from eisitirio.scripts import check_announcement_recipients
+from eisitirio.scripts import check_statistics
+from eisitirio.scripts import compact_statistics
 from eisitirio.scripts import cron
+from eisitirio.scripts import explain_queries
 from eisitirio.scripts import fix_graduand_postage
 from eisitirio.scripts import prefill
+from eisitirio.scripts import rebuild_ticket_counters
 from eisitirio.scripts import run_bpython
+from eisitirio.scripts import send_outbox
 from eisitirio.scripts import update_battels
 from eisitirio.scripts import create_qr_codes
+from eisitirio.scripts import verify_qr_codes
 
 EISITIRIO_DIR = os.path.realpath(__file__).replace('command.py',
                                                    'eisitirio')
@@ -59,15 +67,28 @@ MANAGER = script.Manager(get_app, with_default_commands=False)
 MANAGER.add_option('config', default=None,
                    help="Configuration file to load before running commands")
 
+MANAGER.add_command('archive_log', archive_log.ArchiveLogCommand)
 MANAGER.add_command('bpython', run_bpython.BpythonCommand)
+MANAGER.add_command(
+    'check_announcement_recipients',
+    check_announcement_recipients.CheckAnnouncementRecipientsCommand
+)
+MANAGER.add_command('check_statistics', check_statistics.CheckStatisticsCommand)
+MANAGER.add_command('compact_statistics',
+                    compact_statistics.CompactStatisticsCommand)
 MANAGER.add_command('cron', cron.CronCommand)
+MANAGER.add_command('explain_queries', explain_queries.ExplainQueriesCommand)
 MANAGER.add_command('fix_graduand_postage',
                     fix_graduand_postage.FixGraduandPostageCommand)
 MANAGER.add_command('db', migrate.MigrateCommand)
 MANAGER.add_command('prefill', prefill.PrefillCommand)
+MANAGER.add_command('rebuild_ticket_counters',
+                    rebuild_ticket_counters.RebuildTicketCountersCommand)
 MANAGER.add_command('run', script.Server)
 MANAGER.add_command('update_battels', update_battels.UpdateBattelsCommand)
 MANAGER.add_command('send_qr_tickets', create_qr_codes.CreateQRCodes)
+MANAGER.add_command('send_outbox', send_outbox.SendOutboxCommand)
+MANAGER.add_command('verify_qr_codes', verify_qr_codes.VerifyQRCodesCommand)
 
 if __name__ == '__main__':
     MANAGER.run()
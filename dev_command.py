@@ -0,0 +1,52 @@
+#!/usr/bin/env python2
+# coding: utf-8
+"""Script to invoke the development-only benchmark and stress commands.
+
+These seed a scratch database and check how many queries, or how much time or
+memory, parts of the app need, so they're kept apart from the commands in
+command.py which are run against a deployment. They take the same config
+argument.
+"""
+
+from __future__ import unicode_literals
+
+import flask_script as script
+# from flask.ext import script
+
+import command
+from eisitirio.scripts import benchmark_check_in
+from eisitirio.scripts import benchmark_csv_export
+from eisitirio.scripts import benchmark_dashboard
+from eisitirio.scripts import benchmark_impersonation
+from eisitirio.scripts import benchmark_outbox
+from eisitirio.scripts import benchmark_pagination
+from eisitirio.scripts import benchmark_statistic_series
+from eisitirio.scripts import benchmark_statistics
+from eisitirio.scripts import stress_reservations
+
+MANAGER = script.Manager(command.get_app, with_default_commands=False)
+
+MANAGER.add_option('config', default=None,
+                   help="Configuration file to load before running commands")
+
+MANAGER.add_command('benchmark_check_in',
+                    benchmark_check_in.BenchmarkCheckInCommand)
+MANAGER.add_command('benchmark_csv_export',
+                    benchmark_csv_export.BenchmarkCsvExportCommand)
+MANAGER.add_command('benchmark_dashboard',
+                    benchmark_dashboard.BenchmarkDashboardCommand)
+MANAGER.add_command('benchmark_impersonation',
+                    benchmark_impersonation.BenchmarkImpersonationCommand)
+MANAGER.add_command('benchmark_outbox',
+                    benchmark_outbox.BenchmarkOutboxCommand)
+MANAGER.add_command('benchmark_pagination',
+                    benchmark_pagination.BenchmarkPaginationCommand)
+MANAGER.add_command('benchmark_statistic_series',
+                    benchmark_statistic_series.BenchmarkStatisticSeriesCommand)
+MANAGER.add_command('benchmark_statistics',
+                    benchmark_statistics.BenchmarkStatisticsCommand)
+MANAGER.add_command('stress_reservations',
+                    stress_reservations.StressReservationsCommand)
+
+if __name__ == '__main__':
+    MANAGER.run()
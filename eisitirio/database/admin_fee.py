@@ -80,9 +80,10 @@ class AdminFee(DB.Model):
                 if ticket.object_id in possible_tickets:
                     ticket.add_note('Upgrade')
         else:
-            APP.email_manager.send_template(
+            APP.email_manager.queue_template(
                 self.charged_by.email,
                 'Administration fee paid.',
                 'admin_fee_paid.email',
+                commit=False,
                 fee=self
             )
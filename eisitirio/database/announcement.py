@@ -5,13 +5,19 @@ from __future__ import unicode_literals
 
 import datetime
 
+import sqlalchemy
+
 from eisitirio import app
 from eisitirio.database import db
+from eisitirio.database import ticket
 from eisitirio.database import user
+from eisitirio.database import waiting
 
 APP = app.APP
 DB = db.DB
 
+EMAIL_PAGE_SIZE = 100
+
 USER_ANNOUNCE_LINK = DB.Table(
     'user_announce_link',
     DB.Model.metadata,
@@ -73,6 +79,12 @@ class Announcement(DB.Model):
         default=False,
         nullable=False
     )
+    # ID of the last user emailed, recipients are emailed in order of ID
+    email_cursor = DB.Column(
+        DB.Integer,
+        default=0,
+        nullable=False
+    )
 
     sender_id = DB.Column(
         DB.Integer,
@@ -173,6 +185,19 @@ class Announcement(DB.Model):
         self.has_collected = has_collected
         self.has_uncollected = has_uncollected
 
+    def __repr__(self):
+        return '<Announcement {0}: {1}>'.format(self.object_id, self.subject)
+
+    def get_recipient_query(self):
+        """Get a query for the users matching the announcement's criteria.
+
+        The criteria are compiled into EXISTS subqueries, so that the
+        recipients can be selected in a single query rather than checking each
+        user in turn.
+
+        Returns:
+            (sqlalchemy.orm.query.Query) query for the matching users.
+        """
         recipient_query = user.User.query
 
         if self.college is not None:
@@ -185,37 +210,161 @@ class Announcement(DB.Model):
                 user.User.affiliation == self.affiliation
             )
 
-        for recipient in recipient_query.all():
-            if (
-                    ( # pylint: disable=too-many-boolean-expressions
-                        self.has_tickets is None or
-                        recipient.has_tickets() == self.has_tickets
-                    ) and
-                    (
-                        self.holds_ticket is None or
-                        recipient.has_held_ticket() == self.holds_ticket
-                    ) and
-                    (
-                        self.is_waiting is None or
-                        recipient.is_waiting == self.is_waiting
-                    ) and
-                    (
-                        self.has_collected is None or
-                        recipient.has_collected_tickets() == self.has_collected
-                    ) and
-                    (
-                        self.has_uncollected is None or (
-                            recipient.has_uncollected_tickets() ==
-                            self.has_uncollected
-                        )
-                    )
-            ):
-                self.users.append(recipient)
-                if send_email:
-                    self.emails.append(recipient)
+        owned = ticket.Ticket.query.filter(
+            ticket.Ticket.owner_id == user.User.object_id
+        ).filter(
+            ticket.Ticket.cancelled == False # pylint: disable=singleton-comparison
+        )
 
-    def __repr__(self):
-        return '<Announcement {0}: {1}>'.format(self.object_id, self.subject)
+        held = ticket.Ticket.query.filter(
+            ticket.Ticket.holder_id == user.User.object_id
+        )
+
+        criteria = [
+            (
+                self.has_tickets,
+                owned.exists()
+            ),
+            (
+                self.holds_ticket,
+                held.exists()
+            ),
+            (
+                self.is_waiting,
+                waiting.Waiting.query.filter(
+                    waiting.Waiting.user_id == user.User.object_id
+                ).exists()
+            ),
+            (
+                self.has_collected,
+                owned.filter(ticket.Ticket.barcode != None).exists() # pylint: disable=singleton-comparison
+            ),
+            (
+                self.has_uncollected,
+                sqlalchemy.or_(
+                    owned.filter(ticket.Ticket.barcode == None).exists(), # pylint: disable=singleton-comparison
+                    held.filter(ticket.Ticket.barcode == None).exists() # pylint: disable=singleton-comparison
+                )
+            ),
+        ]
+
+        for wanted, condition in criteria:
+            if wanted is not None:
+                recipient_query = recipient_query.filter(
+                    condition if wanted else ~condition
+                )
+
+        return recipient_query
+
+    def matches(self, recipient):
+        """Check whether a single user matches the announcement's criteria.
+
+        Equivalent to get_recipient_query, but checks the user in Python.
+
+        Args:
+            recipient: (models.User) the user to check.
+
+        Returns:
+            (bool) whether the user should receive the announcement.
+        """
+        return (
+            ( # pylint: disable=too-many-boolean-expressions
+                self.college is None or
+                recipient.college == self.college
+            ) and
+            (
+                self.affiliation is None or
+                recipient.affiliation == self.affiliation
+            ) and
+            (
+                self.has_tickets is None or
+                recipient.has_tickets() == self.has_tickets
+            ) and
+            (
+                self.holds_ticket is None or
+                recipient.has_held_ticket() == self.holds_ticket
+            ) and
+            (
+                self.is_waiting is None or
+                recipient.is_waiting == self.is_waiting
+            ) and
+            (
+                self.has_collected is None or
+                recipient.has_collected_tickets() == self.has_collected
+            ) and
+            (
+                self.has_uncollected is None or (
+                    recipient.has_uncollected_tickets() ==
+                    self.has_uncollected
+                )
+            )
+        )
+
+    def add_recipients(self):
+        """Add the users matching the criteria as recipients.
+
+        Inserts the links for all recipients with INSERT ... SELECT statements,
+        so must be called after the announcement has been added to the session.
+        The caller is responsible for committing.
+        """
+        DB.session.flush()
+
+        recipients = self.get_recipient_query().with_entities(
+            user.User.object_id,
+            sqlalchemy.literal(self.object_id)
+        )
+
+        link_tables = [USER_ANNOUNCE_LINK]
+
+        if self.send_email:
+            link_tables.append(EMAIL_ANNOUNCE_LINK)
+
+        for link_table in link_tables:
+            DB.session.execute(
+                link_table.insert().from_select(
+                    ['user_id', 'announcement_id'],
+                    recipients
+                )
+            )
+
+        DB.session.expire(self, ['users'])
+
+    def get_email_page(self, page_size):
+        """Get the next recipients to email, after the delivery cursor.
+
+        Args:
+            page_size: (int) maximum number of recipients to get.
+
+        Returns:
+            (list((int, str))) the ID and email address of each recipient, in
+            order of ID.
+        """
+        return DB.session.query(
+            user.User.object_id,
+            user.User.email
+        ).join(
+            EMAIL_ANNOUNCE_LINK,
+            EMAIL_ANNOUNCE_LINK.c.user_id == user.User.object_id
+        ).filter(
+            EMAIL_ANNOUNCE_LINK.c.announcement_id == self.object_id
+        ).filter(
+            user.User.object_id > self.email_cursor
+        ).order_by(
+            user.User.object_id
+        ).limit(page_size).all()
+
+    @property
+    def emails_remaining(self):
+        """How many recipients haven't been emailed yet?"""
+        return DB.session.query(
+            sqlalchemy.func.count()
+        ).select_from(
+            EMAIL_ANNOUNCE_LINK
+        ).filter(
+            EMAIL_ANNOUNCE_LINK.c.announcement_id == self.object_id
+        ).filter(
+            EMAIL_ANNOUNCE_LINK.c.user_id > self.email_cursor
+        ).scalar()
 
     def send_emails(self, count):
         """Send the announcement as an email to a limited number of recipients.
@@ -223,6 +372,12 @@ class Announcement(DB.Model):
         Used for batch sending, renders the text of the announcement into an
         email and sends it to users who match the criteria.
 
+        Recipients are fetched in pages in order of user ID, and each page is
+        sent over the same SMTP connection. After each page the delivery cursor
+        is moved past it and committed, so sending can resume from where it
+        left off if interrupted. Emails which fail for a temporary reason are
+        added to the outbox to be retried by the outbox worker.
+
         Args:
             count: (int) Maximum number of emails to send
 
@@ -235,18 +390,41 @@ class Announcement(DB.Model):
         else:
             sender = self.sender.email
 
+        manager = APP.email_manager
+        connection = None
+
         try:
-            for recipient in self.emails:
-                if count <= 0:
+            while count > 0:
+                page = self.get_email_page(min(count, EMAIL_PAGE_SIZE))
+
+                if not page:
+                    self.email_sent = True
+                    DB.session.commit()
                     break
 
-                APP.email_manager.send_text(recipient.email, self.subject,
-                                            self.content, sender)
+                for _, email in page:
+                    if not APP.config['SEND_EMAILS']:
+                        continue
+
+                    message = manager.compose_text(email, self.subject,
+                                                   self.content, sender)
+
+                    connection, error, permanent = manager.send_over(
+                        connection,
+                        message['From'],
+                        message.get_all('To'),
+                        message['Subject'],
+                        message.as_string()
+                    )
+
+                    if error is not None and not permanent:
+                        manager.queue_message(message, commit=False)
+
+                self.email_cursor = page[-1][0]
+                DB.session.commit()
 
-                self.emails.remove(recipient)
-                count = count - 1
+                count -= len(page)
         finally:
-            self.email_sent = (self.emails.count() == 0)
-            DB.session.commit()
+            manager.close_connection(connection)
 
         return count
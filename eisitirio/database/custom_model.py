@@ -9,11 +9,15 @@ from __future__ import unicode_literals
 
 import functools
 
+import flask
+import flask_login as login
+# from flask.ext import login
 import flask_sqlalchemy
 # from flask.ext import sqlalchemy as flask_sqlalchemy
 import sqlalchemy
 
 from eisitirio.helpers import permissions
+from eisitirio.helpers import request_cache
 
 class CustomModelMeta(flask_sqlalchemy._BoundDeclarativeMeta): # pylint: disable=protected-access
     """Metaclass for the custom model to magically create get_by methods."""
@@ -48,6 +52,14 @@ class CustomModelMeta(flask_sqlalchemy._BoundDeclarativeMeta): # pylint: disable
                 )
             )
 
+        # Primary key lookups can be answered from the session's identity map.
+        # A value which isn't an ID matches nothing, as it would when filtering
+        if field_name == 'object_id':
+            try:
+                return cls.get_by_id(value)
+            except (TypeError, ValueError):
+                return None
+
         item = cls.query.filter(field == value).first()
 
         if not item:
@@ -55,6 +67,23 @@ class CustomModelMeta(flask_sqlalchemy._BoundDeclarativeMeta): # pylint: disable
 
         return item
 
+def _make_check(method, name):
+    """Make a method calling |method| (can or has) for the given name."""
+    def check(self, *args, **kwargs):
+        """Check a permission or possession, see CustomModel.__getattr__."""
+        return getattr(self, method)(name, *args, **kwargs)
+
+    check.__name__ = str('{0}_{1}'.format(method, name))
+
+    return check
+
+def _current_user_id():
+    """Get the ID of the logged in user, or None if there isn't one."""
+    if not flask.has_request_context():
+        return None
+
+    return login.current_user.get_id()
+
 class CustomModel(flask_sqlalchemy.Model):
     """Base table schema to reduce duplication."""
     __tablename__ = None
@@ -98,63 +127,88 @@ class CustomModel(flask_sqlalchemy.Model):
         """
         return permissions.possession(cls, name)
 
-    def can(self, name, *args, **kwargs):
-        """Check whether this object has permission to do something.
+    def _check(self, registry, kind, name, args, kwargs):
+        """Evaluate a permission or possession function, caching the result.
 
-        Gets the permission function by |name|, and passes it this object and
-        the args and kwargs.
+        The result is kept for the rest of the request (until the session is
+        next flushed), as templates often check the same thing many times.
+        Results for objects with unflushed changes aren't cached. Some
+        functions depend on who is logged in, so the result is cached against
+        the current user as well as this object.
         """
         try:
-            return permissions.PERMISSIONS[self.__class__][name](
-                self,
-                *args,
-                **kwargs
-            )
+            func = registry[self.__class__][name]
         except KeyError:
             raise AttributeError(
-                'Permission {0} does not exist for model {1}'.format(
+                '{0} {1} does not exist for model {2}'.format(
+                    kind,
                     name,
                     self.__class__.__name__
                 )
             )
 
+        return request_cache.memoize(
+            (
+                kind,
+                self.__class__,
+                self.object_id,
+                _current_user_id(),
+                name,
+                args,
+                tuple(sorted(kwargs.iteritems()))
+            ),
+            lambda: func(self, *args, **kwargs),
+            self
+        )
+
+    def can(self, name, *args, **kwargs):
+        """Check whether this object has permission to do something.
+
+        Gets the permission function by |name|, and passes it this object and
+        the args and kwargs.
+        """
+        return self._check(permissions.PERMISSIONS, 'Permission', name, args,
+                           kwargs)
+
     def has(self, name, *args, **kwargs):
         """Check whether this object has a possession.
 
         Gets the possession function by |name|, and passes it this object and
         the args and kwargs.
         """
-        try:
-            return permissions.POSSESSIONS[self.__class__][name](
-                self,
-                *args,
-                **kwargs
-            )
-        except KeyError:
-            raise AttributeError(
-                'Possession {0} does not exist for model {1}'.format(
-                    name,
-                    self.__class__.__name__
-                )
-            )
+        return self._check(permissions.POSSESSIONS, 'Possession', name, args,
+                           kwargs)
 
     def __getattr__(self, name):
         """Neat way to access permission/possession functions.
 
         Allows using can_be_cancelled in place of can('be_cancelled') and
         has_tickets in place of has('tickets').
+
+        Once a permission or possession has been accessed this way, a method
+        for it is added to the class, so later accesses don't go through here.
         """
         if name.startswith('can_'):
+            if name[4:] in permissions.PERMISSIONS[self.__class__]:
+                setattr(self.__class__, name, _make_check('can', name[4:]))
+
             return functools.partial(self.can, name[4:])
         elif name.startswith('has_'):
+            if name[4:] in permissions.POSSESSIONS[self.__class__]:
+                setattr(self.__class__, name, _make_check('has', name[4:]))
+
             return functools.partial(self.has, name[4:])
 
         return getattr(super(CustomModel, self), name)
 
     @classmethod
     def get_by_id(cls, object_id):
-        """Get an object by its database ID."""
-        item = cls.query.filter(cls.object_id == int(object_id)).first()
+        """Get an object by its database ID.
+
+        Uses the session's identity map, so an object which has already been
+        loaded in this session is returned without querying the database.
+        """
+        item = cls.query.get(int(object_id))
 
         if not item:
             return None
@@ -28,7 +28,8 @@ class Log(DB.Model):
 
     timestamp = DB.Column(
         DB.DateTime,
-        nullable=False
+        nullable=False,
+        index=True
     )
     ip_address = DB.Column(
         DB.Unicode(45),
@@ -134,6 +135,14 @@ class Log(DB.Model):
             self.timestamp.strftime('%Y-%m-%d %H:%m (UTC)')
         )
 
+    @staticmethod
+    def csv_export_options():
+        """Get options to load what write_csv_row uses along with the rows."""
+        return [
+            DB.joinedload(Log.actor),
+            DB.joinedload(Log.user),
+        ]
+
     @staticmethod
     def write_csv_header(csv_writer):
         """Write the header of a CSV export file."""
@@ -29,12 +29,16 @@ from eisitirio.database.eway_transaction import EwayTransaction
 from eisitirio.database.group_purchase_request import GroupPurchaseRequest
 from eisitirio.database.generic_transaction_item import GenericTransactionItem
 from eisitirio.database.log import Log
+from eisitirio.database.outbox_email import OutboxEmail
 from eisitirio.database.photo import Photo
 from eisitirio.database.postage import Postage
 from eisitirio.database.postage_transaction_item import PostageTransactionItem
 from eisitirio.database.purchase_group import PurchaseGroup
+from eisitirio.database.queue_entry import QueueEntry
 from eisitirio.database.statistic import Statistic
+from eisitirio.database.statistic_counter import StatisticCounter
 from eisitirio.database.ticket import Ticket
+from eisitirio.database.ticket_counter import TicketCounter
 from eisitirio.database.ticket_transaction_item import TicketTransactionItem
 from eisitirio.database.transaction import DummyTransaction
 from eisitirio.database.transaction import FreeTransaction
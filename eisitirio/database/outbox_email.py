@@ -0,0 +1,83 @@
+# coding: utf-8
+"""Database model for emails waiting to be sent."""
+
+from __future__ import unicode_literals
+
+import datetime
+
+from eisitirio.database import db
+
+DB = db.DB
+
+class OutboxEmail(DB.Model):
+    """Model for emails waiting to be sent by the outbox worker."""
+    __tablename__ = 'outbox_email'
+    __table_args__ = (
+        # The worker polls for pending emails which are due
+        DB.Index('ix_outbox_email_pending_next_attempt',
+                 'pending', 'next_attempt'),
+    )
+
+    created = DB.Column(
+        DB.DateTime(),
+        nullable=False
+    )
+    sender = DB.Column(
+        DB.Unicode(120),
+        nullable=False
+    )
+    recipients = DB.Column(
+        DB.UnicodeText(),
+        nullable=False
+    )
+    subject = DB.Column(
+        DB.Unicode(255),
+        nullable=False
+    )
+    message = DB.Column(
+        # Large enough for emails with embedded images, MEDIUMTEXT on MySQL
+        DB.Text(length=16777215),
+        nullable=False
+    )
+
+    pending = DB.Column(
+        DB.Boolean(),
+        default=True,
+        nullable=False
+    )
+    attempts = DB.Column(
+        DB.Integer(),
+        default=0,
+        nullable=False
+    )
+    next_attempt = DB.Column(
+        DB.DateTime(),
+        nullable=False
+    )
+    sent = DB.Column(
+        DB.DateTime(),
+        nullable=True
+    )
+    last_error = DB.Column(
+        DB.Unicode(255),
+        nullable=True
+    )
+
+    def __init__(self, message):
+        self.created = datetime.datetime.utcnow()
+        self.next_attempt = self.created
+
+        self.sender = message['From']
+        self.recipients = ','.join(message.get_all('To'))
+        self.subject = message['Subject']
+        self.message = message.as_string()
+
+        self.pending = True
+        self.attempts = 0
+
+    def __repr__(self):
+        return '<OutboxEmail {0}: {1} to {2}>'.format(
+            self.object_id,
+            self.subject,
+            self.recipients
+        )
@@ -0,0 +1,57 @@
+# coding: utf-8
+"""Database model for a place in the release-time purchase queue."""
+
+from __future__ import unicode_literals
+
+import datetime
+
+from eisitirio.database import db
+
+DB = db.DB
+
+class QueueEntry(DB.Model):
+    """Model for a place in the release-time purchase queue.
+
+    Places are handed out in the order of the autoincrementing object_id, so
+    concurrent arrivals are ordered by the database rather than the app. Each
+    entry records the release it was made for (identified by when the queue
+    opened), so places are only counted among entries for the same release.
+    """
+    __tablename__ = 'queue_entry'
+
+    joined = DB.Column(
+        DB.DateTime(),
+        nullable=False
+    )
+    release = DB.Column(
+        DB.DateTime(),
+        nullable=True,
+        index=True
+    )
+
+    user_id = DB.Column(
+        DB.Integer,
+        DB.ForeignKey('user.object_id'),
+        unique=True,
+        nullable=False
+    )
+    user = DB.relationship(
+        'User',
+        backref=DB.backref(
+            'queue_entry',
+            uselist=False
+        ),
+        foreign_keys=[user_id]
+    )
+
+    def __init__(self, user, release):
+        self.user = user
+        self.release = release
+
+        self.joined = datetime.datetime.utcnow()
+
+    def __repr__(self):
+        return '<QueueEntry {0}: {1}>'.format(
+            self.object_id,
+            self.user.full_name
+        )
@@ -1,5 +1,10 @@
 # coding: utf-8
-"""Database model for representing a statistic in a timeseries."""
+"""Database model for representing a statistic in a timeseries.
+
+Statistics are recorded every 20 minutes, and older ones are downsampled into
+coarser resolutions so that the number kept for a season stays small (see
+eisitirio.helpers.statistic_rollup).
+"""
 
 from __future__ import unicode_literals
 
@@ -20,9 +25,15 @@ STATISTIC_GROUPS = collections.OrderedDict([
     ('dietary_requirements', 'Dietary Requirements'),
 ])
 
+# Resolutions a statistic can be stored at, from finest to coarsest
+RESOLUTIONS = ['raw', 'hourly', 'daily']
+
 class Statistic(DB.Model):
     """Model for representing a statistic in a timeseries."""
     __tablename__ = 'statistic'
+    __table_args__ = (
+        DB.Index('ix_statistic_group_timestamp', 'group', 'timestamp'),
+    )
 
     timestamp = DB.Column(
         DB.DateTime,
@@ -40,6 +51,11 @@ class Statistic(DB.Model):
         DB.Integer(),
         nullable=False
     )
+    resolution = DB.Column(
+        DB.Enum(*RESOLUTIONS),
+        default='raw',
+        nullable=False
+    )
 
     def __init__(self, group, statistic, value):
         if group not in STATISTIC_GROUPS:
@@ -51,6 +67,7 @@ class Statistic(DB.Model):
         self.group = group
         self.statistic = statistic
         self.value = value
+        self.resolution = 'raw'
 
     def __repr__(self):
         return '<Statistic {0}/{1}/{2}: {3}>'.format(
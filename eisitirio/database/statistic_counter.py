@@ -0,0 +1,556 @@
+# coding: utf-8
+"""Database model for counters which statistics are snapshotted from.
+
+Recomputing every statistic from the full ticket, user and transaction tables
+each time they're recorded gets slower as the tables grow, so the underlying
+counts are maintained in this table as objects are created, changed and
+deleted, and recording the statistics only has to read them.
+
+Counters are identified by a category and a name. Tickets are counted by type
+and state (one of TICKET_STATES), so that the total, guest and per type
+statistics can all be derived from the same counters.
+
+As with the ticket counters, the counters are kept up to date by a listener on
+the session which adjusts them in the same flush as the objects are written.
+Updates which bypass the session (Query.update, bulk_update_mappings or
+executing an UPDATE directly) must adjust the counters themselves. The
+check_statistics command compares the counters against a full recompute, and
+can rebuild them if they have drifted.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+
+import flask_sqlalchemy
+# from flask.ext import sqlalchemy as flask_sqlalchemy
+import sqlalchemy
+
+from eisitirio.database import db
+from eisitirio.database import dietary_requirements
+from eisitirio.database import ticket
+from eisitirio.database import ticket_transaction_item
+from eisitirio.database import transaction
+from eisitirio.database import user
+from eisitirio.database import waiting
+
+DB = db.DB
+
+TICKET_STATES = ['cancelled', 'unpaid', 'paid', 'collected', 'entered']
+
+DIETARY_REQUIREMENTS = [
+    'vegan',
+    'vegetarian',
+    'pescetarian',
+    'gluten_free',
+    'nut_free',
+    'dairy_free',
+    'egg_free',
+    'seafood_free',
+    'other',
+]
+
+class StatisticCounter(DB.Model):
+    """Model for counters which statistics are snapshotted from."""
+    __tablename__ = 'statistic_counter'
+    __table_args__ = (
+        DB.UniqueConstraint('category', 'name'),
+    )
+
+    category = DB.Column(
+        DB.Unicode(50),
+        nullable=False
+    )
+    name = DB.Column(
+        DB.Unicode(50),
+        nullable=False
+    )
+    value = DB.Column(
+        DB.Integer(),
+        default=0,
+        nullable=False
+    )
+
+    def __init__(self, category, name, value=0):
+        self.category = category
+        self.name = name
+        self.value = value
+
+    def __repr__(self):
+        return '<StatisticCounter {0}/{1}: {2}>'.format(
+            self.category,
+            self.name,
+            self.value
+        )
+
+    @staticmethod
+    def ticket_state_key(ticket_type, cancelled, paid, collected, entered):
+        """Get the key of the counter for tickets of a type in a given state.
+
+        Returns:
+            ((str, str)) the category and name of the counter.
+        """
+        if cancelled:
+            state = 'cancelled'
+        elif not paid:
+            state = 'unpaid'
+        elif not collected:
+            state = 'paid'
+        elif not entered:
+            state = 'collected'
+        else:
+            state = 'entered'
+
+        return 'ticket_states', '{0}/{1}'.format(ticket_type, state)
+
+    @staticmethod
+    def get_values():
+        """Get the value of every counter.
+
+        Returns:
+            (collections.defaultdict((str, str), int)) map from the category
+            and name of each counter to its value. Counters which don't exist
+            map to 0.
+        """
+        return collections.defaultdict(int, (
+            ((category, name), value)
+            for category, name, value in DB.session.query(
+                StatisticCounter.category,
+                StatisticCounter.name,
+                StatisticCounter.value
+            )
+        ))
+
+    @staticmethod
+    def adjust(deltas, session=None):
+        """Atomically adjust several counters.
+
+        The counters are adjusted with a single UPDATE relative to their
+        current values, so concurrent adjustments don't overwrite each other.
+        Only if some of them don't exist yet are those created, with an INSERT
+        which ignores duplicates so concurrent transactions creating the same
+        counter don't fail, and then adjusted. The INSERT isn't run first
+        every time, as on MySQL an ignored duplicate takes a shared lock on the
+        row, and two transactions each holding one and waiting to upgrade it
+        for the UPDATE deadlock.
+
+        Args:
+            deltas: (dict((str, str), int)) map from the category and name of
+                each counter to the change in its value.
+            session: (sqlalchemy.orm.Session or None) session to issue the
+                update in. Defaults to the app's scoped session.
+        """
+        if session is None:
+            session = DB.session
+
+        deltas = {key: delta for key, delta in deltas.iteritems() if delta}
+
+        if not deltas:
+            return
+
+        if _update_counters(session, deltas) == len(deltas):
+            return
+
+        table = StatisticCounter.__table__
+
+        # A locking read, so it sees the same rows as the UPDATE did rather
+        # than the transaction's snapshot
+        existing = set(session.query(
+            StatisticCounter.category,
+            StatisticCounter.name
+        ).filter(
+            sqlalchemy.or_(*[
+                sqlalchemy.and_(
+                    StatisticCounter.category == category,
+                    StatisticCounter.name == name
+                )
+                for category, name in deltas
+            ])
+        ).with_for_update().all())
+
+        missing = {
+            key: delta
+            for key, delta in deltas.iteritems()
+            if key not in existing
+        }
+
+        # Create the counters in a consistent order to avoid deadlocks
+        session.execute(
+            table.insert().prefix_with(
+                'IGNORE',
+                dialect='mysql'
+            ).prefix_with(
+                'OR IGNORE',
+                dialect='sqlite'
+            ),
+            [
+                {'category': category, 'name': name, 'value': 0}
+                for category, name in sorted(missing)
+            ]
+        )
+
+        _update_counters(session, missing)
+
+    @staticmethod
+    def count_all():
+        """Count everything the counters count from scratch.
+
+        Returns:
+            (dict((str, str), int)) map from the category and name of each
+            counter to what its value should be.
+        """
+        counts = collections.defaultdict(int)
+
+        for ticket_type, cancelled, paid, collected, entered, count in (
+                DB.session.query(
+                    ticket.Ticket.ticket_type,
+                    ticket.Ticket.cancelled,
+                    ticket.Ticket.paid,
+                    ticket.Ticket.barcode != None, # pylint: disable=singleton-comparison
+                    ticket.Ticket.entered,
+                    sqlalchemy.func.count(ticket.Ticket.object_id)
+                ).group_by(
+                    ticket.Ticket.ticket_type,
+                    ticket.Ticket.cancelled,
+                    ticket.Ticket.paid,
+                    ticket.Ticket.barcode != None, # pylint: disable=singleton-comparison
+                    ticket.Ticket.entered
+                )
+        ):
+            counts[StatisticCounter.ticket_state_key(
+                ticket_type,
+                cancelled,
+                paid,
+                collected,
+                entered
+            )] += count
+
+        for college_id, count in DB.session.query(
+                user.User.college_id,
+                sqlalchemy.func.count(user.User.object_id)
+        ).group_by(
+            user.User.college_id
+        ):
+            counts['college_users', unicode(college_id)] = count
+
+        for payment_method, count in DB.session.query(
+                transaction.Transaction.payment_method,
+                sqlalchemy.func.count(
+                    ticket_transaction_item.TicketTransactionItem.object_id
+                )
+        ).select_from(
+            ticket_transaction_item.TicketTransactionItem
+        ).join(
+            ticket_transaction_item.TicketTransactionItem.transaction
+        ).filter(
+            transaction.Transaction.paid == True # pylint: disable=singleton-comparison
+        ).group_by(
+            transaction.Transaction.payment_method
+        ):
+            counts['paid_ticket_items', payment_method] = count
+
+        for entry in waiting.Waiting.query:
+            for key, delta in _waiting_counts(
+                    {'waiting_for': entry.waiting_for}
+            ).iteritems():
+                counts[key] += delta
+
+        for requirements in dietary_requirements.DietaryRequirements.query:
+            for key, delta in _dietary_requirements_counts({
+                    attribute: getattr(requirements, attribute)
+                    for attribute in DIETARY_REQUIREMENTS
+            }).iteritems():
+                counts[key] += delta
+
+        return {key: int(count) for key, count in counts.iteritems()}
+
+    @staticmethod
+    def rebuild():
+        """Rebuild the counters from scratch.
+
+        Returns:
+            (dict((str, str), (int, int))) map from the category and name of
+            each counter which was wrong to its previous and correct values.
+        """
+        actual = StatisticCounter.count_all()
+
+        changed = {}
+
+        for counter in StatisticCounter.query.with_for_update().all():
+            value = actual.pop((counter.category, counter.name), 0)
+
+            if counter.value != value:
+                changed[counter.category, counter.name] = (counter.value,
+                                                           value)
+                counter.value = value
+
+        for (category, name), value in actual.iteritems():
+            changed[category, name] = (0, value)
+            DB.session.add(StatisticCounter(category, name, value))
+
+        DB.session.commit()
+
+        return changed
+
+def _update_counters(session, deltas):
+    """Adjust the existing counters in |deltas| with a relative UPDATE.
+
+    Returns:
+        (int) the number of counters which exist.
+    """
+    table = StatisticCounter.__table__
+
+    matches = {
+        key: sqlalchemy.and_(
+            table.c.category == key[0],
+            table.c.name == key[1]
+        )
+        for key in deltas
+    }
+
+    # The MySQL dialect counts matched rather than changed rows
+    return session.execute(
+        table.update().where(
+            sqlalchemy.or_(*matches.values())
+        ).values(
+            value=table.c.value + sqlalchemy.case(
+                [
+                    (matches[key], delta)
+                    for key, delta in deltas.iteritems()
+                ],
+                else_=0
+            )
+        )
+    ).rowcount
+
+def _load_previous_value(*_):
+    """No-op attribute listener, see below."""
+    pass
+
+WATCHED_ATTRIBUTES = collections.OrderedDict([
+    (ticket.Ticket, ['ticket_type', 'cancelled', 'paid', 'barcode', 'entered']),
+    (user.User, ['college']),
+    (waiting.Waiting, ['waiting_for']),
+    (dietary_requirements.DietaryRequirements, DIETARY_REQUIREMENTS),
+])
+
+# As for the ticket counters, make SQLAlchemy load the previous value of each
+# attribute counted by before it's changed, so it can be taken off the count.
+for _model, _attributes in WATCHED_ATTRIBUTES.iteritems():
+    for _attribute in _attributes:
+        sqlalchemy.event.listen(getattr(_model, _attribute), 'set',
+                                _load_previous_value, active_history=True)
+
+sqlalchemy.event.listen(transaction.Transaction.paid, 'set',
+                        _load_previous_value, active_history=True)
+
+def _get_state(instance, attributes, use_history):
+    """Get the values of some attributes of an instance.
+
+    Args:
+        instance: (DB.Model) the instance.
+        attributes: (list(str)) the names of the attributes.
+        use_history: (bool) whether to get the values as they were loaded from
+            the database rather than the current values.
+
+    Returns:
+        (dict(str, object)) map from attribute name to value.
+    """
+    state = {}
+
+    for attribute in attributes:
+        history = sqlalchemy.orm.attributes.get_history(instance, attribute)
+
+        if use_history and (history.deleted or history.unchanged):
+            value = (history.deleted or history.unchanged)[0]
+        elif not use_history and (history.added or history.unchanged):
+            value = (history.added or history.unchanged)[0]
+        else:
+            value = getattr(instance, attribute)
+
+        state[attribute] = value
+
+    return state
+
+def _is_changed(instance, attributes=None):
+    """Check whether any of the attributes counted of an instance have changed.
+
+    Doesn't load any attributes which haven't been loaded already.
+    """
+    if attributes is None:
+        attributes = next(
+            (
+                attributes
+                for model, attributes in WATCHED_ATTRIBUTES.iteritems()
+                if isinstance(instance, model)
+            ),
+            []
+        )
+
+    return any(
+        sqlalchemy.orm.attributes.get_history(
+            instance,
+            attribute,
+            passive=sqlalchemy.orm.attributes.PASSIVE_NO_INITIALIZE
+        ).has_changes()
+        for attribute in attributes
+    )
+
+def _ticket_counts(state):
+    """Get what a ticket in a given state counts towards."""
+    return {
+        StatisticCounter.ticket_state_key(
+            state['ticket_type'],
+            state['cancelled'],
+            state['paid'],
+            state['barcode'] is not None,
+            state['entered']
+        ): 1
+    }
+
+def _user_counts(state):
+    """Get what a user in a given state counts towards."""
+    college = state['college']
+
+    if college is None:
+        return {}
+
+    return {('college_users', unicode(college.object_id)): 1}
+
+def _waiting_counts(state):
+    """Get what a waiting list entry in a given state counts towards."""
+    return {
+        ('waiting', 'users'): 1,
+        ('waiting', 'tickets'): state['waiting_for'] or 0,
+    }
+
+def _dietary_requirements_counts(state):
+    """Get what a set of dietary requirements in a given state counts towards.
+
+    Vegans aren't also counted as vegetarian or pescetarian, and vegetarians
+    aren't also counted as pescetarian.
+    """
+    counts = {}
+
+    if state['vegan']:
+        counts['dietary_requirements', 'vegan'] = 1
+    elif state['vegetarian']:
+        counts['dietary_requirements', 'vegetarian'] = 1
+    elif state['pescetarian']:
+        counts['dietary_requirements', 'pescetarian'] = 1
+
+    for attribute in DIETARY_REQUIREMENTS[3:-1]:
+        if state[attribute]:
+            counts['dietary_requirements', attribute] = 1
+
+    if state['other'] is not None:
+        counts['dietary_requirements', 'other'] = 1
+
+    return counts
+
+COUNTS = {
+    ticket.Ticket: _ticket_counts,
+    user.User: _user_counts,
+    waiting.Waiting: _waiting_counts,
+    dietary_requirements.DietaryRequirements: _dietary_requirements_counts,
+}
+
+def _paid_items_counts(session, deltas):
+    """Count ticket transaction items whose transaction has been paid for.
+
+    Items are counted when they're created or deleted according to whether
+    their transaction is paid, and items which already existed are counted
+    when their transaction is marked as paid.
+    """
+    deleted_ids = set(
+        instance.object_id
+        for instance in session.deleted
+        if isinstance(instance, ticket_transaction_item.TicketTransactionItem)
+    )
+
+    for instance in session.new:
+        if (
+                isinstance(
+                    instance,
+                    ticket_transaction_item.TicketTransactionItem
+                ) and
+                instance.transaction is not None and
+                instance.transaction.paid
+        ):
+            deltas[
+                'paid_ticket_items',
+                instance.transaction.payment_method
+            ] += 1
+
+    for instance in session.deleted:
+        if (
+                isinstance(
+                    instance,
+                    ticket_transaction_item.TicketTransactionItem
+                ) and
+                instance.transaction.paid
+        ):
+            deltas[
+                'paid_ticket_items',
+                instance.transaction.payment_method
+            ] -= 1
+
+    for instance in session.dirty:
+        if (
+                not isinstance(instance, transaction.Transaction) or
+                not _is_changed(instance, ['paid'])
+        ):
+            continue
+
+        was_paid = bool(_get_state(instance, ['paid'], True)['paid'])
+
+        if was_paid == bool(instance.paid):
+            continue
+
+        # New items aren't in the database yet, so are counted above
+        with session.no_autoflush:
+            item_ids = [
+                object_id
+                for object_id, in session.query(
+                    ticket_transaction_item.TicketTransactionItem.object_id
+                ).filter(
+                    ticket_transaction_item.TicketTransactionItem
+                    .transaction_id == instance.object_id
+                )
+                if object_id not in deleted_ids
+            ]
+
+        deltas['paid_ticket_items', instance.payment_method] += (
+            len(item_ids) if instance.paid else -len(item_ids)
+        )
+
+@sqlalchemy.event.listens_for(flask_sqlalchemy.SignallingSession,
+                              'before_flush')
+def update_statistic_counters(session, *_):
+    """Adjust the statistic counters for objects about to be written."""
+    deltas = collections.defaultdict(int)
+
+    def count(instance, use_history, sign):
+        """Add or remove what an instance counts towards."""
+        for model, attributes in WATCHED_ATTRIBUTES.iteritems():
+            if isinstance(instance, model):
+                state = _get_state(instance, attributes, use_history)
+
+                for key, delta in COUNTS[model](state).iteritems():
+                    deltas[key] += sign * delta
+
+    for instance in session.new:
+        count(instance, False, 1)
+
+    for instance in session.deleted:
+        count(instance, True, -1)
+
+    for instance in session.dirty:
+        if _is_changed(instance):
+            # If nothing counted has changed, these cancel out
+            count(instance, True, -1)
+            count(instance, False, 1)
+
+    _paid_items_counts(session, deltas)
+
+    StatisticCounter.adjust(deltas, session)
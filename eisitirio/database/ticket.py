@@ -10,6 +10,7 @@ from sqlalchemy.ext import hybrid
 
 from eisitirio import app
 from eisitirio.database import db
+from eisitirio.helpers import request_cache
 from eisitirio.helpers import util
 
 APP = app.APP
@@ -18,6 +19,14 @@ DB = db.DB
 class Ticket(DB.Model):
     """Model for tickets."""
     __tablename__ = 'ticket'
+    __table_args__ = (
+        # Availability counts and statistics filter on type and state
+        DB.Index('ix_ticket_ticket_type_cancelled_paid',
+                 'ticket_type', 'cancelled', 'paid'),
+        # The cron sweep for unpaid tickets past their expiry time
+        DB.Index('ix_ticket_cancelled_paid_expires',
+                 'cancelled', 'paid', 'expires'),
+    )
 
     ticket_type = DB.Column(
         DB.Unicode(50),
@@ -123,7 +132,18 @@ class Ticket(DB.Model):
 
     @property
     def transaction(self):
-        """Get the transaction this ticket was paid for in."""
+        """Get the transaction this ticket was paid for in.
+
+        Kept for the rest of the request, see User.get_tickets.
+        """
+        return request_cache.memoize(
+            ('Ticket.transaction', self.object_id),
+            self._get_transaction,
+            self
+        )
+
+    def _get_transaction(self):
+        """Find the transaction this ticket was paid for in."""
         for transaction_item in self.transaction_items:
             if transaction_item.transaction.paid:
                 return transaction_item.transaction
@@ -201,6 +221,14 @@ class Ticket(DB.Model):
         # TODO
         return Ticket.query.filter(Ticket.cancelled == False).count() # pylint: disable=singleton-comparison
 
+    @staticmethod
+    def csv_export_options():
+        """Get options to load what write_csv_row uses along with the rows."""
+        return [
+            DB.joinedload(Ticket.holder),
+            DB.joinedload(Ticket.owner),
+        ]
+
     @staticmethod
     def write_csv_header(csv_writer):
         """Write the header of a CSV export file."""
@@ -230,12 +258,12 @@ class Ticket(DB.Model):
             'Yes' if self.entered else 'No',
             'Yes' if self.cancelled else 'No',
             self.price_pounds,
-            self.holder.full_name.encode('utf-8') if self.holder is not None else 'N/A',
+            self.holder.full_name if self.holder is not None else 'N/A',
             self.note,
             self.expires.strftime(
                 '%Y-%m-%d %H:%M:%S'
             ) if self.expires is not None else 'N/A',
             self.barcode if self.barcode is not None else 'N/A',
             self.owner_id,
-            self.owner.full_name.encode('utf-8'),
+            self.owner.full_name,
         ])
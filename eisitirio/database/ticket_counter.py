@@ -0,0 +1,274 @@
+# coding: utf-8
+"""Database model for materialised counts of tickets of each type.
+
+Counting the tickets of each type with a query over the whole ticket table is
+too slow to do on every load of the purchase page, so the counts are maintained
+in this table as tickets are created, cancelled and deleted.
+
+The counts are kept up to date by a listener on the session which adjusts them
+in the same flush (and so the same transaction) as the tickets are written.
+Bulk updates issued with Query.update bypass this listener, so after any such
+update (or if the counts are suspected to have drifted) the counts should be
+rebuilt with the rebuild_ticket_counters command.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+
+import flask_sqlalchemy
+# from flask.ext import sqlalchemy as flask_sqlalchemy
+import sqlalchemy
+
+from eisitirio.database import db
+from eisitirio.database import ticket
+
+DB = db.DB
+
+class TicketCounter(DB.Model):
+    """Model for materialised counts of tickets of each type."""
+    __tablename__ = 'ticket_counter'
+
+    ticket_type = DB.Column(
+        DB.Unicode(50),
+        unique=True,
+        nullable=False
+    )
+    active = DB.Column(
+        DB.Integer(),
+        default=0,
+        nullable=False
+    )
+    cancelled = DB.Column(
+        DB.Integer(),
+        default=0,
+        nullable=False
+    )
+
+    def __init__(self, ticket_type, active=0, cancelled=0):
+        self.ticket_type = ticket_type
+        self.active = active
+        self.cancelled = cancelled
+
+    def __repr__(self):
+        return '<TicketCounter {0}: {1} active, {2} cancelled>'.format(
+            self.ticket_type,
+            self.active,
+            self.cancelled
+        )
+
+    @staticmethod
+    def get_active_counts():
+        """Get the number of active tickets of each type.
+
+        Returns:
+            (collections.defaultdict(str, int)) map from ticket type slug to
+            the number of active tickets of that type. Types without a counter
+            map to 0.
+        """
+        return collections.defaultdict(int, DB.session.query(
+            TicketCounter.ticket_type,
+            TicketCounter.active
+        ).all())
+
+    @staticmethod
+    def adjust(ticket_type, active=0, cancelled=0, session=None):
+        """Atomically adjust the counts for a ticket type.
+
+        The counts are adjusted with an UPDATE relative to the current value,
+        so concurrent adjustments don't overwrite each other. Only if there's
+        no counter row yet (rebuild_ticket_counters creates one for every
+        configured type) is it created, with an INSERT which ignores
+        duplicates so concurrent transactions creating the same row don't
+        fail, and the UPDATE run again. The INSERT isn't run first every time,
+        as on MySQL an ignored duplicate takes a shared lock on the row, and
+        two transactions each holding one and waiting to upgrade it for the
+        UPDATE deadlock.
+
+        Args:
+            ticket_type: (str) slug of the ticket type to adjust.
+            active: (int) change in the number of active tickets.
+            cancelled: (int) change in the number of cancelled tickets.
+            session: (sqlalchemy.orm.Session or None) session to issue the
+                update in. Defaults to the app's scoped session.
+        """
+        if session is None:
+            session = DB.session
+
+        update = TicketCounter.__table__.update().where(
+            TicketCounter.ticket_type == ticket_type
+        ).values(
+            active=TicketCounter.active + active,
+            cancelled=TicketCounter.cancelled + cancelled
+        )
+
+        # The MySQL dialect counts matched rather than changed rows, so a
+        # no-op adjustment of an existing row still counts
+        if session.execute(update).rowcount > 0:
+            return
+
+        session.execute(
+            TicketCounter.__table__.insert().prefix_with(
+                'IGNORE',
+                dialect='mysql'
+            ).prefix_with(
+                'OR IGNORE',
+                dialect='sqlite'
+            ).values(
+                ticket_type=ticket_type,
+                active=0,
+                cancelled=0
+            )
+        )
+
+        session.execute(update)
+
+    @staticmethod
+    def lock(ticket_types):
+        """Lock the counters for |ticket_types| until the transaction ends.
+
+        Each counter row is touched with a no-op relative UPDATE (creating the
+        row if it doesn't exist yet) in a consistent order to avoid deadlocks.
+        This takes a row lock on MySQL, and the database write lock on SQLite
+        which doesn't support SELECT ... FOR UPDATE. The rows are then re-read
+        with a locking read, so the counts are current even if an earlier read
+        in the transaction established an older snapshot.
+
+        Args:
+            ticket_types: (list(str)) slugs of the ticket types to lock.
+
+        Returns:
+            (collections.defaultdict(str, int)) map from ticket type slug to
+            the number of active tickets of that type.
+        """
+        ticket_types = sorted(set(ticket_types))
+
+        for ticket_type in ticket_types:
+            TicketCounter.adjust(ticket_type)
+
+        return collections.defaultdict(int, DB.session.query(
+            TicketCounter.ticket_type,
+            TicketCounter.active
+        ).filter(
+            TicketCounter.ticket_type.in_(ticket_types)
+        ).with_for_update().all())
+
+    @staticmethod
+    def rebuild(ticket_types=None):
+        """Rebuild the counts from the ticket table.
+
+        Args:
+            ticket_types: (list(str) or None) slugs of ticket types to create
+                counters for even if there are no tickets of that type yet.
+
+        Returns:
+            (dict(str, (int, int))) map from ticket type slug to the (active,
+            cancelled) counts which were changed, with the previous values.
+        """
+        actual = {
+            ticket_type: (int(active), int(cancelled))
+            for ticket_type, active, cancelled in DB.session.query(
+                ticket.Ticket.ticket_type,
+                sqlalchemy.func.sum(sqlalchemy.case(
+                    [(ticket.Ticket.cancelled == False, 1)], # pylint: disable=singleton-comparison
+                    else_=0
+                )),
+                sqlalchemy.func.sum(sqlalchemy.case(
+                    [(ticket.Ticket.cancelled == True, 1)], # pylint: disable=singleton-comparison
+                    else_=0
+                ))
+            ).group_by(
+                ticket.Ticket.ticket_type
+            )
+        }
+
+        for ticket_type in ticket_types or []:
+            actual.setdefault(ticket_type, (0, 0))
+
+        changed = {}
+
+        for counter in TicketCounter.query.with_for_update().all():
+            active, cancelled = actual.pop(counter.ticket_type, (0, 0))
+
+            if (counter.active, counter.cancelled) != (active, cancelled):
+                changed[counter.ticket_type] = (counter.active,
+                                                counter.cancelled)
+                counter.active = active
+                counter.cancelled = cancelled
+
+        for ticket_type, (active, cancelled) in actual.iteritems():
+            changed[ticket_type] = (0, 0)
+            DB.session.add(TicketCounter(ticket_type, active, cancelled))
+
+        DB.session.commit()
+
+        return changed
+
+def _load_previous_value(*_):
+    """No-op attribute listener, see below."""
+    pass
+
+# Setting an attribute on an expired instance doesn't normally load its previous
+# value, which is needed to know which counter to decrement. Registering a
+# listener with active_history makes SQLAlchemy load it first.
+for _attribute in [ticket.Ticket.ticket_type, ticket.Ticket.cancelled]:
+    sqlalchemy.event.listen(_attribute, 'set', _load_previous_value,
+                            active_history=True)
+
+def _ticket_state(instance, use_history):
+    """Get the (ticket type, cancelled) state of a ticket.
+
+    Args:
+        instance: (ticket.Ticket) the ticket.
+        use_history: (bool) whether to get the state as it was loaded from the
+            database rather than the current state.
+    """
+    state = []
+
+    for attribute in ['ticket_type', 'cancelled']:
+        history = sqlalchemy.orm.attributes.get_history(instance, attribute)
+
+        if use_history and (history.deleted or history.unchanged):
+            value = (history.deleted or history.unchanged)[0]
+        elif not use_history and (history.added or history.unchanged):
+            value = (history.added or history.unchanged)[0]
+        else:
+            value = getattr(instance, attribute)
+
+        state.append(value)
+
+    return state[0], bool(state[1])
+
+@sqlalchemy.event.listens_for(flask_sqlalchemy.SignallingSession,
+                              'before_flush')
+def update_counters(session, *_):
+    """Adjust the ticket counters for tickets about to be written."""
+    deltas = collections.defaultdict(lambda: [0, 0])
+
+    def count(ticket_type, cancelled, delta):
+        """Record a change in the number of tickets in a given state."""
+        deltas[ticket_type][1 if cancelled else 0] += delta
+
+    for instance in session.new:
+        if isinstance(instance, ticket.Ticket):
+            count(instance.ticket_type, instance.cancelled, 1)
+
+    for instance in session.deleted:
+        if isinstance(instance, ticket.Ticket):
+            count(*_ticket_state(instance, True), delta=-1)
+
+    for instance in session.dirty:
+        if (
+                isinstance(instance, ticket.Ticket) and
+                session.is_modified(instance)
+        ):
+            old_state = _ticket_state(instance, True)
+            new_state = _ticket_state(instance, False)
+
+            if old_state != new_state:
+                count(*old_state, delta=-1)
+                count(*new_state, delta=1)
+
+    for ticket_type, (active, cancelled) in deltas.iteritems():
+        if active or cancelled:
+            TicketCounter.adjust(ticket_type, active, cancelled, session)
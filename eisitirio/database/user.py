@@ -12,6 +12,10 @@ from eisitirio.database import battels
 from eisitirio.database import db
 from eisitirio.database import photo as photo_model # pylint: disable=unused-import
 from eisitirio.database import ticket
+from eisitirio.database import ticket_transaction_item
+from eisitirio.database import transaction
+from eisitirio.helpers import reference_data
+from eisitirio.helpers import request_cache
 from eisitirio.helpers import util
 
 DB = db.DB
@@ -19,6 +23,9 @@ APP = app.APP
 
 BCRYPT = bcrypt.Bcrypt(APP)
 
+# Key on flask.g for the admin impersonating the current user
+ACTOR = 'impersonating_actor'
+
 class User(DB.Model):
     """Model for users."""
     __tablename__ = 'user'
@@ -72,7 +79,8 @@ class User(DB.Model):
     )
     secret_key_expiry = DB.Column(
         DB.DateTime(),
-        nullable=True
+        nullable=True,
+        index=True
     )
     verified = DB.Column(
         DB.Boolean,
@@ -256,16 +264,89 @@ class User(DB.Model):
         For future-proofing purposes, the role of the impersonating user is also
         checked.
         """
-        return self.role == 'Admin' or (
-            'actor_id' in flask.session and
-            User.get_by_id(flask.session['actor_id']).role == 'Admin'
-        )
+        if self.role == 'Admin':
+            return True
+
+        actor = User.get_actor()
+
+        return actor is not None and actor.role == 'Admin'
+
+    @staticmethod
+    def get_actor():
+        """Get the admin impersonating the current user, if any.
+
+        The admin is loaded once per request and kept on flask.g, as is_admin
+        is checked by every admin view and many templates.
+
+        Returns:
+            (User or None) the impersonating admin.
+        """
+        if not flask.has_request_context() or 'actor_id' not in flask.session:
+            return None
+
+        actor_id = flask.session['actor_id']
+        cached = flask.g.get(ACTOR)
+
+        # The session changes when impersonation starts or stops
+        if cached is None or cached[0] != actor_id:
+            cached = (actor_id, User.get_by_id(actor_id))
+            setattr(flask.g, ACTOR, cached)
+
+        return cached[1]
 
     @property
     def is_waiting(self):
         """Is the user on the waiting list?"""
         return self.waiting.count() > 0
 
+    def get_tickets(self):
+        """Get the tickets owned by the user, loading them once per request.
+
+        The tickets' holders and their photos are loaded at the same time, as
+        are the transactions the tickets were paid in, as the ticket
+        permissions and the dashboard use them.
+        """
+        return request_cache.memoize(
+            ('User.get_tickets', self.object_id),
+            self._load_tickets,
+            self
+        )
+
+    def _load_tickets(self):
+        """Load the user's tickets and related objects, see get_tickets."""
+        tickets = self.tickets.options(
+            DB.joinedload(ticket.Ticket.holder).joinedload(User.photo)
+        ).all()
+
+        paid_transactions = {}
+
+        if tickets:
+            # Ordered so the first paid transaction for each ticket wins, as in
+            # Ticket.transaction
+            for ticket_id, paid_transaction in DB.session.query(
+                    ticket_transaction_item.TicketTransactionItem.ticket_id,
+                    transaction.Transaction
+            ).join(
+                ticket_transaction_item.TicketTransactionItem.transaction
+            ).filter(
+                ticket_transaction_item.TicketTransactionItem.ticket_id.in_(
+                    [ticket_.object_id for ticket_ in tickets]
+                ),
+                transaction.Transaction.paid == True # pylint: disable=singleton-comparison
+            ).order_by(
+                ticket_transaction_item.TicketTransactionItem.object_id.desc()
+            ):
+                paid_transactions[ticket_id] = paid_transaction
+
+        for ticket_ in tickets:
+            request_cache.store(
+                ('Ticket.transaction', ticket_.object_id),
+                paid_transactions.get(ticket_.object_id),
+                ticket_
+            )
+
+        return tickets
+
     @property
     def active_tickets(self):
         """Get the active tickets owned by the user."""
@@ -343,6 +424,14 @@ class User(DB.Model):
 
         DB.session.commit()
 
+    @staticmethod
+    def csv_export_options():
+        """Get options to load what write_csv_row uses along with the rows."""
+        # College and affiliation names come from the reference data cache
+        return [
+            DB.joinedload(User.battels),
+        ]
+
     @staticmethod
     def write_csv_header(csv_writer):
         """Write the header of a CSV export file."""
@@ -369,7 +458,7 @@ class User(DB.Model):
             self.phone,
             self.note,
             self.role,
-            self.college.name,
-            self.affiliation.name,
+            reference_data.get_college_name(self.college_id),
+            reference_data.get_affiliation_name(self.affiliation_id),
             self.battels.battels_id if self.battels is not None else 'N/A',
         ])
@@ -0,0 +1,417 @@
+# coding: utf-8
+"""Helpers for benchmarking database-heavy code paths.
+
+Provides a context manager which records the wall time and number of SQL
+statements issued by a block of code, routines for pointing the app at a
+scratch database and seeding it with a realistic volume of data, and a local
+stand-in for the SMTP server.
+"""
+
+from __future__ import unicode_literals
+from __future__ import division
+
+import SocketServer
+import datetime
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+
+import sqlalchemy
+
+from eisitirio import app
+from eisitirio.database import affiliation
+from eisitirio.database import college
+from eisitirio.database import db
+from eisitirio.database import models
+
+APP = app.APP
+DB = db.DB
+
+INSERT_CHUNK_SIZE = 5000
+
+class Profile(object):
+    """Context manager recording wall time and SQL statement count.
+
+    Attributes:
+        queries: (int) number of statements sent to the database in the block.
+        elapsed: (float) wall time of the block in seconds.
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.queries = 0
+        self.elapsed = 0.0
+        self._start = None
+
+    def _count(self, *_):
+        """Event listener to count statements as they are executed."""
+        self.queries += 1
+
+    def __enter__(self):
+        if self.engine is None:
+            self.engine = DB.engine
+
+        sqlalchemy.event.listen(self.engine, 'before_cursor_execute',
+                                self._count)
+        self._start = time.time()
+
+        return self
+
+    def __exit__(self, *_):
+        self.elapsed = time.time() - self._start
+        sqlalchemy.event.remove(self.engine, 'before_cursor_execute',
+                                self._count)
+
+    @property
+    def elapsed_ms(self):
+        """Get the wall time of the block in milliseconds."""
+        return self.elapsed * 1000
+
+def percentile(samples, fraction):
+    """Get a percentile of |samples| by the nearest rank method.
+
+    Args:
+        samples: (list(float)) the samples, which need not be sorted.
+        fraction: (float) the percentile to get, between 0 and 1 (e.g. 0.99
+            for the 99th percentile).
+
+    Returns:
+        (float or None) the percentile, or None if there are no samples.
+    """
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+
+    return ordered[max(0, int(math.ceil(fraction * len(ordered))) - 1)]
+
+class _StandInSmtpHandler(SocketServer.StreamRequestHandler):
+    """Handler speaking just enough SMTP for smtplib to send emails."""
+
+    def reply(self, line):
+        """Send a reply line to the client."""
+        self.wfile.write(line + b'\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+
+        time.sleep(server.connect_delay)
+
+        with server.lock:
+            server.connections += 1
+
+        self.reply(b'220 localhost stand-in SMTP server')
+
+        messages = 0
+
+        while True:
+            line = self.rfile.readline()
+
+            if not line:
+                return
+
+            command = line[:4].upper()
+
+            if command == b'QUIT':
+                self.reply(b'221 Bye')
+                return
+            elif command == b'DATA':
+                self.reply(b'354 End data with <CR><LF>.<CR><LF>')
+
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+
+                time.sleep(server.message_delay)
+
+                with server.lock:
+                    server.received += 1
+
+                self.reply(b'250 OK')
+
+                messages += 1
+
+                if messages == server.messages_per_connection:
+                    # Hang up without warning, as a server timing out would
+                    return
+            elif command in (b'HELO', b'EHLO'):
+                self.reply(b'250 localhost')
+            else:
+                # MAIL, RCPT, RSET and NOOP
+                self.reply(b'250 OK')
+
+class StandInSmtpServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """Local SMTP server which accepts emails and counts them.
+
+    Runs in a background thread, with a thread for each connection. Delays can
+    be added to simulate the latency of a real mail server.
+
+    Attributes:
+        port: (int) the port the server is listening on.
+        connections: (int) how many connections have been opened.
+        received: (int) how many emails have been received.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_delay=0.0, message_delay=0.0,
+                 messages_per_connection=None):
+        """Start the server.
+
+        Args:
+            connect_delay: (float) seconds to wait before greeting each new
+                connection, standing in for the TCP, TLS and login round trips.
+            message_delay: (float) seconds to wait before accepting each email.
+            messages_per_connection: (int or None) number of emails after which
+                the server hangs up on the client, or None to never hang up.
+        """
+        SocketServer.TCPServer.__init__(self, ('127.0.0.1', 0),
+                                        _StandInSmtpHandler)
+
+        self.port = self.server_address[1]
+        self.connect_delay = connect_delay
+        self.message_delay = message_delay
+        self.messages_per_connection = messages_per_connection
+
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.received = 0
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def use_for_app(self):
+        """Point the app's SMTP settings at this server."""
+        APP.config['SEND_EMAILS'] = True
+        APP.config['SMTP_HOST'] = '127.0.0.1'
+        APP.config['SMTP_PORT'] = self.port
+        APP.config['SMTP_SSL'] = False
+        APP.config['SMTP_STARTTLS'] = False
+        APP.config['SMTP_LOGIN'] = False
+
+def explain(query):
+    """Get the query plan the database would use for |query|.
+
+    Eager loads are disabled so that the plan only covers the queried table.
+
+    Args:
+        query: (sqlalchemy.orm.Query) the query to explain.
+
+    Returns:
+        (list(sqlalchemy.engine.RowProxy)) the rows returned by EXPLAIN (or
+        EXPLAIN QUERY PLAN on SQLite).
+    """
+    dialect = DB.engine.dialect
+    compiled = query.enable_eagerloads(False).with_labels().statement.compile(
+        dialect=dialect
+    )
+
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    if dialect.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+
+    return DB.session.connection().execute(
+        prefix + unicode(compiled),
+        params
+    ).fetchall()
+
+def indexes_used(plan):
+    """Get the names of the indexes used in a query plan from |explain|.
+
+    Returns an empty list if the plan involves only full table scans.
+    """
+    if DB.engine.dialect.name == 'sqlite':
+        indexes = []
+
+        for row in plan:
+            detail = row['detail']
+
+            if 'USING INTEGER PRIMARY KEY' in detail:
+                indexes.append('PRIMARY')
+            elif ' INDEX ' in detail:
+                indexes.append(detail.split(' INDEX ')[1].split(' ')[0])
+
+        return indexes
+
+    return [row['key'] for row in plan if row['key'] is not None]
+
+def use_scratch_database(database_uri=None):
+    """Point the app at a scratch database and create the schema.
+
+    Must be called before anything else has connected to the database.
+
+    Args:
+        database_uri: (str or None) URI of an empty database to use. If not
+            given, a temporary SQLite file is created.
+
+    Returns:
+        (str or None) path to the temporary SQLite file if one was created, so
+        that it can be removed once the benchmark has finished.
+    """
+    scratch_file = None
+
+    if database_uri is None:
+        handle, scratch_file = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        database_uri = 'sqlite:///{0}'.format(scratch_file)
+
+    APP.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+
+    DB.create_all()
+
+    return scratch_file
+
+def _bulk_insert(table, rows):
+    """Insert |rows| into |table| in chunks using executemany."""
+    for start in xrange(0, len(rows), INSERT_CHUNK_SIZE):
+        DB.session.execute(
+            table.insert(),
+            rows[start:start + INSERT_CHUNK_SIZE]
+        )
+
+def seed_database(num_tickets, seed=0):
+    """Seed a scratch database with users, tickets and associated data.
+
+    Roughly one user is created for every five tickets. Ticket states,
+    payment methods and dietary requirements are randomised (deterministically,
+    based on |seed|) to give a spread of values across every statistic.
+
+    Args:
+        num_tickets: (int) how many tickets to create.
+        seed: (int) seed for the random number generator.
+    """
+    rand = random.Random(seed)
+    now = datetime.datetime.utcnow()
+
+    colleges = college.get_static()
+    affiliations = affiliation.get_static()
+    DB.session.add_all(colleges)
+    DB.session.add_all(affiliations)
+    DB.session.flush()
+
+    num_users = max(1, num_tickets // 5)
+
+    _bulk_insert(models.User.__table__, [
+        {
+            'object_id': user_id,
+            'email': 'user{0}@example.com'.format(user_id),
+            'password_hash': b'x' * 60,
+            'forenames': 'User',
+            'surname': '{0:06d}'.format(user_id),
+            'phone': '01234567890',
+            'phone_verified': True,
+            'verified': True,
+            'deleted': False,
+            'role': 'User',
+            'college_id': rand.choice(colleges).object_id,
+            'affiliation_id': rand.choice(affiliations).object_id,
+        }
+        for user_id in xrange(1, num_users + 1)
+    ])
+
+    _bulk_insert(models.DietaryRequirements.__table__, [
+        {
+            'user_id': user_id,
+            'pescetarian': rand.random() < 0.05,
+            'vegetarian': rand.random() < 0.1,
+            'vegan': rand.random() < 0.03,
+            'gluten_free': rand.random() < 0.02,
+            'nut_free': rand.random() < 0.02,
+            'dairy_free': rand.random() < 0.02,
+            'egg_free': rand.random() < 0.01,
+            'seafood_free': rand.random() < 0.01,
+            'other': 'Other' if rand.random() < 0.01 else None,
+        }
+        for user_id in xrange(1, num_users + 1)
+        if rand.random() < 0.5
+    ])
+
+    _bulk_insert(models.Waiting.__table__, [
+        {
+            'user_id': user_id,
+            'waiting_for': rand.randint(1, 4),
+            'waiting_since': now,
+        }
+        for user_id in xrange(1, num_users + 1)
+        if rand.random() < 0.02
+    ])
+
+    ticket_types = APP.config['TICKET_TYPES']
+    payment_methods = ['Battels', 'Card', 'Free', 'Dummy']
+
+    # Separate generator, so assigning holders doesn't perturb the other random
+    # values
+    holder_rand = random.Random(seed)
+    holders = range(1, num_users + 1)
+    holder_rand.shuffle(holders)
+
+    tickets = []
+    transactions = []
+    transaction_items = []
+    ticket_transaction_items = []
+
+    for ticket_id in xrange(1, num_tickets + 1):
+        ticket_type = rand.choice(ticket_types)
+        cancelled = rand.random() < 0.1
+        paid = rand.random() < 0.8
+        collected = paid and rand.random() < 0.5
+
+        tickets.append({
+            'object_id': ticket_id,
+            'ticket_type': ticket_type.slug,
+            'paid': paid,
+            'entered': collected and rand.random() < 0.3,
+            'cancelled': cancelled,
+            'price_': ticket_type.price,
+            'expires': None if paid else now,
+            'barcode': (
+                'B{0:019d}'.format(ticket_id) if collected else None
+            ),
+            'claims_made': 0,
+            'owner_id': rand.randint(1, num_users),
+            'holder_id': (
+                holders.pop()
+                if holders and not cancelled and holder_rand.random() < 0.1
+                else None
+            ),
+        })
+
+        if paid:
+            transactions.append({
+                'object_id': ticket_id,
+                'payment_method': rand.choice(payment_methods),
+                'paid': True,
+                'created': now,
+                'user_id': tickets[-1]['owner_id'],
+            })
+            transaction_items.append({
+                'object_id': ticket_id,
+                'item_type': 'Ticket',
+                'transaction_id': ticket_id,
+            })
+            ticket_transaction_items.append({
+                'object_id': ticket_id,
+                'is_refund': False,
+                'ticket_id': ticket_id,
+            })
+
+    _bulk_insert(models.Ticket.__table__, tickets)
+    _bulk_insert(models.Transaction.__table__, transactions)
+    _bulk_insert(models.TransactionItem.__table__, transaction_items)
+    _bulk_insert(models.TicketTransactionItem.__table__,
+                 ticket_transaction_items)
+
+    DB.session.commit()
+
+    # The bulk inserts bypass the session, so the counters must be rebuilt
+    models.TicketCounter.rebuild()
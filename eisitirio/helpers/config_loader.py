@@ -0,0 +1,80 @@
+# coding: utf-8
+"""Helper for loading the deployment config file once per process.
+
+The WSGI wrapper is told which config file to use through the request environ,
+so the file can't be loaded when the process starts. Rather than executing the
+file for every request, it is loaded on the first request and only loaded again
+if its modification time changes, or if a reload has been requested (e.g. by a
+signal handler).
+"""
+
+from __future__ import unicode_literals
+
+import os
+import threading
+
+class ConfigLoader(object):
+    """Loads a config file into an app's config, reloading it when it changes.
+
+    Attributes:
+        app: (flask.Flask) the app to load the config into.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+        self._path = None
+        self._mtime = None
+        self._reload_requested = False
+        self._lock = threading.Lock()
+
+    def request_reload(self, *_):
+        """Load the config file again on the next request.
+
+        Takes (and ignores) any arguments, so it can be used directly as a
+        signal handler.
+        """
+        self._reload_requested = True
+
+    def _is_current(self, path, mtime):
+        """Check whether |path| was the last file loaded, and is unchanged."""
+        return (
+            not self._reload_requested and
+            path == self._path and
+            mtime == self._mtime
+        )
+
+    def load(self, filename):
+        """Make sure the config file has been loaded.
+
+        Args:
+            filename: (str) the config file, absolute or relative to the app's
+                root path as for flask.Config.from_pyfile.
+
+        Returns:
+            (bool) whether the config has been loaded.
+        """
+        path = os.path.join(self.app.root_path, filename)
+
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return False
+
+        if self._is_current(path, mtime):
+            return True
+
+        with self._lock:
+            # Another thread may have loaded it while we waited for the lock
+            if self._is_current(path, mtime):
+                return True
+
+            self._reload_requested = False
+
+            if not self.app.config.from_pyfile(path):
+                return False
+
+            self._path = path
+            self._mtime = mtime
+
+        return True
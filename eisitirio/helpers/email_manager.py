@@ -8,11 +8,86 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
 import atexit
+import bisect
+import collections
+import contextlib
 import smtplib
 import socket
+import threading
+import time
 
 import jinja2
 
+from eisitirio.database import db
+from eisitirio.database import models
+
+DB = db.DB
+
+class DeliveryError(Exception):
+    """Raised when the SMTP server rejects an email.
+
+    Attributes:
+        permanent: (bool) whether the rejection is permanent, so that the email
+            shouldn't be retried.
+    """
+
+    def __init__(self, error, permanent):
+        super(DeliveryError, self).__init__(error)
+
+        self.permanent = permanent
+
+class LatencyHistogram(object):
+    """Histogram of how long emails took to send or queue, by template.
+
+    Kept in memory, so only covers the emails handled by the current process.
+    """
+
+    # Upper bounds of the buckets in milliseconds, with a final bucket for
+    # anything slower
+    BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = collections.defaultdict(
+            lambda: [0] * (len(self.BUCKETS_MS) + 1)
+        )
+
+    @contextlib.contextmanager
+    def measure(self, template, mode):
+        """Record how long the block takes against |template| and |mode|."""
+        start = time.time()
+
+        try:
+            yield
+        finally:
+            self.record(template, mode, time.time() - start)
+
+    def record(self, template, mode, seconds):
+        """Record a single timing.
+
+        Args:
+            template: (str) the template the email was rendered from.
+            mode: (str) how the email was handled, 'sent' or 'queued'.
+            seconds: (float) how long it took.
+        """
+        bucket = bisect.bisect_left(self.BUCKETS_MS, seconds * 1000)
+
+        with self.lock:
+            self.counts[(template, mode)][bucket] += 1
+
+    def get_rows(self):
+        """Get the histogram for display.
+
+        Returns:
+            (list((str, str, int, list(int)))) for each template and mode, the
+            total number of emails and the count in each bucket.
+        """
+        with self.lock:
+            return [
+                (template, mode, sum(counts), list(counts))
+                for (template, mode), counts in sorted(self.counts.iteritems())
+            ]
+
 class EmailManager(object):
     """Helper for sending emails.
 
@@ -30,21 +105,25 @@ class EmailManager(object):
 
         self.jinjaenv = None
 
+        self.latency = LatencyHistogram()
+
         atexit.register(self.shutdown)
 
-    def smtp_connect(self):
-        """Open the connection to the SMTP server."""
-        if self.smtp_open():
-            return True
+    def open_connection(self):
+        """Open a new connection to the SMTP server.
 
+        Returns:
+            (smtplib.SMTP or None) the connection, or None if it could not be
+            opened.
+        """
         try:
             if self.app.config['SMTP_SSL']:
-                self.smtp = smtplib.SMTP_SSL(self.app.config['SMTP_HOST'],
-                                             self.app.config['SMTP_PORT'])
+                smtp = smtplib.SMTP_SSL(self.app.config['SMTP_HOST'],
+                                        self.app.config['SMTP_PORT'])
             else:
-                self.smtp = smtplib.SMTP(self.app.config['SMTP_HOST'],
-                                         self.app.config['SMTP_PORT'])
-        except socket.error as error:
+                smtp = smtplib.SMTP(self.app.config['SMTP_HOST'],
+                                    self.app.config['SMTP_PORT'])
+        except (socket.error, smtplib.SMTPException) as error:
             self.log(
                 'error',
                 'Could not connect to SMTP server at {0}: {1}'.format(
@@ -52,11 +131,11 @@ class EmailManager(object):
                     error
                 )
             )
-            return False
+            return None
 
         if self.app.config['SMTP_STARTTLS']:
             try:
-                self.smtp.starttls()
+                smtp.starttls()
             except smtplib.SMTPHeloError as error:
                 self.log(
                     'error',
@@ -68,7 +147,7 @@ class EmailManager(object):
                         error
                     )
                 )
-                return False
+                return None
             except smtplib.SMTPException as error:
                 self.log(
                     'error',
@@ -80,12 +159,12 @@ class EmailManager(object):
                         error
                     )
                 )
-                return False
+                return None
 
         if self.app.config['SMTP_LOGIN']:
             try:
-                self.smtp.login(self.app.config['SMTP_USER'],
-                                self.app.config['SMTP_PASSWORD'])
+                smtp.login(self.app.config['SMTP_USER'],
+                           self.app.config['SMTP_PASSWORD'])
             except smtplib.SMTPHeloError as error:
                 self.log(
                     'error',
@@ -97,7 +176,7 @@ class EmailManager(object):
                         error
                     )
                 )
-                return False
+                return None
             except smtplib.SMTPAuthenticationError as error:
                 self.log(
                     'error',
@@ -109,7 +188,7 @@ class EmailManager(object):
                         error
                     )
                 )
-                return False
+                return None
             except smtplib.SMTPException as error:
                 self.log(
                     'error',
@@ -121,21 +200,9 @@ class EmailManager(object):
                         error
                     )
                 )
-                return False
-
-        return True
+                return None
 
-    def smtp_open(self):
-        """Check if the cached connection to the SMTP server is valid."""
-        if self.smtp is None:
-            return False
-
-        try:
-            status = self.smtp.noop()[0]
-        except smtplib.SMTPServerDisconnected:
-            status = -1
-
-        return True if status == 250 else False
+        return smtp
 
     def get_template(self, template):
         """Load a jinja template object.
@@ -157,8 +224,10 @@ class EmailManager(object):
 
         return self.jinjaenv.get_template(template)
 
-    def send_image_html(self, recipient, subject, template, image_bytes, **kwargs):
-        """Send an email based on an html template and allow embedded images.
+    def compose_image_html(self, recipient, subject, template, image_bytes,
+                           **kwargs):
+        """Compose an email based on an html template with an embedded image.
+
         Args:
             recipient: (str) the email address of the recipient
             subject: (str) the subject line of the email to be sent
@@ -168,6 +237,9 @@ class EmailManager(object):
             kwargs: if this contains an element under the |email_from| key, this
                 is used as the sender of the email. Otherwise, all elements are
                 passed to the template rendering as template parameters.
+
+        Returns:
+            (MIMEMultipart) the composed email.
         """
 
         # Set up the MIME stuff so that we can send the images
@@ -187,10 +259,19 @@ class EmailManager(object):
         message['Subject'] = '[{0}] {1}'.format(self.app.config['BALL_NAME'],
                                                 subject)
 
-        return self.send_message(message)
+        return message
 
-    def send_template(self, recipient, subject, template, **kwargs):
-        """Send an email based on a template.
+    def send_image_html(self, recipient, subject, template, image_bytes,
+                        **kwargs):
+        """Send an email based on an html template with an embedded image.
+
+        Arguments are as for compose_image_html.
+        """
+        self.send_message(self.compose_image_html(recipient, subject, template,
+                                                  image_bytes, **kwargs))
+
+    def compose_template(self, recipient, subject, template, **kwargs):
+        """Compose an email based on a template.
 
         Args:
             recipient: (str) the email address of the recipient
@@ -200,6 +281,9 @@ class EmailManager(object):
             kwargs: if this contains an element under the |email_from| key, this
                 is used as the sender of the email. Otherwise, all elements are
                 passed to the template rendering as template parameters.
+
+        Returns:
+            (text.MIMEText) the composed email.
         """
         template = self.get_template(template)
 
@@ -213,18 +297,43 @@ class EmailManager(object):
             for key in self.app.config['TEMPLATE_CONFIG_KEYS']
         }
 
-        self.send_text(
+        return self.compose_text(
             recipient,
             subject,
             template.render(**kwargs),
             email_from
         )
 
-    def send_text(self, recipient, subject, message_text, email_from=None):
-        """Send an text email.
+    def send_template(self, recipient, subject, template, **kwargs):
+        """Send an email based on a template straight away.
+
+        Blocks until the email has been sent, so should only be used outside of
+        web requests. Arguments are as for compose_template.
+        """
+        with self.latency.measure(template, 'sent'):
+            self.send_message(self.compose_template(recipient, subject,
+                                                    template, **kwargs))
+
+    def queue_template(self, recipient, subject, template, commit=False,
+                       **kwargs):
+        """Add an email based on a template to the outbox.
 
-        Composes the email into a text.MIMEText object and passes it to the
-        email sending routine.
+        Returns without waiting for the SMTP server, so should be used in web
+        requests. Other arguments are as for compose_template.
+
+        Args:
+            commit: (bool) whether to commit the session after adding the email.
+                By default, the email is only sent once the caller commits, so
+                it's added in the same transaction as the change it is about.
+        """
+        with self.latency.measure(template, 'queued'):
+            self.queue_message(
+                self.compose_template(recipient, subject, template, **kwargs),
+                commit
+            )
+
+    def compose_text(self, recipient, subject, message_text, email_from=None):
+        """Compose a text email into a text.MIMEText object.
 
         Args:
             recipient: (str) the email address of the recipient
@@ -233,6 +342,9 @@ class EmailManager(object):
             email_from: (str or None) the reported sender of the email. If this
                 is none, the default value from the application configuration is
                 used.
+
+        Returns:
+            (text.MIMEText) the composed email.
         """
         if email_from is None:
             email_from = self.app.config['EMAIL_FROM']
@@ -248,7 +360,15 @@ class EmailManager(object):
         message['From'] = email_from
         message['To'] = recipient
 
-        self.send_message(message)
+        return message
+
+    def send_text(self, recipient, subject, message_text, email_from=None):
+        """Send an text email straight away.
+
+        Arguments are as for compose_text.
+        """
+        self.send_message(self.compose_text(recipient, subject, message_text,
+                                            email_from))
 
     def send_message(self, message):
         """Send a marked up email via SMTP.
@@ -266,13 +386,108 @@ class EmailManager(object):
             )
             return
 
-        if not self.smtp_connect():
+        self.smtp, _, _ = self.send_over(self.smtp,
+                                         message['From'],
+                                         message.get_all('To'),
+                                         message['Subject'],
+                                         message.as_string())
+
+    def send_over(self, connection, sender, recipients, subject,
+                  message_string):
+        """Send a serialised email, reusing a connection where possible.
+
+        Opens a new connection if |connection| is None, and reconnects and
+        tries once more if the server has dropped it.
+
+        Args:
+            connection: (smtplib.SMTP or None) an open connection to reuse.
+            sender: (str) the envelope sender of the email.
+            recipients: (list(str)) the envelope recipients of the email.
+            subject: (str) the subject of the email, for logging.
+            message_string: (str) the serialised email.
+
+        Returns:
+            (smtplib.SMTP or None, str or None, bool) the connection to use for
+            the next email, the error if the email wasn't sent, and whether the
+            error is permanent so that the email shouldn't be retried.
+        """
+        error = 'Could not connect to SMTP server'
+
+        for _ in xrange(2):
+            if connection is None:
+                connection = self.open_connection()
+
+            if connection is None:
+                break
+
+            try:
+                self.deliver(connection, sender, recipients, subject,
+                             message_string)
+                return connection, None, False
+            except DeliveryError as delivery_error:
+                # Already logged by deliver
+                return (connection, unicode(delivery_error),
+                        delivery_error.permanent)
+            except (smtplib.SMTPServerDisconnected, socket.error) as lost:
+                self.log(
+                    'warning',
+                    'Lost connection to SMTP server at {0}: {1}'.format(
+                        self.app.config['SMTP_HOST'],
+                        lost
+                    )
+                )
+                error = 'Lost connection to SMTP server: {0}'.format(lost)
+                connection = None
+
+        return connection, error, False
+
+    @staticmethod
+    def close_connection(connection):
+        """Close a connection opened by open_connection, ignoring errors."""
+        if connection is not None:
+            try:
+                connection.quit()
+            except (smtplib.SMTPException, socket.error):
+                pass
+
+    def queue_message(self, message, commit=False):
+        """Add a marked up email to the outbox to be sent by the worker.
+
+        Args:
+            message: (text.MIMEText) A formatted email message.
+            commit: (bool) whether to commit the session after adding the email.
+                By default, the email is only sent once the caller commits.
+        """
+        if not self.app.config['SEND_EMAILS']:
+            self.log(
+                'info',
+                'Email not queued per application policy'
+            )
             return
 
+        DB.session.add(models.OutboxEmail(message))
+
+        if commit:
+            DB.session.commit()
+
+    def deliver(self, connection, sender, recipients, subject,
+                message_string):
+        """Send a serialised email over an open SMTP connection.
+
+        Args:
+            connection: (smtplib.SMTP) an open connection to the SMTP server.
+            sender: (str) the envelope sender of the email.
+            recipients: (list(str)) the envelope recipients of the email.
+            subject: (str) the subject of the email, for logging.
+            message_string: (str) the serialised email.
+
+        Raises:
+            DeliveryError: if the server rejected the email, after logging it.
+            smtplib.SMTPServerDisconnected, socket.error: if the connection to
+                the server was lost, in which case it should be discarded.
+        """
         try:
-            self.smtp.sendmail(message['From'],
-                               message.get_all('To'),
-                               message.as_string())
+            connection.sendmail(sender, recipients, message_string)
         except smtplib.SMTPRecipientsRefused as error:
             self.log(
                 'error',
@@ -282,10 +497,11 @@ class EmailManager(object):
                 ).format(
                     self.app.config['SMTP_HOST'],
                     error.recipients,
-                    message['Subject']
+                    subject
                 )
             )
-        except smtplib.SMTPHeloError as _:
+            raise DeliveryError(error, True)
+        except smtplib.SMTPHeloError as error:
             self.log(
                 'error',
                 (
@@ -293,10 +509,11 @@ class EmailManager(object):
                     'message with subject {1}'
                 ).format(
                     self.app.config['SMTP_HOST'],
-                    message['Subject']
+                    subject
                 )
             )
-        except smtplib.SMTPSenderRefused as _:
+            raise DeliveryError(error, False)
+        except smtplib.SMTPSenderRefused as error:
             self.log(
                 'error',
                 (
@@ -304,10 +521,11 @@ class EmailManager(object):
                     'message with subject {2}'
                 ).format(
                     self.app.config['SMTP_HOST'],
-                    message['From'],
-                    message['Subject']
+                    sender,
+                    subject
                 )
             )
+            raise DeliveryError(error, error.smtp_code >= 500)
         except smtplib.SMTPDataError as error:
             self.log(
                 'error',
@@ -318,11 +536,12 @@ class EmailManager(object):
                     self.app.config['SMTP_HOST'],
                     error.smtp_code,
                     error.smtp_error,
-                    message['Subject']
+                    subject
                 )
             )
+            raise DeliveryError(error, error.smtp_code >= 500)
 
     def shutdown(self):
         """Close connection to the SMTP server when the program terminates."""
-        if self.smtp_open():
-            self.smtp.quit()
+        self.close_connection(self.smtp)
+        self.smtp = None
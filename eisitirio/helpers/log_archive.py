@@ -0,0 +1,279 @@
+# coding: utf-8
+"""Helper for moving old log entries out of the database into archive files.
+
+Archived entries are written as one line of JSON each to a gzipped file per
+month, along with the IDs of the tickets they relate to. Files are only ever
+appended to, with each batch written as a separate gzip member, so archiving
+can be run repeatedly and safely stopped at any point. If it stops between
+writing a batch and deleting it from the database, the batch is written again
+next time, so entries are deduplicated by ID when they're read back.
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+import gzip
+import json
+import os
+import re
+
+import sqlalchemy
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+
+APP = app.APP
+DB = db.DB
+
+BATCH_SIZE = 5000
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+ARCHIVE_FILE_PATTERN = re.compile(r'^log-(\d{4}-\d{2})\.jsonl\.gz$')
+
+class ArchivedLog(object):
+    """A log entry read back from an archive file.
+
+    Has the same attributes as a models.Log where they make sense, except that
+    related objects are only referred to by ID.
+    """
+
+    def __init__(self, row):
+        self.object_id = row['object_id']
+        self.timestamp = datetime.datetime.strptime(row['timestamp'],
+                                                    TIMESTAMP_FORMAT)
+        self.ip_address = row['ip_address']
+        self.action = row['action']
+        self.actor_id = row['actor_id']
+        self.user_id = row['user_id']
+        self.transaction_id = row['transaction_id']
+        self.purchase_group_id = row['purchase_group_id']
+        self.admin_fee_id = row['admin_fee_id']
+        self.ticket_ids = row['ticket_ids']
+
+def get_archive_directory():
+    """Get the directory archive files are kept in."""
+    return APP.config.get(
+        'LOG_ARCHIVE_DIRECTORY',
+        os.path.join(APP.root_path, 'log_archive')
+    )
+
+def _get_archive_path(month):
+    """Get the path to the archive file for a month, given as YYYY-MM."""
+    return os.path.join(get_archive_directory(),
+                        'log-{0}.jsonl.gz'.format(month))
+
+def get_archived_months():
+    """Get the months which have archive files, most recent first.
+
+    Returns:
+        (list(str)) the months, as YYYY-MM.
+    """
+    directory = get_archive_directory()
+
+    if not os.path.isdir(directory):
+        return []
+
+    return sorted(
+        (
+            match.group(1)
+            for match in (
+                ARCHIVE_FILE_PATTERN.match(filename)
+                for filename in os.listdir(directory)
+            )
+            if match
+        ),
+        reverse=True
+    )
+
+def _write_batch(rows, ticket_ids):
+    """Append a batch of rows to the archive files for their months.
+
+    Returns:
+        (int) the number of compressed bytes written.
+    """
+    by_month = {}
+
+    for row in rows:
+        entry = dict(row)
+        entry['timestamp'] = row['timestamp'].strftime(TIMESTAMP_FORMAT)
+        entry['ticket_ids'] = ticket_ids.get(row['object_id'], [])
+
+        by_month.setdefault(
+            row['timestamp'].strftime('%Y-%m'),
+            []
+        ).append(json.dumps(entry))
+
+    written = 0
+
+    for month, lines in by_month.iteritems():
+        path = _get_archive_path(month)
+        size_before = os.path.getsize(path) if os.path.exists(path) else 0
+
+        with open(path, 'ab') as raw_file:
+            with gzip.GzipFile(fileobj=raw_file, mode='ab') as archive_file:
+                archive_file.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+
+        written += os.path.getsize(path) - size_before
+
+    return written
+
+def archive_before(cutoff, batch_size=BATCH_SIZE):
+    """Move log entries from before a cutoff into the archive files.
+
+    Each batch is written to the archive files before being deleted from the
+    database.
+
+    Args:
+        cutoff: (datetime.datetime) entries from before this are archived.
+        batch_size: (int) how many entries to archive at once.
+
+    Returns:
+        (generator((int, int))) the number of entries archived and the number
+        of compressed bytes written by each batch.
+    """
+    log_table = models.Log.__table__
+    link_table = models.Log.tickets.property.secondary
+
+    directory = get_archive_directory()
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    while True:
+        rows = DB.session.execute(
+            sqlalchemy.select([log_table]).where(
+                log_table.c.timestamp < cutoff
+            ).order_by(
+                log_table.c.object_id
+            ).limit(batch_size)
+        ).fetchall()
+
+        if not rows:
+            return
+
+        log_ids = [row['object_id'] for row in rows]
+
+        ticket_ids = {}
+
+        for log_id, ticket_id in DB.session.execute(
+                sqlalchemy.select([
+                    link_table.c.log_id,
+                    link_table.c.ticket_id
+                ]).where(
+                    link_table.c.log_id.in_(log_ids)
+                )
+        ):
+            ticket_ids.setdefault(log_id, []).append(ticket_id)
+
+        written = _write_batch(rows, ticket_ids)
+
+        DB.session.execute(
+            link_table.delete().where(link_table.c.log_id.in_(log_ids))
+        )
+        DB.session.execute(
+            log_table.delete().where(log_table.c.object_id.in_(log_ids))
+        )
+        DB.session.commit()
+
+        yield len(rows), written
+
+def read_month(month, user_id=None, ticket_id=None, transaction_id=None,
+               purchase_group_id=None):
+    """Read the archived entries for a month, optionally filtered.
+
+    Args:
+        month: (str) the month, as YYYY-MM.
+        user_id: (int or None) only get entries where this user was the actor
+            or the target.
+        ticket_id: (int or None) only get entries relating to this ticket.
+        transaction_id: (int or None) only get entries relating to this
+            transaction.
+        purchase_group_id: (int or None) only get entries relating to this
+            purchase group.
+
+    Returns:
+        (list(ArchivedLog)) the entries, most recent first, or None if there is
+        no archive for the month.
+    """
+    path = _get_archive_path(month)
+
+    if not ARCHIVE_FILE_PATTERN.match(os.path.basename(path)):
+        return None
+
+    if not os.path.exists(path):
+        return None
+
+    entries = {}
+
+    with gzip.open(path, 'rb') as archive_file:
+        for line in archive_file:
+            row = json.loads(line)
+
+            if user_id is not None and user_id not in (row['actor_id'],
+                                                       row['user_id']):
+                continue
+
+            if ticket_id is not None and ticket_id not in row['ticket_ids']:
+                continue
+
+            if (
+                    transaction_id is not None and
+                    row['transaction_id'] != transaction_id
+            ):
+                continue
+
+            if (
+                    purchase_group_id is not None and
+                    row['purchase_group_id'] != purchase_group_id
+            ):
+                continue
+
+            entries[row['object_id']] = row
+
+    return sorted(
+        (ArchivedLog(row) for row in entries.itervalues()),
+        key=lambda entry: (entry.timestamp, entry.object_id),
+        reverse=True
+    )
+
+def get_table_sizes():
+    """Get the space used by the log tables, including their indexes.
+
+    Only supported on MySQL.
+
+    Returns:
+        (int or None) the size in bytes, or None if it can't be found.
+    """
+    if DB.engine.dialect.name != 'mysql':
+        return None
+
+    return int(DB.session.execute(
+        sqlalchemy.text(
+            'SELECT COALESCE(SUM(data_length + index_length), 0) '
+            'FROM information_schema.tables '
+            'WHERE table_schema = DATABASE() '
+            'AND table_name IN (\'log\', \'log_ticket_link\')'
+        )
+    ).scalar())
+
+def reclaim_space():
+    """Rebuild the log tables so that space freed by archiving is reclaimed.
+
+    Only supported on MySQL, where deleted rows otherwise leave free space in
+    the table's data file rather than shrinking it.
+
+    Returns:
+        (bool) whether the tables were rebuilt.
+    """
+    if DB.engine.dialect.name != 'mysql':
+        return False
+
+    DB.session.execute(sqlalchemy.text('OPTIMIZE TABLE log, log_ticket_link'))
+    DB.session.commit()
+
+    return True
@@ -1,19 +1,116 @@
 # coding: utf-8
-"""Helper class to log events, both for users actions and for system errors."""
+"""Helper class to log events, both for users actions and for system errors.
+
+User actions logged during a request are buffered rather than being added to
+the session one by one, and are written in bulk when the session is next
+committed. Actions logged with commit=True are committed straight away, so
+they're recorded even if the request later fails. Others are written with the
+request's own transaction, and discarded if it's rolled back. Views which
+commit their own changes log with commit=False just before, so the action is
+written in the same commit. This saves loading the actor, and lets actions
+logged together share an insert.
+"""
 
 from __future__ import unicode_literals
 
+import datetime
 import logging
 
 import flask_login as login
 # from flask.ext import login
+import flask_sqlalchemy
+from werkzeug import local
 import flask
+import sqlalchemy
 
 from eisitirio.database import db
 from eisitirio.database import models
 
 DB = db.DB
 
+# Name of the attribute of flask.g holding the events buffered for a request
+EVENT_BUFFER = 'log_event_buffer'
+
+def _get_id(instance):
+    """Get the ID of a model instance without loading it, if it has one yet."""
+    if instance is None:
+        return None
+
+    identity = sqlalchemy.inspect(instance).identity
+
+    return identity[0] if identity is not None else None
+
+@sqlalchemy.event.listens_for(flask_sqlalchemy.SignallingSession,
+                              'before_commit')
+def write_buffered_events(session):
+    """Write events buffered during this request as part of the commit.
+
+    Log entries without tickets are inserted together. Those with tickets are
+    inserted one at a time to get their IDs, and then all of their links to
+    tickets are inserted together.
+    """
+    if not flask.has_app_context():
+        return
+
+    events = flask.g.pop(EVENT_BUFFER, None)
+
+    if not events:
+        return
+
+    # Assign IDs to anything created in this request which was logged
+    session.flush()
+
+    log_table = models.Log.__table__
+    link_table = models.Log.tickets.property.secondary
+
+    rows = []
+    links = []
+
+    for event in events:
+        row = {
+            'timestamp': event['timestamp'],
+            'ip_address': event['ip_address'],
+            'action': event['action'],
+            'actor_id': event['actor_id'],
+            'user_id': _get_id(event['user']),
+            'transaction_id': _get_id(event['transaction']),
+            'purchase_group_id': _get_id(event['purchase_group']),
+            'admin_fee_id': _get_id(event['admin_fee']),
+        }
+
+        if event['tickets']:
+            log_id = session.execute(
+                log_table.insert(),
+                row
+            ).inserted_primary_key[0]
+
+            links.extend(
+                {
+                    'log_id': log_id,
+                    'ticket_id': _get_id(ticket),
+                }
+                for ticket in event['tickets']
+            )
+        else:
+            rows.append(row)
+
+    if rows:
+        session.execute(log_table.insert(), rows)
+
+    if links:
+        session.execute(link_table.insert(), links)
+
+@sqlalchemy.event.listens_for(flask_sqlalchemy.SignallingSession,
+                              'after_rollback')
+def discard_buffered_events(_):
+    """Discard events buffered during this request when it's rolled back.
+
+    Also registered to run when each request finishes, as anything it hasn't
+    committed by then is discarded.
+    """
+    if flask.has_app_context():
+        flask.g.pop(EVENT_BUFFER, None)
+
 class LogManager(object):
     """Helper to log events, both for users actions and for system errors.
 
@@ -42,6 +139,8 @@ class LogManager(object):
         self.main = logging.getLogger('main')
         self.purchase = logging.getLogger('purchase')
 
+        app.teardown_request(discard_buffered_events)
+
     def init_app(self, app):
         """Add this instance to the app."""
         app.logger = self
@@ -82,6 +181,10 @@ class LogManager(object):
         Creates a log entry in the database which can be found through the admin
         interface.
 
+        During a request, the entry is buffered and written along with the next
+        commit, which is made straight away if |commit| is True. Otherwise, it
+        is added to the session and committed if |commit| is True.
+
         Args:
             message: (str) The message to be logged
             tickets: (list(models.Ticket) or None) tickets the action affected
@@ -89,13 +192,15 @@ class LogManager(object):
             transaction: (models.Transaction or None) transaction this action
                 affected
         """
-        actor = None
+        actor_id = None
 
         if in_app:
             if 'actor_id' in flask.session:
-                actor = models.User.get_by_id(flask.session['actor_id'])
+                actor_id = flask.session['actor_id']
             elif not login.current_user.is_anonymous:
-                actor = login.current_user
+                actor_id = _get_id(
+                    login.current_user._get_current_object() # pylint: disable=protected-access
+                )
 
             ip_address = flask.request.remote_addr.decode()
         else:
@@ -103,14 +208,44 @@ class LogManager(object):
 
         if isinstance(user, login.AnonymousUserMixin):
             user = None
+        elif isinstance(user, local.LocalProxy):
+            # Passed login.current_user
+            user = user._get_current_object() # pylint: disable=protected-access
 
         if tickets is None:
             tickets = []
 
+        if flask.has_request_context():
+            # Add anything new to the session, as adding the entry would have
+            for instance in [user, transaction, purchase_group,
+                             admin_fee] + list(tickets):
+                if (
+                        instance is not None and
+                        sqlalchemy.inspect(instance).transient
+                ):
+                    DB.session.add(instance)
+
+            flask.g.setdefault(EVENT_BUFFER, []).append({
+                'timestamp': datetime.datetime.utcnow(),
+                'ip_address': ip_address,
+                'action': message,
+                'actor_id': actor_id,
+                'user': user,
+                'tickets': list(tickets),
+                'transaction': transaction,
+                'purchase_group': purchase_group,
+                'admin_fee': admin_fee,
+            })
+
+            if commit:
+                DB.session.commit()
+
+            return
+
         entry = models.Log(
             ip_address,
             message,
-            actor,
+            None,
             user,
             tickets,
             transaction,
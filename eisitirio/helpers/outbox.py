@@ -0,0 +1,241 @@
+# coding: utf-8
+"""Helper to send the emails waiting in the outbox.
+
+Emails are sent over a small pool of SMTP connections, one per sending thread,
+which are reused for as long as the server keeps them open and only reopened
+after the server disconnects. Emails which fail to send for a temporary reason
+are retried later with an exponentially increasing delay. The database is only
+touched from the calling thread, with the results of each batch recorded in
+bulk.
+"""
+
+from __future__ import unicode_literals
+from __future__ import division
+
+import Queue
+import collections
+import datetime
+import threading
+import time
+
+from eisitirio.database import db
+from eisitirio.database import models
+
+DB = db.DB
+
+BATCH_SIZE = 200
+MAX_ATTEMPTS = 8
+RETRY_DELAY = datetime.timedelta(minutes=1)
+MAX_RETRY_DELAY = datetime.timedelta(hours=6)
+
+OutboxStats = collections.namedtuple('OutboxStats',
+                                     ['sent', 'retrying', 'failed', 'elapsed'])
+
+def get_retry_delay(attempts):
+    """Get how long to wait before retrying an email.
+
+    Args:
+        attempts: (int) how many times sending the email has failed.
+
+    Returns:
+        (datetime.timedelta) the delay before the next attempt.
+    """
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+class OutboxWorker(object):
+    """Helper for sending the emails in the outbox over pooled connections."""
+
+    def __init__(self, manager, num_connections=4):
+        """Initialise the worker.
+
+        Args:
+            manager: (email_manager.EmailManager) the email manager to open
+                connections and send emails with.
+            num_connections: (int) how many SMTP connections to send over in
+                parallel.
+        """
+        self.manager = manager
+        self.num_connections = num_connections
+
+    def _send_all(self, work, results):
+        """Send emails from |work| over a single reused connection.
+
+        Runs in a sending thread until it receives None, putting a tuple of the
+        email's ID, error message (or None) and whether the error is permanent
+        into |results| for each email. A result is put for every email, even
+        if sending it raises an unexpected exception, as drain waits for them.
+        """
+        connection = None
+
+        while True:
+            email = work.get()
+
+            if email is None:
+                break
+
+            try:
+                connection, error, permanent = self.manager.send_over(
+                    connection,
+                    email.sender,
+                    email.recipients.split(','),
+                    email.subject,
+                    email.message
+                )
+            except Exception as err: # pylint: disable=broad-except
+                # The connection may be in an unknown state, so start afresh
+                self.manager.close_connection(connection)
+                connection = None
+                error, permanent = unicode(err) or repr(err), False
+
+            results.put((email.object_id, error, permanent))
+
+        self.manager.close_connection(connection)
+
+    def _record(self, batch, results, now):
+        """Record the results of sending a batch of emails.
+
+        Args:
+            batch: (list) the emails in the batch.
+            results: (list) tuples of email ID, error and whether the error is
+                permanent, as produced by _send_all.
+            now: (datetime.datetime) the time the batch was sent.
+
+        Returns:
+            (int, int, int) the numbers of emails sent, to be retried and given
+            up on.
+        """
+        attempts = {email.object_id: email.attempts + 1 for email in batch}
+
+        sent = []
+        retrying = collections.defaultdict(list)
+        failed = []
+
+        for object_id, error, permanent in results:
+            if error is None:
+                sent.append(object_id)
+            elif permanent or attempts[object_id] >= MAX_ATTEMPTS:
+                failed.append((object_id, error))
+            else:
+                retrying[attempts[object_id]].append((object_id, error))
+
+        outbox = models.OutboxEmail.__table__
+
+        if sent:
+            DB.session.execute(
+                outbox.update().where(
+                    outbox.c.object_id.in_(sent)
+                ).values(
+                    pending=False,
+                    sent=now,
+                    attempts=outbox.c.attempts + 1
+                )
+            )
+
+        for email_attempts, emails in retrying.iteritems():
+            next_attempt = now + get_retry_delay(email_attempts)
+
+            for object_id, error in emails:
+                DB.session.execute(
+                    outbox.update().where(
+                        outbox.c.object_id == object_id
+                    ).values(
+                        attempts=email_attempts,
+                        next_attempt=next_attempt,
+                        last_error=error[:255]
+                    )
+                )
+
+        for object_id, error in failed:
+            DB.session.execute(
+                outbox.update().where(
+                    outbox.c.object_id == object_id
+                ).values(
+                    pending=False,
+                    attempts=attempts[object_id],
+                    last_error=error[:255]
+                )
+            )
+
+        DB.session.commit()
+
+        return (
+            len(sent),
+            sum(len(emails) for emails in retrying.itervalues()),
+            len(failed)
+        )
+
+    def drain(self, limit=None):
+        """Send all pending emails which are due.
+
+        Args:
+            limit: (int or None) the maximum number of emails to attempt to
+                send, or None for no limit.
+
+        Returns:
+            (OutboxStats) how many emails were sent, are to be retried and were
+            given up on, and how long it took in seconds.
+        """
+        start = time.time()
+
+        work = Queue.Queue()
+        results = Queue.Queue()
+
+        threads = [
+            threading.Thread(target=self._send_all, args=(work, results))
+            for _ in xrange(self.num_connections)
+        ]
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        totals = [0, 0, 0]
+
+        try:
+            while limit is None or sum(totals) < limit:
+                now = datetime.datetime.utcnow()
+
+                batch_size = BATCH_SIZE
+
+                if limit is not None:
+                    batch_size = min(batch_size, limit - sum(totals))
+
+                # Plain rows rather than instances, as they are passed to the
+                # sending threads
+                batch = DB.session.query(
+                    models.OutboxEmail.object_id,
+                    models.OutboxEmail.attempts,
+                    models.OutboxEmail.sender,
+                    models.OutboxEmail.recipients,
+                    models.OutboxEmail.subject,
+                    models.OutboxEmail.message
+                ).filter(
+                    models.OutboxEmail.pending == True # pylint: disable=singleton-comparison
+                ).filter(
+                    models.OutboxEmail.next_attempt <= now
+                ).order_by(
+                    models.OutboxEmail.next_attempt,
+                    models.OutboxEmail.object_id
+                ).limit(batch_size).all()
+
+                if not batch:
+                    break
+
+                for email in batch:
+                    work.put(email)
+
+                batch_results = [results.get() for _ in batch]
+
+                for index, count in enumerate(
+                        self._record(batch, batch_results, now)
+                ):
+                    totals[index] += count
+        finally:
+            for _ in threads:
+                work.put(None)
+
+            for thread in threads:
+                thread.join()
+
+        return OutboxStats(totals[0], totals[1], totals[2],
+                           time.time() - start)
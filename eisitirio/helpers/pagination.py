@@ -0,0 +1,288 @@
+# coding: utf-8
+"""Helper for paging through query results by keyset rather than by offset.
+
+Paging with OFFSET makes the database read and discard every row before the
+page, so later pages get slower the further they are from the start, and
+counting the total number of rows means reading every matching row as well.
+Keyset pagination instead filters on the sort key of the last row of the
+previous page, which the database can seek to using an index, so every page
+costs the same.
+
+The sort key must be unique, so it should end in the object's ID. Pages are
+identified by an opaque cursor, which is safe to use in URLs.
+"""
+
+from __future__ import unicode_literals
+
+import base64
+import datetime
+import json
+
+import sqlalchemy
+
+from eisitirio.database import db
+
+DB = db.DB
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# Totals are only counted up to this many rows, so that counting stays cheap
+APPROXIMATE_TOTAL_LIMIT = 1000
+
+class KeysetPage(object):
+    """A page of results from a query paged by keyset.
+
+    Has the same attributes as Flask-SQLAlchemy's Pagination object where they
+    make sense, so that templates can use either.
+
+    Attributes:
+        items: (list) the results on this page.
+        per_page: (int) the maximum number of results on a page.
+        has_prev: (bool) whether there is a page before this one.
+        has_next: (bool) whether there is a page after this one.
+        prev_cursor: (str or None) cursor for the previous page.
+        next_cursor: (str or None) cursor for the next page.
+        total: (int or None) the number of results in total, or None if it
+            wasn't requested. Totals above APPROXIMATE_TOTAL_LIMIT aren't
+            counted exactly.
+        total_is_exact: (bool) whether the total is exact, or a lower bound.
+    """
+
+    def __init__(self, items, per_page, prev_cursor, next_cursor, total=None,
+                 total_is_exact=True):
+        self.items = items
+        self.per_page = per_page
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.total = total
+        self.total_is_exact = total_is_exact
+
+    @property
+    def has_prev(self):
+        """Whether there is a page before this one."""
+        return self.prev_cursor is not None
+
+    @property
+    def has_next(self):
+        """Whether there is a page after this one."""
+        return self.next_cursor is not None
+
+def _encode_value(value):
+    """Convert a key value to something which can be stored as JSON."""
+    if isinstance(value, datetime.datetime):
+        return value.strftime(TIMESTAMP_FORMAT)
+
+    return value
+
+def _decode_value(column, value):
+    """Convert a key value from a cursor back to the column's type."""
+    if value is not None and isinstance(column.type, sqlalchemy.DateTime):
+        return datetime.datetime.strptime(value, TIMESTAMP_FORMAT)
+
+    return value
+
+def make_cursor(columns, item, forwards):
+    """Make a cursor for the page either side of an item.
+
+    Args:
+        columns: (list(InstrumentedAttribute)) the columns of the sort key.
+        item: (object) the first or last item on the current page.
+        forwards: (bool) whether the cursor is for the page after |item|, as
+            opposed to the page before it.
+
+    Returns:
+        (str) the cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps([
+        forwards,
+        [_encode_value(getattr(item, column.key)) for column in columns]
+    ]))
+
+def parse_cursor(columns, cursor):
+    """Parse a cursor from make_cursor.
+
+    Args:
+        columns: (list(InstrumentedAttribute)) the columns of the sort key.
+        cursor: (str) the cursor.
+
+    Returns:
+        (bool, list) whether the cursor is for the page after the key, and the
+        values of the key, or (True, None) if the cursor is invalid.
+    """
+    try:
+        forwards, values = json.loads(base64.urlsafe_b64decode(
+            cursor.encode('ascii')
+        ))
+
+        if len(values) != len(columns):
+            return True, None
+
+        return bool(forwards), [
+            _decode_value(column, value)
+            for column, value in zip(columns, values)
+        ]
+    except (TypeError, ValueError):
+        return True, None
+
+def _beyond(columns, values, descending):
+    """Get a filter for rows strictly beyond |values| in the sort order."""
+    column, value = columns[0], values[0]
+
+    if descending:
+        beyond = column < value
+    else:
+        beyond = column > value
+
+    if len(columns) == 1:
+        return beyond
+
+    return sqlalchemy.or_(
+        beyond,
+        sqlalchemy.and_(
+            column == value,
+            _beyond(columns[1:], values[1:], descending)
+        )
+    )
+
+def _after(columns, values, descending):
+    """Get a filter for rows after |values| in the sort order.
+
+    Written out as nested comparisons rather than a row comparison, as not
+    every database supports those. The comparisons are ANDed with a bound on
+    the first column, which is redundant but lets the database seek to the
+    start of the page using an index on that column.
+    """
+    if len(columns) == 1:
+        return _beyond(columns, values, descending)
+
+    if descending:
+        bound = columns[0] <= values[0]
+    else:
+        bound = columns[0] >= values[0]
+
+    return sqlalchemy.and_(bound, _beyond(columns, values, descending))
+
+def count_approximately(query, limit=APPROXIMATE_TOTAL_LIMIT):
+    """Count the results of a query, stopping once there are |limit| of them.
+
+    Returns:
+        (int, bool) the number of results counted, and whether it's exact.
+    """
+    counted = DB.session.query(sqlalchemy.func.count()).select_from(
+        query.order_by(None).limit(limit + 1).subquery()
+    ).scalar()
+
+    return min(counted, limit), counted <= limit
+
+def paginate(query, columns, cursor=None, per_page=10, descending=False,
+             with_total=False):
+    """Get a page of results from a query, paging by keyset.
+
+    Args:
+        query: (sqlalchemy.orm.Query) the query to page through. Any ordering
+            it has is replaced by |columns|.
+        columns: (list(InstrumentedAttribute)) the columns to sort by, which
+            must together be unique, such as [Log.timestamp, Log.object_id].
+        cursor: (str or None) cursor from a previous page, or None for the
+            first page.
+        per_page: (int) the maximum number of results on a page.
+        descending: (bool) whether to sort in descending order.
+        with_total: (bool) whether to count the total number of results (up to
+            APPROXIMATE_TOTAL_LIMIT).
+
+    Returns:
+        (KeysetPage) the page of results.
+    """
+    forwards, values = True, None
+
+    if cursor is not None:
+        forwards, values = parse_cursor(columns, cursor)
+
+    # Going backwards, fetch the rows before the cursor in reverse order
+    fetch_descending = descending == forwards
+
+    page_query = query.order_by(None).order_by(*[
+        column.desc() if fetch_descending else column.asc()
+        for column in columns
+    ])
+
+    if values is not None:
+        page_query = page_query.filter(
+            _after(columns, values, fetch_descending)
+        )
+
+    items = page_query.limit(per_page + 1).all()
+
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if not forwards:
+        items.reverse()
+
+    prev_cursor = None
+    next_cursor = None
+
+    if items:
+        if (has_more if not forwards else values is not None):
+            prev_cursor = make_cursor(columns, items[0], False)
+
+        if (has_more if forwards else values is not None):
+            next_cursor = make_cursor(columns, items[-1], True)
+
+    total = None
+    total_is_exact = True
+
+    if with_total:
+        total, total_is_exact = count_approximately(query)
+
+    return KeysetPage(items, per_page, prev_cursor, next_cursor, total,
+                      total_is_exact)
+
+def iterate(query, columns, per_page=1000, descending=False, key=None):
+    """Iterate over all the results of a query, loading a page at a time.
+
+    Each page is loaded with its own query which seeks past the last result of
+    the previous page, so only one page is held in memory at once, even with
+    database drivers which buffer whole result sets (such as MySQLdb).
+
+    Args:
+        query: (sqlalchemy.orm.Query) the query to iterate over. Any ordering
+            it has is replaced by |columns|.
+        columns: (list(InstrumentedAttribute)) the columns to sort by, which
+            must together be unique, as for paginate.
+        per_page: (int) the number of results to load at once.
+        descending: (bool) whether to sort in descending order.
+        key: (callable or None) function taking a result and returning the
+            values of |columns| for it. Defaults to getting the attributes of
+            the result with the same names as the columns.
+
+    Returns:
+        (generator) the results, in order.
+    """
+    query = query.order_by(None).order_by(*[
+        column.desc() if descending else column.asc()
+        for column in columns
+    ])
+
+    values = None
+
+    while True:
+        page_query = query
+
+        if values is not None:
+            page_query = page_query.filter(
+                _after(columns, values, descending)
+            )
+
+        items = page_query.limit(per_page).all()
+
+        for item in items:
+            yield item
+
+        if len(items) < per_page:
+            return
+
+        if key is not None:
+            values = key(items[-1])
+        else:
+            values = [getattr(items[-1], column.key) for column in columns]
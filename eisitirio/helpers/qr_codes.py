@@ -0,0 +1,258 @@
+# coding: utf-8
+"""Helper functions for rendering and caching ticket QR codes.
+
+A ticket's QR code only depends on its ID and barcode, so each image is
+rendered once and stored on disk under a hash of the two, with the most
+recently used images also kept in memory. The hash is used as the image's
+ETag and in its URL, so browsers can cache it indefinitely. When a ticket's
+barcode changes, the image for the old barcode is removed, and the new
+barcode gives a new hash.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import hashlib
+import io
+import os
+import tempfile
+import threading
+
+import png
+import pyqrcode
+import sqlalchemy
+
+from eisitirio import app
+from eisitirio.database import models
+
+APP = app.APP
+
+QR_SCALE = 20
+QR_QUIET_ZONE = 4
+
+# Number of images to keep in memory in each process
+MEMORY_CACHE_SIZE = 256
+
+_MEMORY_CACHE = collections.OrderedDict()
+_MEMORY_CACHE_LOCK = threading.Lock()
+
+def render_qr(ticket_id, barcode, scale=QR_SCALE):
+    """Render the QR code for a ticket as PNG data.
+
+    Args:
+        ticket_id: (int) the ID of the ticket.
+        barcode: (str) the ticket's barcode.
+        scale: (int) the size of each module of the code in pixels.
+
+    Returns:
+        (bytes) the PNG image.
+    """
+    qrcode_img = pyqrcode.create('{0},{1}'.format(ticket_id, barcode))
+    buffer = io.BytesIO()
+    qrcode_img.png(buffer, scale=scale, quiet_zone=QR_QUIET_ZONE)
+    return buffer.getvalue()
+
+def get_cache_directory():
+    """Get the directory rendered QR codes are kept in."""
+    return APP.config.get(
+        'QR_CACHE_DIRECTORY',
+        os.path.join(APP.root_path, 'qr_cache')
+    )
+
+def get_key(ticket_id, barcode):
+    """Get the key a ticket's QR code is cached under.
+
+    Args:
+        ticket_id: (int) the ID of the ticket.
+        barcode: (str) the ticket's barcode.
+
+    Returns:
+        (str) a hash of the ticket's ID, barcode and the rendering settings.
+    """
+    return hashlib.sha256(
+        '{0},{1},{2},{3}'.format(
+            ticket_id,
+            barcode,
+            QR_SCALE,
+            QR_QUIET_ZONE
+        ).encode('utf-8')
+    ).hexdigest()[:32]
+
+def _get_path(key):
+    """Get the path the QR code with the given key is stored at."""
+    return os.path.join(get_cache_directory(), key[:2], '{0}.png'.format(key))
+
+def _remember(key, image):
+    """Keep an image in the memory cache, dropping the least recently used."""
+    with _MEMORY_CACHE_LOCK:
+        _MEMORY_CACHE[key] = image
+
+        while len(_MEMORY_CACHE) > MEMORY_CACHE_SIZE:
+            _MEMORY_CACHE.popitem(last=False)
+
+def _recall(key):
+    """Get an image from the memory cache, or None if it isn't there."""
+    with _MEMORY_CACHE_LOCK:
+        image = _MEMORY_CACHE.pop(key, None)
+
+        if image is not None:
+            _MEMORY_CACHE[key] = image
+
+        return image
+
+def get_qr(ticket_id, barcode):
+    """Get the QR code for a ticket, rendering it if it isn't cached.
+
+    Args:
+        ticket_id: (int) the ID of the ticket.
+        barcode: (str) the ticket's barcode.
+
+    Returns:
+        (bytes) the PNG image.
+    """
+    key = get_key(ticket_id, barcode)
+
+    image = _recall(key)
+
+    if image is not None:
+        return image
+
+    path = _get_path(key)
+
+    try:
+        with open(path, 'rb') as file_handle:
+            image = file_handle.read()
+    except IOError:
+        image = render_qr(ticket_id, barcode)
+
+        if not os.path.exists(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # Created by another process in the meantime
+                pass
+
+        # Write to a temporary file and move it into place, so another process
+        # or thread never reads a partly written image. Each writer has its own
+        # temporary file, and renaming over an existing image is atomic.
+        handle, temporary_path = tempfile.mkstemp(
+            dir=os.path.dirname(path),
+            suffix='.tmp'
+        )
+
+        with os.fdopen(handle, 'wb') as file_handle:
+            file_handle.write(image)
+
+        os.rename(temporary_path, path)
+
+    _remember(key, image)
+
+    return image
+
+def discard(ticket_id, barcode):
+    """Remove the cached QR code for a ticket's old barcode.
+
+    Args:
+        ticket_id: (int) the ID of the ticket.
+        barcode: (str) the barcode the ticket used to have.
+    """
+    key = get_key(ticket_id, barcode)
+
+    with _MEMORY_CACHE_LOCK:
+        _MEMORY_CACHE.pop(key, None)
+
+    try:
+        os.remove(_get_path(key))
+    except OSError:
+        pass
+
+def read_qr_modules(png_data, scale=QR_SCALE):
+    """Read the modules of a QR code back out of a PNG from render_qr.
+
+    Args:
+        png_data: (bytes) the PNG image.
+        scale: (int) the size of each module of the code in pixels.
+
+    Returns:
+        (list(list(int))) the modules of the code, row by row, with 1 for a dark
+        module and 0 for a light one.
+    """
+    # Read the image in its own format, which is much quicker than converting
+    # it to RGBA
+    width, height, rows, info = png.Reader(bytes=png_data).asDirect()
+
+    rows = list(rows)
+    size = width // scale - 2 * QR_QUIET_ZONE
+    threshold = (2 ** info['bitdepth']) // 2
+
+    if width != height or width % scale != 0 or size <= 0:
+        raise ValueError('Image is {0}x{1}, not a whole number of modules'
+                         .format(width, height))
+
+    def _is_dark(row, column):
+        """Check whether the pixel at the centre of a module is dark."""
+        centre = (
+            (row + QR_QUIET_ZONE) * scale + scale // 2,
+            (column + QR_QUIET_ZONE) * scale + scale // 2
+        )
+
+        # Only the first (grey or red) channel of each pixel is checked
+        pixel = rows[centre[0]][centre[1] * info['planes']]
+
+        return 1 if pixel < threshold else 0
+
+    return [
+        [_is_dark(row, column) for column in xrange(size)]
+        for row in xrange(size)
+    ]
+
+def verify_qr(ticket_id, barcode):
+    """Check that a ticket's QR code is served and reads back correctly.
+
+    The PNG served to the ticket holder by get_qr (from the cache, if it's
+    there) is read back, and its modules are compared with a fresh encoding of
+    the ticket's ID and barcode, so a stale or corrupt cached image is caught.
+    The encoded data must also split back into the same ID and barcode when
+    scanned.
+
+    Args:
+        ticket_id: (int) the ID of the ticket.
+        barcode: (str) the ticket's barcode.
+
+    Returns:
+        (str or None) a description of the problem, or None if the QR code is
+        correct.
+    """
+    data = '{0},{1}'.format(ticket_id, barcode)
+
+    if data.split(',') != [unicode(ticket_id), barcode]:
+        return 'Barcode {0} can\'t be read back from the QR code'.format(
+            barcode
+        )
+
+    try:
+        expected = pyqrcode.create(data).code
+    except ValueError as err:
+        return 'Could not encode QR code: {0}'.format(err)
+
+    try:
+        modules = read_qr_modules(get_qr(ticket_id, barcode))
+    except (png.Error, ValueError) as err:
+        return 'Could not read back served PNG: {0}'.format(err)
+
+    if modules != expected:
+        return 'Served PNG doesn\'t match the QR code for {0}'.format(data)
+
+    return None
+
+@sqlalchemy.event.listens_for(models.Ticket.barcode, 'set',
+                              active_history=True)
+def discard_old_barcode(target, value, oldvalue, _):
+    """Remove a ticket's cached QR code when its barcode is changed."""
+    if (
+            target.object_id is not None and
+            oldvalue and
+            oldvalue is not sqlalchemy.orm.attributes.NO_VALUE and
+            oldvalue != value
+    ):
+        discard(target.object_id, oldvalue)
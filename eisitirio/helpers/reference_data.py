@@ -0,0 +1,150 @@
+# coding: utf-8
+"""Helper for caching reference data in each process.
+
+The lists of colleges and affiliations are shown on several forms, and their
+names are written in exports, but they only change a few times a year. They're
+loaded once per process and kept as plain (object_id, name) tuples, so they can
+be shared between requests without being tied to a database session.
+
+Each load records the version of the reference data it was made at. The
+version is bumped whenever a commit in this process changes a college or
+affiliation, which makes every cached list stale. Other processes pick up
+changes once their copy is older than REFERENCE_DATA_MAX_AGE (5 minutes by
+default).
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import datetime
+import itertools
+import threading
+
+import flask_sqlalchemy
+# from flask.ext import sqlalchemy as flask_sqlalchemy
+import sqlalchemy
+
+from eisitirio import app
+from eisitirio.database import affiliation
+from eisitirio.database import college
+from eisitirio.database import db
+
+APP = app.APP
+DB = db.DB
+
+MODELS = (college.College, affiliation.Affiliation)
+
+# Key in the session's info for whether reference data has been changed
+CHANGED = 'reference_data_changed'
+
+_Reference = collections.namedtuple('Reference', ['object_id', 'name'])
+class Reference(_Reference):
+    """A cached college or affiliation.
+
+    Fields:
+        object_id: (int) the database ID of the college or affiliation.
+        name: (str) its name.
+    """
+
+_CacheEntry = collections.namedtuple('CacheEntry', ['version', 'loaded',
+                                                    'items', 'by_id'])
+
+_CACHE = {}
+_LOCK = threading.Lock()
+_VERSION = [0]
+
+def invalidate():
+    """Mark all cached reference data in this process as stale."""
+    with _LOCK:
+        _VERSION[0] += 1
+
+def _get_entry(model):
+    """Get the cache entry for a model, loading it if it's missing or stale."""
+    now = datetime.datetime.utcnow()
+    max_age = APP.config.get('REFERENCE_DATA_MAX_AGE',
+                             datetime.timedelta(minutes=5))
+
+    entry = _CACHE.get(model)
+
+    if (
+            entry is not None and
+            entry.version == _VERSION[0] and
+            now - entry.loaded < max_age
+    ):
+        return entry
+
+    version = _VERSION[0]
+
+    items = [
+        Reference(object_id, name)
+        for object_id, name in DB.session.query(
+            model.object_id,
+            model.name
+        ).order_by(
+            model.object_id
+        )
+    ]
+
+    entry = _CacheEntry(
+        version=version,
+        loaded=now,
+        items=items,
+        by_id={item.object_id: item for item in items}
+    )
+
+    with _LOCK:
+        _CACHE[model] = entry
+
+    return entry
+
+def get_colleges():
+    """Get all the colleges.
+
+    Returns:
+        (list(Reference)) the colleges, in order of ID.
+    """
+    return _get_entry(college.College).items
+
+def get_affiliations():
+    """Get all the affiliations.
+
+    Returns:
+        (list(Reference)) the affiliations, in order of ID.
+    """
+    return _get_entry(affiliation.Affiliation).items
+
+def get_college_name(college_id):
+    """Get the name of a college from its ID, or None if there isn't one."""
+    item = _get_entry(college.College).by_id.get(college_id)
+
+    return item.name if item is not None else None
+
+def get_affiliation_name(affiliation_id):
+    """Get the name of an affiliation from its ID, or None if there isn't one."""
+    item = _get_entry(affiliation.Affiliation).by_id.get(affiliation_id)
+
+    return item.name if item is not None else None
+
+@sqlalchemy.event.listens_for(flask_sqlalchemy.SignallingSession,
+                              'before_flush')
+def note_changes(session, *_):
+    """Note whether reference data is being changed, to invalidate on commit."""
+    if any(
+            isinstance(instance, MODELS)
+            for instance in itertools.chain(session.new, session.dirty,
+                                            session.deleted)
+    ):
+        session.info[CHANGED] = True
+
+@sqlalchemy.event.listens_for(flask_sqlalchemy.SignallingSession,
+                              'after_commit')
+def invalidate_on_commit(session):
+    """Invalidate the cache if the committed changes included reference data."""
+    if session.info.pop(CHANGED, False):
+        invalidate()
+
+@sqlalchemy.event.listens_for(flask_sqlalchemy.SignallingSession,
+                              'after_rollback')
+def forget_changes(session):
+    """Forget about reference data changes which have been rolled back."""
+    session.info.pop(CHANGED, None)
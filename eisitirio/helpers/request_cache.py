@@ -0,0 +1,112 @@
+# coding: utf-8
+"""Helper for caching values for the rest of a request.
+
+Rendering a page can check the same permissions and possessions, or load the
+same related objects, many times over. Values cached here are kept on flask.g,
+and emptied when the request is torn down (flask.g belongs to the app context,
+which can outlive a request, e.g. with the test client).
+
+The whole cache is also emptied whenever the database session flushes, commits
+or rolls back, or an INSERT, UPDATE or DELETE is executed (e.g. by Query.update
+or DB.session.execute, which bypass the flush), so a cached value never
+outlives the data it was computed from. Changes which haven't been flushed yet
+aren't seen by the listeners, so values depending on objects in a session with
+pending changes aren't cached at all.
+
+Outside a request (e.g. in scripts), nothing is cached.
+"""
+
+from __future__ import unicode_literals
+
+import flask
+import flask_sqlalchemy
+# from flask.ext import sqlalchemy as flask_sqlalchemy
+import sqlalchemy
+
+from eisitirio import app
+
+APP = app.APP
+
+CACHE = 'request_cache'
+
+def _has_pending_changes(session):
+    """Check whether a session has changes which haven't been flushed."""
+    return bool(session.new or session.deleted or session.dirty)
+
+def _can_cache(instance):
+    """Check whether values depending on |instance| can be cached."""
+    if not flask.has_request_context():
+        return False
+
+    session = sqlalchemy.orm.object_session(instance)
+
+    if session is None:
+        return False
+    elif _has_pending_changes(session):
+        clear()
+        return False
+
+    return True
+
+def memoize(key, compute, instance):
+    """Get a value from the cache, computing and storing it if it's missing.
+
+    Args:
+        key: (tuple) key to store the value under. If it isn't hashable, the
+            value is computed without being cached.
+        compute: (function) function taking no arguments to compute the value.
+        instance: (CustomModel) the database object the value depends on. If
+            it isn't in a session, or its session has pending changes, the
+            value is computed without being cached.
+
+    Returns:
+        the cached or computed value.
+    """
+    if not _can_cache(instance):
+        return compute()
+
+    try:
+        return flask.g.setdefault(CACHE, {})[key]
+    except KeyError:
+        pass
+    except TypeError:
+        return compute()
+
+    value = compute()
+
+    # Computing the value may have flushed the session and emptied the cache
+    flask.g.setdefault(CACHE, {})[key] = value
+
+    return value
+
+def store(key, value, instance):
+    """Put a value in the cache, e.g. when loading values for several objects.
+
+    Args:
+        key: (tuple) key to store the value under.
+        value: the value to store.
+        instance: (CustomModel) the database object the value depends on, as
+            for memoize.
+    """
+    if _can_cache(instance):
+        flask.g.setdefault(CACHE, {})[key] = value
+
+@APP.teardown_request
+@sqlalchemy.event.listens_for(flask_sqlalchemy.SignallingSession,
+                              'after_flush')
+@sqlalchemy.event.listens_for(flask_sqlalchemy.SignallingSession,
+                              'after_commit')
+@sqlalchemy.event.listens_for(flask_sqlalchemy.SignallingSession,
+                              'after_rollback')
+def clear(*_):
+    """Empty the cache for the current request."""
+    if flask.has_request_context():
+        flask.g.pop(CACHE, None)
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'after_cursor_execute')
+def clear_after_write(_conn, _cursor, _statement, _parameters, context, _):
+    """Empty the cache after a statement which writes to the database."""
+    if context is not None and (
+            context.isinsert or context.isupdate or context.isdelete
+    ):
+        clear()
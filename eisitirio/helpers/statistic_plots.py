@@ -1,16 +1,33 @@
 # coding: utf-8
-"""Helper function for drawing a graph and displaying it as a view."""
+"""Helper functions for drawing graphs of the recorded statistics.
+
+Graphs are drawn with the object-oriented matplotlib API rather than pyplot, so
+rendering doesn't rely on global state and can be split across a pool of
+processes. The data for each graph is loaded in the calling process, and only
+the plot descriptors are sent to the pool.
+
+Each graph is saved alongside a fingerprint of the statistics it was drawn
+from, so graphs whose statistics haven't changed aren't drawn again.
+"""
 
 from __future__ import unicode_literals
 
 import collections
+import multiprocessing
 import os
+import time
 
 from matplotlib import dates
-from matplotlib import pyplot
+from matplotlib import figure
+from matplotlib.backends import backend_agg
 
 from eisitirio import app
+from eisitirio.database import db
 from eisitirio.database import models
+from eisitirio.helpers import statistic_rollup
+
+APP = app.APP
+DB = db.DB
 
 COLORS = 'rgbcmyk'
 POINTS = '^os*+xDH'
@@ -34,23 +51,77 @@ class PlotDescriptor(_PlotDescriptor):
             in the legend.
     """
 
-def create_plot(group):
-    """Create a plot for a set of statistics.
+def get_graph_filename(group):
+    """Get the path the graph for a statistics group is saved to."""
+    return os.path.join(
+        APP.config['GRAPH_STORAGE_FOLDER'],
+        '{0}.png'.format(group)
+    )
 
-    Retrieves the data from the database and transforms it into a set of plot
-    descriptors, and passes these to |render_plot| to create the graph.
+def _get_fingerprint_filename(group):
+    """Get the path the fingerprint of a group's graph is saved to."""
+    return os.path.join(
+        APP.config['GRAPH_STORAGE_FOLDER'],
+        '{0}.fingerprint'.format(group)
+    )
+
+def get_fingerprint(group):
+    """Get a fingerprint of the recorded statistics in a group.
+
+    Statistics are only ever added or deleted, never changed in place (other
+    than their resolution, which doesn't affect the graph), so the number of
+    statistics and the highest ID change whenever the data to plot does.
 
     Args:
-        group: (str) The statistics group to plot.
+        group: (str) the statistics group.
 
     Returns:
-        a flask response object with the plot as a PNG image file
+        (str) the fingerprint.
     """
-    statistics = models.Statistic.query.filter(
+    count, last_id = DB.session.query(
+        DB.func.count(models.Statistic.object_id),
+        DB.func.max(models.Statistic.object_id)
+    ).filter(
         models.Statistic.group == group
-    ).order_by(
-        models.Statistic.timestamp
-    ).all()
+    ).one()
+
+    return '{0}:{1}'.format(count, last_id)
+
+def _get_saved_fingerprint(group):
+    """Get the fingerprint of the statistics the saved graph was drawn from.
+
+    Returns:
+        (str or None) the fingerprint, or None if the graph hasn't been drawn.
+    """
+    if not os.path.exists(get_graph_filename(group)):
+        return None
+
+    try:
+        with open(_get_fingerprint_filename(group), 'r') as file_handle:
+            return file_handle.read().strip()
+    except IOError:
+        return None
+
+def _save_fingerprint(group, fingerprint):
+    """Record the fingerprint of the statistics a graph was drawn from."""
+    with open(_get_fingerprint_filename(group), 'w') as file_handle:
+        file_handle.write(fingerprint)
+
+def get_plots(group):
+    """Load the statistics for a group and turn them into plot descriptors.
+
+    Args:
+        group: (str) The statistics group to plot.
+
+    Returns:
+        (list(PlotDescriptor), datetime.datetime, datetime.datetime) the plots,
+        and the first and last timestamps to plot, or None if there are no
+        statistics in the group.
+    """
+    statistics = statistic_rollup.get_series(group).all()
+
+    if not statistics:
+        return None
 
     style_index = 0
 
@@ -70,11 +141,7 @@ def create_plot(group):
         plots[statistic.statistic]['datapoints'].append(statistic.value)
         plots[statistic.statistic]['current_value'] = statistic.value
 
-    render_plot(
-        os.path.join(
-            app.APP.config['GRAPH_STORAGE_FOLDER'],
-            '{0}.png'.format(group)
-        ),
+    return (
         [
             PlotDescriptor(
                 timestamps=plot['timestamps'],
@@ -88,11 +155,26 @@ def create_plot(group):
         statistics[-1].timestamp
     )
 
+def create_plot(group):
+    """Create a plot for a set of statistics.
+
+    Retrieves the data from the database and transforms it into a set of plot
+    descriptors, and passes these to |render_plot| to create the graph.
+
+    Args:
+        group: (str) The statistics group to plot.
+    """
+    plots = get_plots(group)
+
+    if plots is not None:
+        render_plot(get_graph_filename(group), *plots)
+
 def render_plot(filename, plots, x_lim_min, x_lim_max):
-    """Render a graph as a view.
+    """Render a graph to a PNG file.
 
     Takes a set of plot descriptors for timeseries, and renders a line graph
-    showing the plots.
+    showing the plots. The graph is written to a temporary file and moved into
+    place, so a partly written graph is never served.
 
     Args:
         filename: (str) Location to save the graph to
@@ -101,11 +183,10 @@ def render_plot(filename, plots, x_lim_min, x_lim_max):
             axis
         x_lim_max: (datetime.datetime) the maximum timestamp to plot on the x
             axis
-
-    Returns:
-        a flask response object with the plot as a PNG image file
     """
-    fig, axes = pyplot.subplots()
+    fig = figure.Figure()
+    backend_agg.FigureCanvasAgg(fig)
+    axes = fig.add_subplot(1, 1, 1)
 
     for plot in plots:
         axes.plot_date(
@@ -127,11 +208,85 @@ def render_plot(filename, plots, x_lim_min, x_lim_max):
     axes.fmt_xdata = dates.DateFormatter('%Y-%m-%d %H:%M:%S')
     fig.autofmt_xdate()
 
-    pyplot.savefig(
-        filename,
+    temporary_filename = '{0}.{1}.tmp'.format(filename, os.getpid())
+
+    fig.savefig(
+        temporary_filename,
         format='png',
         bbox_extra_artists=(legend,),
         bbox_inches='tight',
         facecolor='white'
     )
 
+    os.rename(temporary_filename, filename)
+
+def _render_plot_task(task):
+    """Render a graph in a pool process, see render_plot.
+
+    Returns:
+        (str, float) the group, and the time taken to render its graph in
+        milliseconds.
+    """
+    group, filename, plots, x_lim_min, x_lim_max = task
+
+    start = time.time()
+
+    render_plot(filename, plots, x_lim_min, x_lim_max)
+
+    return group, (time.time() - start) * 1000
+
+def draw_graphs(groups, processes=None):
+    """Draw the graphs for statistics groups whose statistics have changed.
+
+    Args:
+        groups: (list(str)) the statistics groups to draw graphs for.
+        processes: (int or None) number of processes to render graphs with.
+            Defaults to the number of CPUs.
+
+    Returns:
+        (list((str, float or None))) for each group, the time taken to render
+        its graph in milliseconds, or None if it wasn't redrawn.
+    """
+    if not os.path.exists(APP.config['GRAPH_STORAGE_FOLDER']):
+        os.makedirs(APP.config['GRAPH_STORAGE_FOLDER'])
+
+    timings = collections.OrderedDict((group, None) for group in groups)
+    fingerprints = {}
+    tasks = []
+
+    for group in groups:
+        fingerprint = get_fingerprint(group)
+
+        if fingerprint == _get_saved_fingerprint(group):
+            continue
+
+        plots = get_plots(group)
+
+        if plots is None:
+            continue
+
+        fingerprints[group] = fingerprint
+        tasks.append((group, get_graph_filename(group)) + plots)
+
+    if not tasks:
+        return timings.items()
+
+    processes = min(processes or multiprocessing.cpu_count(), len(tasks))
+
+    # Not worth starting a pool to draw one graph
+    if processes == 1:
+        pool = None
+        results = (_render_plot_task(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_render_plot_task, tasks)
+
+    try:
+        for group, elapsed in results:
+            _save_fingerprint(group, fingerprints[group])
+            timings[group] = elapsed
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    return timings.items()
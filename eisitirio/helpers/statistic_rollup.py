@@ -0,0 +1,154 @@
+# coding: utf-8
+"""Helper for downsampling recorded statistics into coarser resolutions.
+
+Statistics are recorded every 20 minutes at the 'raw' resolution. Once they're
+older than STATISTICS_RAW_KEEP (a day by default) they're compacted to one per
+hour, and once older than STATISTICS_HOURLY_KEEP (30 days by default) to one
+per day. Each statistic is a snapshot of a count rather than an amount over
+the period, so compacting keeps the last sample in each hour or day, and
+deletes the rest.
+
+Each resolution covers a separate period of time, so reading every statistic
+in a group gives a single series, with raw detail for the last day and a
+number of points which grows by only one per statistic per day.
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+from eisitirio.database import static
+
+APP = app.APP
+DB = db.DB
+
+# Maximum number of IDs to update or delete in one statement
+CHUNK_SIZE = 1000
+
+def _floor_hour(timestamp):
+    """Get the start of the hour containing |timestamp|."""
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def _floor_day(timestamp):
+    """Get the start of the day containing |timestamp|."""
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def get_tiers():
+    """Get the downsampling steps, from finest to coarsest.
+
+    Returns:
+        (list((str, str, datetime.timedelta, function))) for each step, the
+        resolution to compact from, the resolution to compact to, how long to
+        keep statistics at the finer resolution, and a function to get the
+        start of the coarser period containing a timestamp.
+    """
+    return [
+        (
+            'raw',
+            'hourly',
+            APP.config.get('STATISTICS_RAW_KEEP', datetime.timedelta(days=1)),
+            _floor_hour
+        ),
+        (
+            'hourly',
+            'daily',
+            APP.config.get('STATISTICS_HOURLY_KEEP',
+                           datetime.timedelta(days=30)),
+            _floor_day
+        ),
+    ]
+
+def _in_chunks(ids):
+    """Split a list of IDs into lists of at most CHUNK_SIZE."""
+    for start in xrange(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+def compact(now):
+    """Downsample statistics which are old enough into coarser resolutions.
+
+    Only whole periods are compacted, so a period which is partly within the
+    time to keep the finer resolution is left until all of it is old enough.
+
+    Args:
+        now: (datetime.datetime) the current time.
+
+    Returns:
+        (int, int) the number of statistics kept at a coarser resolution, and
+        the number deleted.
+    """
+    kept = 0
+    deleted = 0
+
+    for finer, coarser, keep, floor in get_tiers():
+        cutoff = floor(now - keep)
+
+        for group in static.STATISTIC_GROUPS:
+            # Ordered by time, so the last sample in each period wins
+            last_samples = {}
+            to_delete = []
+
+            for object_id, statistic, timestamp in DB.session.query(
+                    models.Statistic.object_id,
+                    models.Statistic.statistic,
+                    models.Statistic.timestamp
+            ).filter(
+                models.Statistic.group == group
+            ).filter(
+                models.Statistic.timestamp < cutoff
+            ).filter(
+                models.Statistic.resolution == finer
+            ).order_by(
+                models.Statistic.timestamp,
+                models.Statistic.object_id
+            ):
+                key = (statistic, floor(timestamp))
+
+                if key in last_samples:
+                    to_delete.append(last_samples[key])
+
+                last_samples[key] = object_id
+
+            to_keep = sorted(last_samples.itervalues())
+
+            for chunk in _in_chunks(to_keep):
+                models.Statistic.query.filter(
+                    models.Statistic.object_id.in_(chunk)
+                ).update({'resolution': coarser}, synchronize_session=False)
+
+            for chunk in _in_chunks(to_delete):
+                models.Statistic.query.filter(
+                    models.Statistic.object_id.in_(chunk)
+                ).delete(synchronize_session=False)
+
+            kept += len(to_keep)
+            deleted += len(to_delete)
+
+    DB.session.commit()
+
+    return kept, deleted
+
+def get_series(group):
+    """Get a query for the recorded statistics in a group, at all resolutions.
+
+    Only loads the columns needed to plot or export them, rather than whole
+    objects.
+
+    Args:
+        group: (str) the statistics group.
+
+    Returns:
+        (sqlalchemy.orm.Query) query for the (statistic, timestamp, value) of
+        each recorded statistic, in time order.
+    """
+    return DB.session.query(
+        models.Statistic.statistic,
+        models.Statistic.timestamp,
+        models.Statistic.value
+    ).filter(
+        models.Statistic.group == group
+    ).order_by(
+        models.Statistic.timestamp
+    )
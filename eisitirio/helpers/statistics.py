@@ -1,173 +1,269 @@
 # coding: utf-8
-"""Helper functions for computing statistics."""
+"""Helper functions for computing statistics.
+
+Statistics are normally taken from the statistic counters, which are kept up to
+date as objects change (see eisitirio.database.statistic_counter), by
+get_snapshot. They can also be computed from scratch by get, which is used to
+check the counters.
+
+When computed from scratch, each group of statistics is computed with a single
+query per table, using conditional aggregates (SUM(CASE ...)) or GROUP BY
+rather than issuing a separate COUNT for every bucket.
+"""
 
 from __future__ import unicode_literals
 
 import collections
-import warnings
 
 import sqlalchemy
-from sqlalchemy import exc as sqlalchemy_exceptions
 
 from eisitirio import app
 from eisitirio.database import db
 from eisitirio.database import models
+from eisitirio.database import statistic_counter
 
 APP = app.APP
 DB = db.DB
 
 # pylint: disable=singleton-comparison
 
+PAYMENT_METHODS = collections.OrderedDict([
+    ('Battels', 'Battels'),
+    ('Card', 'Card'),
+    ('Free', 'Free'),
+    ('Unknown', 'Dummy'),
+])
+
+DIETARY_REQUIREMENT_NAMES = [
+    'Vegan',
+    'Vegetarian',
+    'Pescetarian',
+    'Gluten Free',
+    'Nut Free',
+    'Dairy Free',
+    'Egg Free',
+    'Seafood Free',
+    'Other',
+]
+
 def get_revenue():
     """Get statistics about revenue."""
-
-    return collections.OrderedDict([
-        (
-            'Total value of all tickets',
-            _maybe_int(
-                DB.session.query(
-                    sqlalchemy.func.sum(models.Ticket.price_)
-                ).scalar()
-            )
+    ticket_totals = DB.session.query(
+        sqlalchemy.func.sum(models.Ticket.price_),
+        _sum_if(
+            models.Ticket.cancelled == False,
+            models.Ticket.price_
         ),
-        (
-            'Total value of active tickets',
-            _maybe_int(
-                DB.session.query(
-                    sqlalchemy.func.sum(models.Ticket.price_)
-                ).filter(
-                    models.Ticket.cancelled == False
-                ).scalar()
-            )
+        _sum_if(
+            models.Ticket.cancelled == True,
+            models.Ticket.price_
         ),
-        (
-            'Total value of cancelled tickets',
-            _maybe_int(
-                DB.session.query(
-                    sqlalchemy.func.sum(models.Ticket.price_)
-                ).filter(
-                    models.Ticket.cancelled == True
-                ).scalar()
-            )
-        ),
-        (
-            'Total value of paid tickets',
-            _maybe_int(
-                DB.session.query(
-                    sqlalchemy.func.sum(models.Ticket.price_)
-                ).filter(
-                    models.Ticket.paid == True
-                ).filter(
-                    models.Ticket.cancelled == False
-                ).scalar()
-            )
+        _sum_if(
+            sqlalchemy.and_(
+                models.Ticket.paid == True,
+                models.Ticket.cancelled == False
+            ),
+            models.Ticket.price_
         ),
+    ).one()
+
+    eway_totals = DB.session.query(
+        sqlalchemy.func.sum(models.EwayTransaction.charged),
+        sqlalchemy.func.sum(models.EwayTransaction.refunded),
+    ).filter(
+        models.EwayTransaction.completed != None
+    ).one()
+
+    battels_totals = DB.session.query(
+        sqlalchemy.func.sum(models.Battels.michaelmas_charge),
+        sqlalchemy.func.sum(models.Battels.hilary_charge),
+    ).one()
+
+    postage_total = DB.session.query(
+        sqlalchemy.func.sum(models.Postage.price)
+    ).filter(
+        models.Postage.paid == True
+    ).filter(
+        models.Postage.cancelled == False
+    ).scalar()
+
+    return collections.OrderedDict([
+        ('Total value of all tickets', _maybe_int(ticket_totals[0])),
+        ('Total value of active tickets', _maybe_int(ticket_totals[1])),
+        ('Total value of cancelled tickets', _maybe_int(ticket_totals[2])),
+        ('Total value of paid tickets', _maybe_int(ticket_totals[3])),
         (
             'Total eWay charges (payments minus refunds)',
-            _maybe_int(
-                DB.session.query(
-                    sqlalchemy.func.sum(models.EwayTransaction.charged)
-                ).filter(
-                    models.EwayTransaction.completed != None
-                ).scalar()
-            ) - _maybe_int(
-                DB.session.query(
-                    sqlalchemy.func.sum(models.EwayTransaction.refunded)
-                ).filter(
-                    models.EwayTransaction.completed != None
-                ).scalar()
-            )
-        ),
-        (
-            'Total Michaelmas battels charges',
-            _maybe_int(
-                DB.session.query(
-                    sqlalchemy.func.sum(models.Battels.michaelmas_charge)
-                ).scalar()
-            )
-        ),
-        (
-            'Total Hilary battels charges',
-            _maybe_int(
-                DB.session.query(
-                    sqlalchemy.func.sum(models.Battels.hilary_charge)
-                ).scalar()
-            )
-        ),
-        (
-            'Total postage value',
-            _maybe_int(
-                DB.session.query(
-                    sqlalchemy.func.sum(models.Postage.price)
-                ).filter(
-                    models.Postage.paid == True
-                ).filter(
-                    models.Postage.cancelled == False
-                ).scalar()
-            )
+            _maybe_int(eway_totals[0]) - _maybe_int(eway_totals[1])
         ),
+        ('Total Michaelmas battels charges', _maybe_int(battels_totals[0])),
+        ('Total Hilary battels charges', _maybe_int(battels_totals[1])),
+        ('Total postage value', _maybe_int(postage_total)),
     ])
 
 def get(group):
     """Hacky wrapper around each of the _get_<group_name> functions."""
     return globals()['_get_{0}'.format(group)]()
 
-def _get_college_users():
+def get_snapshot(group, counters):
+    """Get the statistics for a group from the statistic counters.
+
+    Gives the same statistics as get, without counting from scratch.
+
+    Args:
+        group: (str) the statistics group.
+        counters: (dict((str, str), int)) the values of the counters, from
+            models.StatisticCounter.get_values.
+
+    Returns:
+        (collections.OrderedDict(str, int)) map from statistic to value.
+    """
+    return globals()['_snapshot_{0}'.format(group)](counters)
+
+def _snapshot_college_users(counters):
     """Get the number of registered users from each college."""
-    return collections.OrderedDict([
+    return collections.OrderedDict(
+        (name, counters['college_users', unicode(object_id)])
+        for object_id, name in DB.session.query(
+            models.College.object_id,
+            models.College.name
+        ).order_by(
+            models.College.object_id
+        )
+    )
+
+def _snapshot_payment_methods(counters):
+    """Get the number of tickets paid for with each payment method."""
+    return collections.OrderedDict(
+        (name, counters['paid_ticket_items', payment_method])
+        for name, payment_method in PAYMENT_METHODS.iteritems()
+    )
+
+def _snapshot_ticket_types(counters):
+    """Get the number of active tickets by type."""
+    return collections.OrderedDict(
         (
-            college.name,
-            models.User.query.filter(
-                models.User.college_id == college.object_id
-            ).count()
+            ticket_type.name,
+            sum(
+                counters['ticket_states', '{0}/{1}'.format(ticket_type.slug,
+                                                           state)]
+                for state in statistic_counter.TICKET_STATES
+                if state != 'cancelled'
+            )
         )
-        for college in models.College.query.all()
+        for ticket_type in APP.config['TICKET_TYPES']
+    )
+
+def _snapshot_total_ticket_sales(counters):
+    """Get the total number of tickets in various states."""
+    return _snapshot_ticket_sales(counters)
+
+def _snapshot_guest_ticket_sales(counters):
+    """Get the total number of guest tickets in various states."""
+    statistics = collections.OrderedDict([
+        ('Available', APP.config['GUEST_TICKETS_AVAILABLE']),
     ])
 
+    statistics.update(
+        _snapshot_ticket_sales(counters, APP.config['GUEST_TYPE_SLUGS'])
+    )
+
+    return statistics
+
+def _snapshot_ticket_sales(counters, ticket_types=None):
+    """Get numbers of tickets in various states, of all or some types."""
+    states = collections.defaultdict(int)
+
+    for (category, name), value in counters.items():
+        if category == 'ticket_states':
+            ticket_type, state = name.rsplit('/', 1)
+
+            if ticket_types is None or ticket_type in ticket_types:
+                states[state] += value
+
+    return collections.OrderedDict([
+        ('Ordered', sum(states.itervalues())),
+        ('Cancelled', states['cancelled']),
+        ('Unpaid', states['unpaid']),
+        ('Paid', states['paid']),
+        ('Collected', states['collected']),
+        ('Entered', states['entered']),
+    ])
+
+def _snapshot_waiting(counters):
+    """Get statistics of number of users/tickets on the waiting list."""
+    return collections.OrderedDict([
+        ('Users Waiting', counters['waiting', 'users']),
+        ('Tickets Waiting', counters['waiting', 'tickets']),
+    ])
+
+def _snapshot_dietary_requirements(counters):
+    """Get statistics of number of users who have dietary requirements."""
+    return collections.OrderedDict(
+        (name, counters['dietary_requirements', requirement])
+        for name, requirement in zip(
+            DIETARY_REQUIREMENT_NAMES,
+            statistic_counter.DIETARY_REQUIREMENTS
+        )
+    )
+
+def _get_college_users():
+    """Get the number of registered users from each college."""
+    return collections.OrderedDict(
+        (name, _maybe_int(count))
+        for name, count in DB.session.query(
+            models.College.name,
+            sqlalchemy.func.count(models.User.object_id)
+        ).outerjoin(
+            models.User,
+            models.User.college_id == models.College.object_id
+        ).group_by(
+            models.College.object_id,
+            models.College.name
+        ).order_by(
+            models.College.object_id
+        )
+    )
+
 def _get_payment_methods():
     """Get the number of tickets paid for with each payment method."""
-    with warnings.catch_warnings():
-        warnings.simplefilter(
-            "ignore",
-            category=sqlalchemy_exceptions.SAWarning
-        )
+    counts = dict(
+        DB.session.query(
+            models.Transaction.payment_method,
+            sqlalchemy.func.count(models.TicketTransactionItem.object_id)
+        ).select_from(
+            models.TicketTransactionItem
+        ).join(
+            models.TicketTransactionItem.transaction
+        ).filter(
+            models.Transaction.paid == True
+        ).group_by(
+            models.Transaction.payment_method
+        ).all()
+    )
 
-        return collections.OrderedDict([
-            (
-                name,
-                models.Ticket.query.join(
-                    models.TicketTransactionItem.query.join(
-                        models.Transaction.query.filter(
-                            models.Transaction.payment_method == payment_method
-                        ).filter(
-                            models.Transaction.paid == True
-                        ).subquery(),
-                        models.TicketTransactionItem.transaction
-                    ).subquery(reduce_columns=True),
-                    models.Ticket.transaction_items
-                ).count()
-            )
-            for name, payment_method in collections.OrderedDict([
-                ('Battels', 'Battels'),
-                ('Card', 'Card'),
-                ('Free', 'Free'),
-                ('Unknown', 'Dummy'),
-            ]).iteritems()
-        ])
+    return collections.OrderedDict(
+        (name, _maybe_int(counts.get(payment_method)))
+        for name, payment_method in PAYMENT_METHODS.iteritems()
+    )
 
 def _get_ticket_types():
     """Get the number of active tickets by type."""
-    return collections.OrderedDict([
-        (
-            ticket_type.name,
-            models.Ticket.query.filter(
-                models.Ticket.ticket_type == ticket_type.slug
-            ).filter(
-                models.Ticket.cancelled == False
-            ).count()
-        )
+    counts = dict(
+        DB.session.query(
+            models.Ticket.ticket_type,
+            sqlalchemy.func.count(models.Ticket.object_id)
+        ).filter(
+            models.Ticket.cancelled == False
+        ).group_by(
+            models.Ticket.ticket_type
+        ).all()
+    )
+
+    return collections.OrderedDict(
+        (ticket_type.name, _maybe_int(counts.get(ticket_type.slug)))
         for ticket_type in APP.config['TICKET_TYPES']
-    ])
+    )
 
 def _get_total_ticket_sales():
     """Get the total number of tickets in various states."""
@@ -192,148 +288,82 @@ def _get_guest_ticket_sales():
     return statistics
 
 def _get_ticket_sales(query):
-    """Get numbers of tickets in various states, based on a filtered query."""
-    return collections.OrderedDict([
-        (
-            'Ordered',
-            query.count(),
-        ),
-        (
-            'Cancelled',
-            query.filter(
-                models.Ticket.cancelled == True
-            ).count(),
-        ),
-        (
-            'Unpaid',
-            query.filter(
-                models.Ticket.cancelled == False
-            ).filter(
-                models.Ticket.paid == False
-            ).count(),
-        ),
-        (
-            'Paid',
-            query.filter(
-                models.Ticket.cancelled == False
-            ).filter(
-                models.Ticket.paid == True
-            ).filter(
-                models.Ticket.collected == False
-            ).count(),
-        ),
-        (
-            'Collected',
-            query.filter(
-                models.Ticket.cancelled == False
-            ).filter(
-                models.Ticket.paid == True
-            ).filter(
-                models.Ticket.collected == True
-            ).filter(
-                models.Ticket.entered == False
-            ).count(),
-        ),
-        (
-            'Entered',
-            query.filter(
-                models.Ticket.cancelled == False
-            ).filter(
-                models.Ticket.paid == True
-            ).filter(
-                models.Ticket.collected == True
-            ).filter(
-                models.Ticket.entered == True
-            ).count(),
-        ),
-    ])
+    """Get numbers of tickets in various states, based on a filtered query.
+
+    All of the states are counted in a single pass over the filtered tickets.
+    """
+    active = models.Ticket.cancelled == False
+    paid = sqlalchemy.and_(active, models.Ticket.paid == True)
+    collected = sqlalchemy.and_(paid, models.Ticket.collected == True)
+
+    counts = query.with_entities(
+        sqlalchemy.func.count(models.Ticket.object_id),
+        _count_if(models.Ticket.cancelled == True),
+        _count_if(sqlalchemy.and_(active, models.Ticket.paid == False)),
+        _count_if(sqlalchemy.and_(paid, models.Ticket.collected == False)),
+        _count_if(sqlalchemy.and_(collected, models.Ticket.entered == False)),
+        _count_if(sqlalchemy.and_(collected, models.Ticket.entered == True)),
+    ).one()
+
+    return collections.OrderedDict(
+        (name, _maybe_int(count))
+        for name, count in zip(
+            ['Ordered', 'Cancelled', 'Unpaid', 'Paid', 'Collected', 'Entered'],
+            counts
+        )
+    )
 
 def _get_waiting():
     """Get statistics of number of users/tickets on the waiting list."""
+    users_waiting, tickets_waiting = DB.session.query(
+        sqlalchemy.func.count(models.Waiting.object_id),
+        sqlalchemy.func.sum(models.Waiting.waiting_for)
+    ).one()
+
     return collections.OrderedDict([
-        (
-            'Users Waiting',
-            models.User.query.join(
-                models.Waiting.query.subquery(),
-                models.User.waiting
-            ).count(),
-        ),
-        (
-            'Tickets Waiting',
-            _maybe_int(
-                DB.session.query(
-                    sqlalchemy.func.sum(
-                        models.Waiting.waiting_for
-                    )
-                ).scalar()
-            ),
-        )
+        ('Users Waiting', _maybe_int(users_waiting)),
+        ('Tickets Waiting', _maybe_int(tickets_waiting)),
     ])
 
 def _get_dietary_requirements():
     """Get statistics of number of users who have dietary requirements."""
-    return collections.OrderedDict([
-        (
-            'Vegan',
-            models.DietaryRequirements.query.filter(
-                models.DietaryRequirements.vegan == True
-            ).count(),
-        ),
-        (
-            'Vegetarian',
-            models.DietaryRequirements.query.filter(
-                models.DietaryRequirements.vegan == False
-            ).filter(
-                models.DietaryRequirements.vegetarian == True
-            ).count(),
-        ),
-        (
-            'Pescetarian',
-            models.DietaryRequirements.query.filter(
-                models.DietaryRequirements.vegan == False
-            ).filter(
-                models.DietaryRequirements.vegetarian == False
-            ).filter(
-                models.DietaryRequirements.pescetarian == True
-            ).count(),
-        ),
-        (
-            'Gluten Free',
-            models.DietaryRequirements.query.filter(
-                models.DietaryRequirements.gluten_free == True
-            ).count(),
-        ),
-        (
-            'Nut Free',
-            models.DietaryRequirements.query.filter(
-                models.DietaryRequirements.nut_free == True
-            ).count(),
-        ),
-        (
-            'Dairy Free',
-            models.DietaryRequirements.query.filter(
-                models.DietaryRequirements.dairy_free == True
-            ).count(),
-        ),
-        (
-            'Egg Free',
-            models.DietaryRequirements.query.filter(
-                models.DietaryRequirements.egg_free == True
-            ).count(),
-        ),
-        (
-            'Seafood Free',
-            models.DietaryRequirements.query.filter(
-                models.DietaryRequirements.seafood_free == True
-            ).count(),
+    requirements = models.DietaryRequirements
+    not_vegan = requirements.vegan == False
+
+    counts = DB.session.query(
+        _count_if(requirements.vegan == True),
+        _count_if(
+            sqlalchemy.and_(not_vegan, requirements.vegetarian == True)
         ),
-        (
-            'Other',
-            models.DietaryRequirements.query.filter(
-                models.DietaryRequirements.other != None
-            ).count(),
+        _count_if(
+            sqlalchemy.and_(
+                not_vegan,
+                requirements.vegetarian == False,
+                requirements.pescetarian == True
+            )
         ),
-    ])
+        _count_if(requirements.gluten_free == True),
+        _count_if(requirements.nut_free == True),
+        _count_if(requirements.dairy_free == True),
+        _count_if(requirements.egg_free == True),
+        _count_if(requirements.seafood_free == True),
+        _count_if(requirements.other != None),
+    ).one()
+
+    return collections.OrderedDict(
+        (name, _maybe_int(count))
+        for name, count in zip(DIETARY_REQUIREMENT_NAMES, counts)
+    )
+
+def _count_if(condition):
+    """Create an aggregate counting the rows which match |condition|."""
+    return _sum_if(condition, 1)
+
+def _sum_if(condition, value):
+    """Create an aggregate summing |value| over rows matching |condition|."""
+    return sqlalchemy.func.sum(
+        sqlalchemy.case([(condition, value)], else_=0)
+    )
 
 def _maybe_int(value):
     """Convert the result of an sqlalchemy scalar to an int."""
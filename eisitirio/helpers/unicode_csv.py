@@ -4,9 +4,17 @@
 import codecs
 import cStringIO
 import csv
+import time
 
+import flask
 import six
 
+# How much of a streamed CSV file to buffer before sending it, in bytes
+CHUNK_SIZE = 64 * 1024
+
+# How many objects to load at once when exporting a query
+BATCH_SIZE = 1000
+
 class UnicodeWriter(object):
     """CSV writer which supports unicode output.
 
@@ -47,3 +55,64 @@ class UnicodeWriter(object):
         """Write multiple rows to the CSV file."""
         for row in rows:
             self.writerow(row)
+
+def iter_csv(items, write_row, write_header=None):
+    """Generate a CSV file in chunks, for streaming as a response.
+
+    Rows are written to a small buffer which is emptied whenever it fills, so
+    only one chunk of the file is held in memory at a time. Pass the results of
+    pagination.iterate as |items| to avoid loading every object at once.
+
+    Args:
+        items: (iterable) the objects to write a row for.
+        write_row: (callable) function taking an item and a UnicodeWriter,
+            which writes the row(s) for the item.
+        write_header: (callable or None) function taking a UnicodeWriter, which
+            writes the header row.
+
+    Returns:
+        (generator(str)) the chunks of the CSV file.
+    """
+    buf = cStringIO.StringIO()
+    writer = UnicodeWriter(buf)
+
+    if write_header is not None:
+        write_header(writer)
+
+    for item in items:
+        write_row(item, writer)
+
+        if buf.tell() >= CHUNK_SIZE:
+            yield buf.getvalue()
+
+            buf.seek(0)
+            buf.truncate()
+
+    yield buf.getvalue()
+
+def csv_response(chunks, filename=None, cache_timeout=0):
+    """Create a response which streams a CSV file to the client.
+
+    Args:
+        chunks: (iterable(str)) the chunks of the file, from iter_csv.
+        filename: (str or None) name to download the file as. If not given, the
+            browser will show the file rather than downloading it.
+        cache_timeout: (int) how long the client may cache the file for, in
+            seconds.
+
+    Returns:
+        (flask.Response) the streaming response.
+    """
+    response = flask.Response(flask.stream_with_context(chunks),
+                              mimetype='text/csv')
+
+    if filename is not None:
+        response.headers['Content-Disposition'] = (
+            'attachment; filename={0}'.format(filename)
+        )
+
+    response.cache_control.public = True
+    response.cache_control.max_age = cache_timeout
+    response.expires = int(time.time() + cache_timeout)
+
+    return response
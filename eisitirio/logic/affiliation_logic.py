@@ -25,10 +25,11 @@ def verify_affiliation(user):
     """
     user.affiliation_verified = True
 
-    APP.email_manager.send_template(
+    APP.email_manager.queue_template(
         user.email,
         'Affiliation Verified - Buy Your Tickets Now!',
         'affiliation_verified.email',
+        commit=False,
         name=user.forenames,
         url=flask.url_for('purchase.purchase_home', _external=True)
     )
@@ -101,7 +102,7 @@ def maybe_verify_affiliation(user):
             DB.session.commit()
             return
 
-        APP.email_manager.send_template(
+        APP.email_manager.queue_template(
             APP.config['TICKETS_EMAIL'],
             'Verify Affiliation',
             'verify_affiliation.email',
@@ -109,6 +110,8 @@ def maybe_verify_affiliation(user):
             url=flask.url_for('admin_users.verify_affiliations',
                               _external=True)
         )
+
+        DB.session.commit()
         flask.flash(
             (
                 'Your affiliation must be verified before you will be '
@@ -35,11 +35,13 @@ def collect_ticket(ticket, barcode):
         return 'Barcode has already been used for a ticket.'
 
     ticket.barcode = barcode
-    DB.session.commit()
 
     APP.log_manager.log_event(
         'Collected',
-        tickets=[ticket]
+        tickets=[ticket],
+        commit=False
     )
 
+    DB.session.commit()
+
     return None
@@ -0,0 +1,279 @@
+# coding: utf-8
+"""Logic for scanning tickets at the door without a round trip per scan.
+
+Each scanner downloads a manifest of every ticket which can be used to enter the
+ball, and validates scans against it locally. Barcodes are only included as
+hashes, so the manifest can't be used to make tickets. Entries are stored on the
+scanner and synced back in batches, and tickets which were used to enter the
+ball more than once (for example at two scanners which were offline at the same
+time) are reported back to the scanner as conflicts.
+
+The manifest is signed with the app's secret key, and scanners must present the
+signature when syncing entries, so only scanners with a recent manifest can mark
+tickets as having entered. The maximum age of a manifest in seconds can be set
+with the DOOR_MANIFEST_MAX_AGE key, and defaults to a day.
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+import hashlib
+
+import itsdangerous
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+
+APP = app.APP
+DB = db.DB
+
+def _get_serializer():
+    """Get the serializer used to sign manifests."""
+    return itsdangerous.URLSafeTimedSerializer(APP.secret_key,
+                                               salt='door-manifest')
+
+def hash_barcode(barcode):
+    """Hash a barcode for inclusion in the manifest.
+
+    Args:
+        barcode: (str) the ticket's barcode.
+
+    Returns:
+        (str) the hex encoded SHA-256 hash of the barcode.
+    """
+    return hashlib.sha256(barcode.encode('utf-8')).hexdigest()
+
+def build_manifest():
+    """Build the manifest of tickets which can be used to enter the ball.
+
+    Returns:
+        (dict) the manifest, containing the time it was generated, the
+        signature to present when syncing, and a list of tickets. Each ticket is
+        a list of its ID, the hash of its barcode, the holder's name, the URL of
+        the holder's photo thumbnail (or None) and whether it has already been
+        used to enter the ball.
+    """
+    tickets = DB.session.query(
+        models.Ticket.object_id,
+        models.Ticket.barcode,
+        models.User.full_name,
+        models.Photo.thumb_url,
+        models.Ticket.entered
+    ).join(
+        models.User,
+        models.Ticket.holder_id == models.User.object_id
+    ).outerjoin(
+        models.Photo,
+        models.User.photo_id == models.Photo.object_id
+    ).filter(
+        models.Ticket.paid == True, # pylint: disable=singleton-comparison
+        models.Ticket.cancelled == False, # pylint: disable=singleton-comparison
+        models.Ticket.barcode != None # pylint: disable=singleton-comparison
+    ).order_by(
+        models.Ticket.object_id
+    ).all()
+
+    generated = datetime.datetime.utcnow().isoformat()
+
+    return {
+        'generated': generated,
+        'signature': _get_serializer().dumps(generated),
+        'tickets': [
+            [object_id, hash_barcode(barcode), full_name, thumb_url, entered]
+            for object_id, barcode, full_name, thumb_url, entered in tickets
+        ],
+    }
+
+def check_signature(signature):
+    """Check that a scanner's manifest was issued recently by this app.
+
+    Args:
+        signature: (str) the signature from the scanner's manifest.
+
+    Returns:
+        (bool) whether the signature is valid and recent.
+    """
+    try:
+        _get_serializer().loads(
+            signature,
+            max_age=APP.config.get('DOOR_MANIFEST_MAX_AGE', 24 * 60 * 60)
+        )
+    except itsdangerous.BadData:
+        return False
+
+    return True
+
+def record_entries(ticket_ids):
+    """Mark a batch of tickets scanned at the door as having entered the ball.
+
+    The tickets are locked while the batch is recorded, so that batches from
+    different scanners containing the same ticket can't both record it.
+
+    Args:
+        ticket_ids: (list(int)) IDs of the tickets scanned, in the order they
+            were scanned.
+
+    Returns:
+        (list(int), list(int), list(int)) IDs of the tickets which were marked
+        as having entered, of those which had already been used to enter the
+        ball (or appeared more than once in the batch), and of those which are
+        no longer valid for entry (for example cancelled since the manifest was
+        downloaded).
+    """
+    tickets = {
+        ticket.object_id: ticket
+        for ticket in models.Ticket.query.filter(
+            models.Ticket.object_id.in_(ticket_ids)
+        ).order_by(
+            models.Ticket.object_id
+        ).with_for_update()
+    } if ticket_ids else {}
+
+    accepted = []
+    conflicts = []
+    invalid = []
+
+    for ticket_id in ticket_ids:
+        ticket = tickets.get(ticket_id)
+
+        if (
+                ticket is None or
+                ticket.cancelled or
+                not ticket.paid or
+                ticket.barcode is None or
+                ticket.holder_id is None
+        ):
+            invalid.append(ticket_id)
+        elif ticket.entered:
+            conflicts.append(ticket_id)
+        else:
+            ticket.entered = True
+            accepted.append(ticket_id)
+
+    if accepted:
+        APP.log_manager.log_event(
+            'Entered the ball',
+            tickets=[tickets[ticket_id] for ticket_id in accepted],
+            commit=False
+        )
+
+    if conflicts:
+        APP.log_manager.log_event(
+            'Scanned at the door after already entering the ball',
+            tickets=[tickets[ticket_id] for ticket_id in set(conflicts)],
+            commit=False
+        )
+
+    DB.session.commit()
+
+    return accepted, conflicts, invalid
+
+def get_entered_ids():
+    """Get the IDs of all tickets which have been used to enter the ball.
+
+    Sent to scanners after each sync so that they can detect tickets which
+    have entered at another scanner without waiting for a new manifest.
+    """
+    return [
+        object_id
+        for object_id, in DB.session.query(
+            models.Ticket.object_id
+        ).filter(
+            models.Ticket.entered == True # pylint: disable=singleton-comparison
+        )
+    ]
+
+def _thumb_url(user):
+    """Get the URL of a user's photo thumbnail, if they have one."""
+    return user.photo.thumb_url if user.photo else None
+
+def check_in(ticket_id, barcode):
+    """Check a ticket scanned at the door, and mark it as having entered.
+
+    The ticket, its holder and owner and their photos are loaded in a single
+    query, and the ticket is marked as having entered with a conditional
+    update, so that a ticket scanned at two gates at once only enters once.
+
+    Args:
+        ticket_id: (int) the ID of the ticket scanned.
+        barcode: (str) the barcode scanned.
+
+    Returns:
+        (bool, str, str or None) whether to permit entry, a message for the
+        door staff, and the URL of the photo to check the guest against.
+    """
+    ticket = models.Ticket.query.filter(
+        models.Ticket.object_id == ticket_id
+    ).options(
+        DB.joinedload(models.Ticket.holder).joinedload(models.User.photo),
+        DB.joinedload(models.Ticket.owner).joinedload(models.User.photo)
+    ).first()
+
+    if not ticket:
+        return False, 'No such ticket with barcode {0}'.format(barcode), None
+
+    if not ticket.holder:
+        return (
+            False,
+            'Ticket has not been claimed. Owner is {0}'.format(
+                ticket.owner.full_name
+            ),
+            _thumb_url(ticket.owner)
+        )
+
+    photo = _thumb_url(ticket.holder)
+
+    if ticket.cancelled or not ticket.paid:
+        return False, 'Ticket is not valid for entry', photo
+
+    if not ticket.barcode or ticket.barcode != barcode:
+        return (
+            False,
+            'Found ticket, barcode doesnt match {0}'.format(barcode),
+            photo
+        )
+
+    # Read before committing, which would expire the loaded objects
+    holder_name = ticket.holder.full_name
+    owner_name = ticket.owner.full_name
+
+    tickets = models.Ticket.__table__
+
+    result = DB.session.execute(
+        tickets.update().where(
+            tickets.c.object_id == ticket_id
+        ).where(
+            tickets.c.entered == False # pylint: disable=singleton-comparison
+        ).values(
+            entered=True
+        )
+    )
+
+    if result.rowcount == 1:
+        # The update bypasses the session, so adjust the statistics here
+        models.StatisticCounter.adjust({
+            models.StatisticCounter.ticket_state_key(
+                ticket.ticket_type, False, True, True, False
+            ): -1,
+            models.StatisticCounter.ticket_state_key(
+                ticket.ticket_type, False, True, True, True
+            ): 1,
+        })
+
+    DB.session.commit()
+
+    if result.rowcount != 1:
+        return (
+            False,
+            (
+                'Ticket has already been used for entry. Check ID against {0} '
+                '(owned by {1})'
+            ).format(
+                holder_name,
+                owner_name
+            ),
+            photo
+        )
+
+    return True, 'Permit entry for {0}'.format(holder_name), photo
@@ -49,13 +49,21 @@ class TicketInfo(_TicketInfo):
             ]
         })
 
-def guest_tickets_available():
-    """Return how many guest tickets are available."""
-    guest_ticket_count = models.Ticket.query.filter(
-        models.Ticket.ticket_type.in_(app.APP.config['GUEST_TYPE_SLUGS'])
-    ).filter(
-        models.Ticket.cancelled == False  # pylint: disable=singleton-comparison
-    ).count()
+def guest_tickets_available(active_counts=None):
+    """Return how many guest tickets are available.
+
+    Args:
+        active_counts: (dict(str, int) or None) number of active tickets of
+            each type, as returned by models.TicketCounter.get_active_counts.
+            Loaded from the database if not given.
+    """
+    if active_counts is None:
+        active_counts = models.TicketCounter.get_active_counts()
+
+    guest_ticket_count = sum(
+        active_counts[slug]
+        for slug in app.APP.config['GUEST_TYPE_SLUGS']
+    )
 
     return max(
         0,
@@ -82,22 +90,28 @@ def _type_limit_per_person(user, ticket_type):
         models.Ticket.ticket_type == ticket_type.slug
     ).count())
 
-def _type_total_limit(ticket_type):
+def _type_total_limit(ticket_type, active_counts=None):
     """Get how many tickets of a given type the user can buy.
 
     Based on the limit on total sales. Returns an arbitrary excessively large
     number if no such limit is set.
+
+    Args:
+        ticket_type: (eisitirio.helpers.ticket_type.TicketType) the type of
+            ticket being purchased
+        active_counts: (dict(str, int) or None) number of active tickets of
+            each type, as returned by models.TicketCounter.get_active_counts.
+            Loaded from the database if not given.
     """
     if ticket_type.total_limit == -1:
         return LARGE_NUMBER
 
-    return max(0, ticket_type.total_limit - models.Ticket.query.filter(
-        models.Ticket.ticket_type == ticket_type.slug
-    ).filter(
-        models.Ticket.cancelled == False # pylint: disable=singleton-comparison
-    ).count())
+    if active_counts is None:
+        active_counts = models.TicketCounter.get_active_counts()
+
+    return max(0, ticket_type.total_limit - active_counts[ticket_type.slug])
 
-def _get_ticket_limit(user, ticket_type, ticket_info):
+def _get_ticket_limit(user, ticket_type, ticket_info, active_counts):
     """Get the number of tickets of |ticket_type| that |user| can purchase.
 
     Args:
@@ -105,6 +119,7 @@ def _get_ticket_limit(user, ticket_type, ticket_info):
         ticket_type: (eisitirio.helpers.ticket_type.TicketType) the type of
             ticket being purchased
         ticket_info: (TicketInfo) Information about available tickets.
+        active_counts: (dict(str, int)) number of active tickets of each type.
 
     Returns:
         (int) the number of |ticket_type| tickets that |user| can buy.
@@ -112,7 +127,7 @@ def _get_ticket_limit(user, ticket_type, ticket_info):
 
     limit = min(
         _type_limit_per_person(user, ticket_type),
-        _type_total_limit(ticket_type),
+        _type_total_limit(ticket_type, active_counts),
         ticket_info.total_tickets_available
     )
 
@@ -123,16 +138,18 @@ def _get_ticket_limit(user, ticket_type, ticket_info):
 
 def get_ticket_info(user):
     """Get information about what tickets |user| can purchase online."""
+    active_counts = models.TicketCounter.get_active_counts()
 
     ticket_info = TicketInfo(
-        guest_tickets_available(),
+        guest_tickets_available(active_counts),
         _total_tickets_available(user, datetime.datetime.utcnow()),
         []
     )
 
     for ticket_type in app.APP.config['TICKET_TYPES']:
         if ticket_type.can_buy(user):
-            ticket_limit = _get_ticket_limit(user, ticket_type, ticket_info)
+            ticket_limit = _get_ticket_limit(user, ticket_type, ticket_info,
+                                             active_counts)
 
             if ticket_limit > 0:
                 ticket_info.ticket_types.append((ticket_type, ticket_limit))
@@ -258,6 +275,69 @@ def create_tickets(user, ticket_info, num_tickets):
 
     return tickets
 
+def reserve_tickets(num_tickets):
+    """Check that there is capacity for an order and hold it.
+
+    Locks the counters for the ordered ticket types (and for all guest ticket
+    types if any guest tickets are ordered) so that concurrent purchases are
+    serialised, and checks the total and guest limits against the locked
+    counts. The caller must then create the tickets and commit in the same
+    transaction, which increments the counters and releases the locks.
+
+    If the order can't be satisfied, the transaction is rolled back so that the
+    locks are released immediately.
+
+    Args:
+        num_tickets: (dict(str, int)) how many tickets of each type have been
+            ordered, keyed by ticket type slug.
+
+    Returns:
+        (list(str)) error messages, empty if the capacity has been reserved.
+    """
+    ticket_types = [
+        APP.config['TICKET_TYPES_BY_SLUG'][slug]
+        for slug, number in num_tickets.iteritems()
+        if number > 0
+    ]
+
+    guest_tickets_ordered = sum(
+        num_tickets[ticket_type.slug]
+        for ticket_type in ticket_types
+        if ticket_type.counts_towards_guest_limit
+    )
+
+    slugs = [ticket_type.slug for ticket_type in ticket_types]
+
+    if guest_tickets_ordered > 0:
+        slugs.extend(APP.config['GUEST_TYPE_SLUGS'])
+
+    active_counts = models.TicketCounter.lock(slugs)
+
+    flashes = []
+
+    for ticket_type in ticket_types:
+        type_limit = _type_total_limit(ticket_type, active_counts)
+
+        if num_tickets[ticket_type.slug] > type_limit:
+            flashes.append(
+                "There are only {0} {1} tickets left.".format(
+                    type_limit,
+                    ticket_type.name
+                )
+            )
+
+    guest_limit = guest_tickets_available(active_counts)
+
+    if guest_tickets_ordered > guest_limit:
+        flashes.append("There are only {0} guest tickets left.".format(
+            guest_limit
+        ))
+
+    if flashes:
+        DB.session.rollback()
+
+    return flashes
+
 def check_payment_method(flashes):
     """Validate the payment method selected in the purchase form.
 
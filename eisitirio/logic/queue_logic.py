@@ -0,0 +1,197 @@
+# coding: utf-8
+"""Logic for the release-time virtual queue in front of the purchase page.
+
+When general release opens, every user loads the purchase page at once. With
+the queue enabled, users without an admission token are given a place in the
+queue, and places are admitted at a fixed rate from the time the queue opens.
+
+The admission token is signed with the app's secret key and records the user's
+place, so whether a user has been admitted (and how far they have to go) can be
+worked out from the token and the clock alone, without touching the database.
+
+Each release is identified by when its queue opens. Places, and admission
+tokens, are only valid for the release they were given out for, so changing
+PURCHASE_QUEUE_OPENS for the next release starts a fresh queue.
+
+The queue is configured with the following keys:
+    PURCHASE_QUEUE_ENABLED: (bool) whether the queue is in use. Can be a
+        timed_config.Until to switch the queue on and off at set times.
+    PURCHASE_QUEUE_OPENS: (datetime.datetime) when admissions start. The queue
+        isn't used until this is set.
+    PURCHASE_QUEUE_ADMISSIONS_PER_MINUTE: (int) how many places are admitted
+        each minute after the queue opens. Defaults to
+        DEFAULT_ADMISSIONS_PER_MINUTE.
+"""
+
+from __future__ import unicode_literals
+from __future__ import division
+
+import datetime
+
+import flask
+import itsdangerous
+import sqlalchemy
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+
+APP = app.APP
+DB = db.DB
+
+SESSION_KEY = 'purchase_queue_token'
+
+DEFAULT_ADMISSIONS_PER_MINUTE = 100
+
+def _get_serializer():
+    """Get the serializer used to sign admission tokens."""
+    return itsdangerous.URLSafeSerializer(APP.secret_key,
+                                          salt='purchase-queue')
+
+def get_release():
+    """Get when the queue opens for the current release.
+
+    Returns:
+        (datetime.datetime or None) the time admissions start, or None if it
+        hasn't been set.
+    """
+    return APP.config.get('PURCHASE_QUEUE_OPENS')
+
+def queue_enabled():
+    """Check whether purchases currently go through the queue."""
+    return bool(
+        APP.config.get('PURCHASE_QUEUE_ENABLED', False) and
+        get_release() is not None
+    )
+
+def admitted_places(now=None):
+    """Get how many places in the queue have been admitted.
+
+    Args:
+        now: (datetime.datetime or None) time to calculate admissions at.
+            Defaults to the current time.
+
+    Returns:
+        (int) the number of places admitted, such that every place up to and
+        including this number may purchase tickets.
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+
+    release = get_release()
+
+    if release is None:
+        return 0
+
+    elapsed = (now - release).total_seconds()
+
+    if elapsed < 0:
+        return 0
+
+    return int(
+        elapsed * APP.config.get('PURCHASE_QUEUE_ADMISSIONS_PER_MINUTE',
+                                 DEFAULT_ADMISSIONS_PER_MINUTE) // 60
+    )
+
+def join_queue(user):
+    """Give a user a place in the queue and an admission token for it.
+
+    Users who already have a place for the current release keep it, and places
+    from earlier releases are replaced. The token is stored in the user's
+    session.
+
+    Args:
+        user: (models.User) the user joining the queue.
+
+    Returns:
+        (int) the user's place in the queue, starting from 1.
+    """
+    release = get_release()
+    entry = user.queue_entry
+
+    if entry is not None and entry.release != release:
+        DB.session.delete(entry)
+        DB.session.flush()
+        entry = None
+
+    if entry is None:
+        entry = models.QueueEntry(user, release)
+        DB.session.add(entry)
+
+        try:
+            DB.session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            # The user joined from another request at the same time
+            DB.session.rollback()
+            entry = models.QueueEntry.get_by_user_id(user.object_id)
+
+    first_id = DB.session.query(
+        sqlalchemy.func.min(models.QueueEntry.object_id)
+    ).filter(
+        models.QueueEntry.release == release
+    ).scalar()
+
+    place = entry.object_id - first_id + 1
+
+    flask.session[SESSION_KEY] = _get_serializer().dumps(
+        [user.object_id, release.isoformat(), place]
+    )
+
+    return place
+
+def get_session_user_id():
+    """Get the ID of the user logged in to this session, without loading them.
+
+    flask_login keeps the ID in the signed session cookie, so this can be used
+    where loading the user with login.current_user would cost a query.
+
+    Returns:
+        (int or None) the ID of the logged in user, or None if nobody is logged
+        in.
+    """
+    try:
+        return int(flask.session['user_id'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def get_place(user_id):
+    """Get a user's place in the queue from their admission token.
+
+    Args:
+        user_id: (int or None) the ID of the user to check.
+
+    Returns:
+        (int or None) the user's place in the queue, or None if the user doesn't
+        have a valid admission token for the current release.
+    """
+    token = flask.session.get(SESSION_KEY)
+    release = get_release()
+
+    if token is None or release is None or user_id is None:
+        return None
+
+    try:
+        token_user_id, token_release, place = _get_serializer().loads(token)
+    except (itsdangerous.BadSignature, ValueError):
+        return None
+
+    if token_user_id != user_id or token_release != release.isoformat():
+        return None
+
+    return place
+
+def is_admitted(user_id):
+    """Check whether a user may go through to the purchase page.
+
+    Args:
+        user_id: (int or None) the ID of the user to check.
+
+    Returns:
+        (bool) whether the user may purchase tickets now.
+    """
+    if not queue_enabled():
+        return True
+
+    place = get_place(user_id)
+
+    return place is not None and place <= admitted_places()
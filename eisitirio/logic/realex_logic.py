@@ -177,15 +177,16 @@ def generate_payment_form(transaction):
         transaction.value
     )
 
-    DB.session.commit()
-
     APP.log_manager.log_event(
         'Started Card Payment',
         tickets=transaction.tickets,
         user=login.current_user,
-        transaction=transaction
+        transaction=transaction,
+        commit=False
     )
 
+    DB.session.commit()
+
     return form_str
 
 def get_transaction_id(str):
@@ -9,14 +9,14 @@ from eisitirio.database import models
 @models.User.possession()
 def tickets(user):
     """Does the user have any tickets?"""
-    return len([x for x in user.tickets
+    return len([x for x in user.get_tickets()
                 if not x.cancelled]) > 0
 
 @models.User.possession()
 def uncollected_tickets(user):
     """Does the user have any uncollected tickets?"""
     return (
-        any(not x.cancelled and not x.collected for x in user.tickets) or
+        any(not x.cancelled and not x.collected for x in user.get_tickets()) or
         (
             user.held_ticket is not None and
             not user.held_ticket.collected
@@ -26,12 +26,12 @@ def uncollected_tickets(user):
 @models.User.possession()
 def collected_tickets(user):
     """Has the user collected any tickets?"""
-    return any(not x.cancelled and x.collected for x in user.tickets)
+    return any(not x.cancelled and x.collected for x in user.get_tickets())
 
 @models.User.possession()
 def collectable_tickets(user):
     """Does the user own any tickets that can be collected?"""
-    return any(ticket.can_be_collected() for ticket in user.tickets)
+    return any(ticket.can_be_collected() for ticket in user.get_tickets())
 
 @models.User.possession()
 def unpaid_tickets(user, method=None):
@@ -50,12 +50,12 @@ def unpaid_tickets(user, method=None):
     if method is None:
         return any(
             ticket.can_be_paid_for()
-            for ticket in user.tickets
+            for ticket in user.get_tickets()
         )
     else:
         return any(
             ticket.can_be_paid_for()
-            for ticket in user.tickets
+            for ticket in user.get_tickets()
             if ticket.payment_method == method
         )
 
@@ -76,7 +76,7 @@ def paid_tickets(user, method=None):
     if method is None:
         return len(
             [
-                x for x in user.tickets if (
+                x for x in user.get_tickets() if (
                     x.paid and
                     not x.cancelled
                 )
@@ -85,7 +85,7 @@ def paid_tickets(user, method=None):
     else:
         return len(
             [
-                x for x in user.tickets if (
+                x for x in user.get_tickets() if (
                     x.payment_method == method and
                     x.paid and
                     not x.cancelled
@@ -0,0 +1,100 @@
+# coding: utf-8
+"""Script to move old log entries out of the database into archive files."""
+
+from __future__ import unicode_literals
+from __future__ import division
+
+import datetime
+
+from dateutil import parser
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.helpers import log_archive
+
+APP = app.APP
+
+def _format_size(size):
+    """Format a size in bytes as megabytes."""
+    return '{0:.1f}MB'.format(size / 1024 / 1024)
+
+class ArchiveLogCommand(script.Command):
+    """Flask-Script command for archiving old log entries."""
+
+    help = 'Move old log entries out of the database into archive files'
+
+    option_list = (
+        script.Option('--days', dest='days', type=int, default=180,
+                      help='Archive entries older than this many days'),
+        script.Option('--before', dest='before', default=None,
+                      help=(
+                          'Archive entries from before this date instead, '
+                          'e.g. 2017-01-01'
+                      )),
+        script.Option('--batch-size', dest='batch_size', type=int,
+                      default=log_archive.BATCH_SIZE,
+                      help='Number of entries to archive at once'),
+        script.Option('--optimize', dest='optimize', action='store_true',
+                      default=False,
+                      help=(
+                          'Rebuild the log tables afterwards to reclaim the '
+                          'space (MySQL only, locks the tables while running)'
+                      )),
+    )
+
+    @staticmethod
+    def run(days, before, batch_size, optimize):
+        """Archive the entries, and report the space reclaimed."""
+        if before is not None:
+            cutoff = parser.parse(before)
+        else:
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+
+        with APP.app_context():
+            size_before = log_archive.get_table_sizes()
+
+            archived = 0
+            written = 0
+
+            for batch_archived, batch_written in log_archive.archive_before(
+                    cutoff,
+                    batch_size
+            ):
+                archived += batch_archived
+                written += batch_written
+
+                print 'Archived {0} entries'.format(archived)
+
+            print (
+                'Archived {0} entries from before {1:%Y-%m-%d} into {2}, '
+                'adding {3} of archive files'
+            ).format(
+                archived,
+                cutoff,
+                log_archive.get_archive_directory(),
+                _format_size(written)
+            )
+
+            if optimize and archived:
+                log_archive.reclaim_space()
+
+            size_after = log_archive.get_table_sizes()
+
+            if size_before is None:
+                print (
+                    'The space used by the log tables can only be measured '
+                    'on MySQL'
+                )
+            else:
+                print 'Log tables went from {0} to {1}, reclaiming {2}'.format(
+                    _format_size(size_before),
+                    _format_size(size_after),
+                    _format_size(size_before - size_after)
+                )
+
+                if not optimize:
+                    print (
+                        'Run with --optimize to return the space freed to the '
+                        'operating system'
+                    )
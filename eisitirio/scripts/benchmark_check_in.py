@@ -0,0 +1,177 @@
+# coding: utf-8
+"""Script to load test checking in tickets at several gates at once."""
+
+from __future__ import unicode_literals
+from __future__ import division
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+from eisitirio.helpers import benchmark
+from eisitirio.helpers import util
+from eisitirio.logic import door_logic
+
+APP = app.APP
+DB = db.DB
+
+def prepare_tickets():
+    """Give every valid ticket a barcode, and mark none as having entered.
+
+    Returns:
+        (list((int, str))) the ID and barcode of each valid ticket.
+    """
+    tickets = [
+        {
+            'object_id': object_id,
+            'barcode': util.generate_key(20).decode('utf-8'),
+            'entered': False,
+        }
+        for object_id, in DB.session.query(
+            models.Ticket.object_id
+        ).filter(
+            models.Ticket.holder_id != None, # pylint: disable=singleton-comparison
+            models.Ticket.paid == True, # pylint: disable=singleton-comparison
+            models.Ticket.cancelled == False # pylint: disable=singleton-comparison
+        )
+    ]
+
+    DB.session.bulk_update_mappings(models.Ticket, tickets)
+    DB.session.commit()
+
+    return [(ticket['object_id'], ticket['barcode']) for ticket in tickets]
+
+def _run_gate(barrier, scans, latencies, admitted, errors):
+    """Check in each scan in turn as a single gate would.
+
+    Args:
+        barrier: (threading.Event) event to wait on before scanning, so that
+            all gates start at once.
+        scans: (list((int, str))) the ID and barcode of each ticket to scan.
+        latencies: (list) list to append the time taken by each check in to,
+            in milliseconds.
+        admitted: (list) list to append the ID of each ticket admitted to.
+        errors: (list) list to append any unexpected errors to.
+    """
+    with APP.app_context():
+        barrier.wait()
+
+        try:
+            for ticket_id, barcode in scans:
+                start = time.time()
+                valid, _, _ = door_logic.check_in(ticket_id, barcode)
+                latencies.append((time.time() - start) * 1000)
+
+                if valid:
+                    admitted.append(ticket_id)
+        except Exception as err: # pylint: disable=broad-except
+            DB.session.rollback()
+            errors.append(repr(err))
+        finally:
+            DB.session.remove()
+
+class BenchmarkCheckInCommand(script.Command):
+    """Flask-Script command for load testing the check in endpoint logic."""
+
+    help = 'Load test checking in tickets at several gates at once'
+
+    option_list = (
+        script.Option('--tickets', '-t', dest='num_tickets', type=int,
+                      default=2000,
+                      help='Number of tickets to seed the database with'),
+        script.Option('--gates', '-g', dest='num_gates', type=int, default=4,
+                      help='Number of gates scanning at once'),
+        script.Option('--database', '-d', dest='database_uri', default=None,
+                      help=(
+                          'URI of an empty scratch database to use. Defaults '
+                          'to a temporary SQLite file'
+                      )),
+    )
+
+    @staticmethod
+    def run(num_tickets, num_gates, database_uri):
+        """Scan every ticket at every gate, and report latency.
+
+        Every gate scans the tickets in the same order, so each ticket is
+        scanned at all gates at about the same time, and must only be admitted
+        once.
+        """
+        scratch_file = None
+
+        if database_uri is None:
+            handle, scratch_file = tempfile.mkstemp(suffix='.sqlite')
+            os.close(handle)
+            # Gates queue on the SQLite write lock, so wait for it
+            database_uri = 'sqlite:///{0}?timeout=60'.format(scratch_file)
+
+        try:
+            with APP.app_context():
+                benchmark.use_scratch_database(database_uri)
+                benchmark.seed_database(num_tickets)
+
+                scans = prepare_tickets()
+
+            random.Random(0).shuffle(scans)
+
+            barrier = threading.Event()
+            latencies = []
+            admitted = []
+            errors = []
+
+            threads = [
+                threading.Thread(
+                    target=_run_gate,
+                    args=(barrier, scans, latencies, admitted, errors)
+                )
+                for _ in xrange(num_gates)
+            ]
+
+            for thread in threads:
+                thread.start()
+
+            start = time.time()
+            barrier.set()
+
+            for thread in threads:
+                thread.join()
+
+            elapsed = time.time() - start
+
+            print '{0} scans of {1} tickets at {2} gates in {3:.1f}s'.format(
+                len(latencies),
+                len(scans),
+                num_gates,
+                elapsed
+            )
+            print 'Latency: p50 {0:.1f}ms, p99 {1:.1f}ms, max {2:.1f}ms'.format(
+                benchmark.percentile(latencies, 0.5) or 0,
+                benchmark.percentile(latencies, 0.99) or 0,
+                max(latencies or [0])
+            )
+            print '{0} admitted, {1} admitted more than once'.format(
+                len(admitted),
+                len(admitted) - len(set(admitted))
+            )
+
+            for error in sorted(set(errors)):
+                print '  {0}'.format(error)
+
+            if errors or sorted(admitted) != sorted(
+                    ticket_id for ticket_id, _ in scans
+            ):
+                print 'FAILED'
+                sys.exit(1)
+
+            print 'OK'
+        finally:
+            if scratch_file is not None:
+                os.remove(scratch_file)
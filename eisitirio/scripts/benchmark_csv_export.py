@@ -0,0 +1,166 @@
+# coding: utf-8
+"""Script to check that CSV exports run in bounded memory."""
+
+from __future__ import unicode_literals
+from __future__ import division
+
+import cStringIO
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+from eisitirio.helpers import benchmark
+from eisitirio.helpers import pagination
+from eisitirio.helpers import unicode_csv
+
+APP = app.APP
+DB = db.DB
+
+def _seed(database_uri, num_tickets):
+    """Seed the scratch database, run in a separate process.
+
+    This keeps the memory used for seeding out of the measurements.
+    """
+    with APP.app_context():
+        benchmark.use_scratch_database(database_uri)
+        benchmark.seed_database(num_tickets)
+
+def _peak_memory_mb():
+    """Get the peak memory use of this process in megabytes."""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def export_streamed():
+    """Export all tickets as the admin search export does, discarding the data.
+
+    Returns:
+        (int) the size of the export in bytes.
+    """
+    size = 0
+
+    for chunk in unicode_csv.iter_csv(
+            pagination.iterate(
+                models.Ticket.query.options(
+                    *models.Ticket.csv_export_options()
+                ),
+                [models.Ticket.object_id],
+                unicode_csv.BATCH_SIZE
+            ),
+            models.Ticket.write_csv_row,
+            models.Ticket.write_csv_header
+    ):
+        size += len(chunk)
+
+    return size
+
+def export_buffered():
+    """Export all tickets by loading them all and building the whole file.
+
+    Returns:
+        (int) the size of the export in bytes.
+    """
+    csvdata = cStringIO.StringIO()
+    csvwriter = unicode_csv.UnicodeWriter(csvdata)
+
+    models.Ticket.write_csv_header(csvwriter)
+
+    for ticket in models.Ticket.query.options(
+            *models.Ticket.csv_export_options()
+    ).all():
+        ticket.write_csv_row(csvwriter)
+
+    return len(csvdata.getvalue())
+
+class BenchmarkCsvExportCommand(script.Command):
+    """Flask-Script command for checking the memory use of CSV exports."""
+
+    help = 'Check that exporting tickets as CSV runs in bounded memory'
+
+    option_list = (
+        script.Option('--tickets', '-t', dest='num_tickets', type=int,
+                      default=200000, help='Number of tickets to export'),
+        script.Option('--max-memory', '-m', dest='max_memory', type=float,
+                      default=64,
+                      help='Most memory the export may use, in megabytes'),
+        script.Option('--compare', '-c', dest='compare', action='store_true',
+                      default=False,
+                      help=(
+                          'Also export by building the whole file in memory, '
+                          'for comparison'
+                      )),
+        script.Option('--database', '-d', dest='database_uri', default=None,
+                      help=(
+                          'URI of an empty scratch database to use. Defaults '
+                          'to a temporary SQLite file'
+                      )),
+    )
+
+    @staticmethod
+    def run(num_tickets, max_memory, compare, database_uri):
+        """Export the tickets, and check how much memory it took."""
+        scratch_file = None
+
+        if database_uri is None:
+            handle, scratch_file = tempfile.mkstemp(suffix='.sqlite')
+            os.close(handle)
+            database_uri = 'sqlite:///{0}'.format(scratch_file)
+
+        try:
+            seeder = multiprocessing.Process(
+                target=_seed,
+                args=(database_uri, num_tickets)
+            )
+            seeder.start()
+            seeder.join()
+
+            with APP.app_context():
+                benchmark.use_scratch_database(database_uri)
+
+                # Load the first row to set up the connection and mappers
+                models.Ticket.query.first()
+
+                baseline = _peak_memory_mb()
+                start = time.time()
+
+                size = export_streamed()
+
+                streamed = _peak_memory_mb() - baseline
+
+                print (
+                    'Streamed {0} tickets ({1:.1f}MB) in {2:.1f}s, using '
+                    '{3:.1f}MB'
+                ).format(
+                    num_tickets,
+                    size / 1024 / 1024,
+                    time.time() - start,
+                    streamed
+                )
+
+                if compare:
+                    # The peak only goes up, so this must be measured last
+                    start = time.time()
+
+                    export_buffered()
+
+                    print 'Buffered in {0:.1f}s, using {1:.1f}MB'.format(
+                        time.time() - start,
+                        _peak_memory_mb() - baseline
+                    )
+
+            if streamed > max_memory:
+                print 'FAILED: more than {0:.1f}MB used'.format(max_memory)
+                sys.exit(1)
+
+            print 'OK'
+        finally:
+            if scratch_file is not None:
+                os.remove(scratch_file)
@@ -0,0 +1,131 @@
+# coding: utf-8
+"""Script to check the number of queries needed to render the dashboard."""
+
+from __future__ import unicode_literals
+
+import os
+import sys
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+from eisitirio.helpers import benchmark
+
+APP = app.APP
+DB = db.DB
+
+# Most queries rendering the dashboard should take, however many tickets the
+# user has
+MAX_QUERIES = 15
+
+def count_dashboard_queries(client, user_id):
+    """Render the dashboard as a user, and count the queries needed.
+
+    Args:
+        client: (flask.testing.FlaskClient) client to make the request with.
+        user_id: (int) the ID of the user to log in as.
+
+    Returns:
+        (int) the number of queries.
+    """
+    with client.session_transaction() as session:
+        session['user_id'] = unicode(user_id)
+        session['_fresh'] = True
+
+    # Requests share the outer app context, and so its session; start each one
+    # with an empty identity map as a real request would
+    DB.session.remove()
+
+    with benchmark.Profile() as profile:
+        response = client.get('/dashboard')
+
+    if response.status_code != 200:
+        raise RuntimeError('Dashboard returned {0}'.format(response.status))
+
+    return profile.queries
+
+class BenchmarkDashboardCommand(script.Command):
+    """Flask-Script command for counting the dashboard's queries."""
+
+    help = 'Check the number of queries needed to render the dashboard'
+
+    option_list = (
+        script.Option('--tickets', '-n', dest='num_tickets', type=int,
+                      default=1000, help='Number of tickets to seed'),
+        script.Option('--many', dest='many', type=int, default=50,
+                      help='Number of tickets to give the busiest user'),
+        script.Option('--database', '-d', dest='database_uri', default=None,
+                      help=(
+                          'URI of an empty scratch database to use. Defaults '
+                          'to a temporary SQLite file'
+                      )),
+    )
+
+    @staticmethod
+    def run(num_tickets, many, database_uri):
+        """Render the dashboard for users with few and many tickets.
+
+        Fails if either needs more than MAX_QUERIES, which would mean queries
+        are being made for each ticket.
+        """
+        with APP.app_context():
+            scratch_file = benchmark.use_scratch_database(database_uri)
+
+            try:
+                benchmark.seed_database(num_tickets)
+
+                busiest_id = DB.session.query(
+                    models.User.object_id
+                ).order_by(
+                    models.User.object_id
+                ).first()[0]
+
+                # Give the busiest user a run of tickets
+                ticket_ids = [
+                    object_id for object_id, in DB.session.query(
+                        models.Ticket.object_id
+                    ).order_by(
+                        models.Ticket.object_id
+                    ).limit(many)
+                ]
+
+                models.Ticket.query.filter(
+                    models.Ticket.object_id.in_(ticket_ids)
+                ).update({'owner_id': busiest_id}, synchronize_session=False)
+                DB.session.commit()
+
+                counts = DB.session.query(
+                    models.Ticket.owner_id,
+                    DB.func.count(models.Ticket.object_id)
+                ).group_by(
+                    models.Ticket.owner_id
+                ).order_by(
+                    DB.func.count(models.Ticket.object_id)
+                ).all()
+
+                client = APP.test_client()
+                results = []
+
+                for owner_id, tickets in [counts[0], counts[-1]]:
+                    queries = count_dashboard_queries(client, owner_id)
+                    results.append(queries)
+
+                    print 'User {0} with {1} tickets: {2} queries'.format(
+                        owner_id,
+                        tickets,
+                        queries
+                    )
+
+                DB.session.remove()
+
+                if max(results) > MAX_QUERIES:
+                    print 'FAILED: more than {0} queries'.format(MAX_QUERIES)
+                    sys.exit(1)
+
+                print 'OK'
+            finally:
+                if scratch_file is not None:
+                    os.remove(scratch_file)
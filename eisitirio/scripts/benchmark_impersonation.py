@@ -0,0 +1,139 @@
+# coding: utf-8
+"""Script to check the queries added by impersonating a user on admin pages."""
+
+from __future__ import unicode_literals
+
+import os
+import sys
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+from eisitirio.helpers import benchmark
+
+APP = app.APP
+DB = db.DB
+
+# Impersonating should only add the query loading the impersonating admin
+MAX_EXTRA_QUERIES = 1
+
+def count_page_queries(client, path, user_id, actor_id=None):
+    """Load a page as a user, and count the queries needed.
+
+    Args:
+        client: (flask.testing.FlaskClient) client to make the request with.
+        path: (str) the page to load.
+        user_id: (int) the ID of the user to log in as.
+        actor_id: (int or None) the ID of the admin impersonating the user.
+
+    Returns:
+        (int) the number of queries.
+    """
+    with client.session_transaction() as session:
+        session['user_id'] = unicode(user_id)
+        session['_fresh'] = True
+
+        if actor_id is None:
+            session.pop('actor_id', None)
+        else:
+            session['actor_id'] = actor_id
+
+    # Start each request with an empty identity map, and its own flask.g so the
+    # impersonating admin isn't already cached, as a real request would
+    DB.session.remove()
+
+    with APP.app_context(), benchmark.Profile() as profile:
+        response = client.get(path)
+
+    if response.status_code != 200:
+        raise RuntimeError('{0} returned {1}'.format(path, response.status))
+
+    return profile.queries
+
+class BenchmarkImpersonationCommand(script.Command):
+    """Flask-Script command for counting queries while impersonating."""
+
+    help = 'Check the queries added by impersonating a user on admin pages'
+
+    option_list = (
+        script.Option('--tickets', '-n', dest='num_tickets', type=int,
+                      default=1000, help='Number of tickets to seed'),
+        script.Option('--database', '-d', dest='database_uri', default=None,
+                      help=(
+                          'URI of an empty scratch database to use. Defaults '
+                          'to a temporary SQLite file'
+                      )),
+    )
+
+    @staticmethod
+    def run(num_tickets, database_uri):
+        """Load admin pages as an admin and while impersonating a user.
+
+        Fails if impersonating adds more than MAX_EXTRA_QUERIES to any page.
+        """
+        with APP.app_context():
+            scratch_file = benchmark.use_scratch_database(database_uri)
+
+            try:
+                benchmark.seed_database(num_tickets)
+
+                admin_id, user_id = [
+                    object_id for object_id, in DB.session.query(
+                        models.User.object_id
+                    ).order_by(
+                        models.User.object_id
+                    ).limit(2)
+                ]
+
+                models.User.query.filter(
+                    models.User.object_id == admin_id
+                ).update({'role': 'Admin'}, synchronize_session=False)
+                DB.session.commit()
+
+                ticket_id = DB.session.query(
+                    models.Ticket.object_id
+                ).filter(
+                    models.Ticket.owner_id == user_id
+                ).first()[0]
+
+                DB.session.remove()
+
+                client = APP.test_client()
+                failed = False
+
+                for path in [
+                        '/admin/user/{0}/view'.format(user_id),
+                        '/admin/ticket/{0}/view'.format(ticket_id),
+                        '/admin/statistics',
+                ]:
+                    # Warm up any caches before counting
+                    count_page_queries(client, path, admin_id)
+
+                    as_admin = count_page_queries(client, path, admin_id)
+                    impersonating = count_page_queries(client, path, user_id,
+                                                       admin_id)
+
+                    print '{0}: {1} queries as admin, {2} impersonating'.format(
+                        path,
+                        as_admin,
+                        impersonating
+                    )
+
+                    if impersonating - as_admin > MAX_EXTRA_QUERIES:
+                        failed = True
+
+                DB.session.remove()
+
+                if failed:
+                    print (
+                        'FAILED: impersonating adds more than {0} queries'
+                    ).format(MAX_EXTRA_QUERIES)
+                    sys.exit(1)
+
+                print 'OK'
+            finally:
+                if scratch_file is not None:
+                    os.remove(scratch_file)
@@ -0,0 +1,110 @@
+# coding: utf-8
+"""Script to benchmark sending the outbox against a stand-in SMTP server."""
+
+from __future__ import unicode_literals
+
+from email.mime import text
+import os
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+from eisitirio.helpers import benchmark
+from eisitirio.helpers import outbox
+from eisitirio.scripts import send_outbox
+
+APP = app.APP
+DB = db.DB
+
+def queue_emails(num_emails):
+    """Add |num_emails| test emails to the outbox."""
+    for index in xrange(num_emails):
+        message = text.MIMEText(
+            'Benchmark email {0}'.format(index),
+            'plain',
+            'utf-8'
+        )
+
+        message['Subject'] = 'Benchmark email {0}'.format(index)
+        message['From'] = 'benchmark@example.com'
+        message['To'] = 'guest{0}@example.com'.format(index)
+
+        DB.session.add(models.OutboxEmail(message))
+
+    DB.session.commit()
+
+class BenchmarkOutboxCommand(script.Command):
+    """Flask-Script command for benchmarking the outbox worker."""
+
+    help = 'Benchmark sending the outbox against a stand-in SMTP server'
+
+    option_list = (
+        script.Option('--emails', '-e', dest='num_emails', type=int,
+                      default=1000, help='Number of emails to send'),
+        script.Option('--connections', '-c', dest='connections', type=int,
+                      action='append', default=None,
+                      help=(
+                          'Number of SMTP connections to use, can be given '
+                          'more than once. Defaults to 1 and 4'
+                      )),
+        script.Option('--connect-delay', dest='connect_delay', type=float,
+                      default=0.2,
+                      help='Simulated seconds to open each connection'),
+        script.Option('--message-delay', dest='message_delay', type=float,
+                      default=0.02,
+                      help='Simulated seconds to accept each email'),
+        script.Option('--hang-up-after', dest='messages_per_connection',
+                      type=int, default=None,
+                      help=(
+                          'Number of emails after which the server drops '
+                          'each connection'
+                      )),
+        script.Option('--database', '-d', dest='database_uri', default=None,
+                      help=(
+                          'URI of an empty scratch database to use. Defaults '
+                          'to a temporary SQLite file'
+                      )),
+    )
+
+    @staticmethod
+    def run(num_emails, connections, connect_delay, message_delay,
+            messages_per_connection, database_uri):
+        """Send the same emails with each pool size and report throughput."""
+        server = benchmark.StandInSmtpServer(connect_delay, message_delay,
+                                             messages_per_connection)
+        server.use_for_app()
+
+        with APP.app_context():
+            scratch_file = benchmark.use_scratch_database(database_uri)
+
+            try:
+                for num_connections in connections or [1, 4]:
+                    models.OutboxEmail.query.delete()
+                    queue_emails(num_emails)
+
+                    server.connections = 0
+                    server.received = 0
+
+                    print '{0} connection(s):'.format(num_connections)
+
+                    send_outbox.print_stats(
+                        outbox.OutboxWorker(
+                            APP.email_manager,
+                            num_connections
+                        ).drain()
+                    )
+
+                    print (
+                        'Server received {0} emails over {1} connections'
+                    ).format(
+                        server.received,
+                        server.connections
+                    )
+            finally:
+                server.shutdown()
+
+                if scratch_file is not None:
+                    os.remove(scratch_file)
@@ -0,0 +1,160 @@
+# coding: utf-8
+"""Script to compare offset and keyset pagination deep into the log."""
+
+from __future__ import unicode_literals
+from __future__ import division
+
+import datetime
+import os
+import sys
+import time
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+from eisitirio.helpers import benchmark
+from eisitirio.helpers import pagination
+
+APP = app.APP
+DB = db.DB
+
+INSERT_CHUNK_SIZE = 10000
+PER_PAGE = 10
+REPEATS = 3
+
+# How much slower the deepest keyset page may be than the second one
+MAX_SLOWDOWN = 3
+
+LOG_ORDER = [models.Log.timestamp, models.Log.object_id]
+
+def seed_log(num_rows):
+    """Fill the log with |num_rows| entries, several to each timestamp."""
+    start = datetime.datetime(2017, 1, 1)
+
+    for chunk_start in xrange(0, num_rows, INSERT_CHUNK_SIZE):
+        DB.session.execute(
+            models.Log.__table__.insert(),
+            [
+                {
+                    'timestamp': start + datetime.timedelta(seconds=row // 4),
+                    'ip_address': '127.0.0.1',
+                    'action': 'Benchmark entry {0}'.format(row),
+                }
+                for row in xrange(
+                    chunk_start,
+                    min(chunk_start + INSERT_CHUNK_SIZE, num_rows)
+                )
+            ]
+        )
+
+    DB.session.commit()
+
+def _time_ms(function):
+    """Get the best time of a few calls to |function| in milliseconds."""
+    best = None
+
+    for _ in xrange(REPEATS):
+        start = time.time()
+        function()
+        elapsed = (time.time() - start) * 1000
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+class BenchmarkPaginationCommand(script.Command):
+    """Flask-Script command for benchmarking deep pages of the log."""
+
+    help = 'Compare offset and keyset pagination deep into the log'
+
+    option_list = (
+        script.Option('--rows', '-r', dest='num_rows', type=int,
+                      default=1000000, help='Number of log entries'),
+        script.Option('--database', '-d', dest='database_uri', default=None,
+                      help=(
+                          'URI of an empty scratch database to use. Defaults '
+                          'to a temporary SQLite file'
+                      )),
+    )
+
+    @staticmethod
+    def run(num_rows, database_uri):
+        """Time fetching pages at increasing depths with each method."""
+        with APP.app_context():
+            scratch_file = benchmark.use_scratch_database(database_uri)
+
+            try:
+                seed_log(num_rows)
+
+                query = models.Log.query.order_by(None)
+
+                print '{0:>10} {1:>12} {2:>12} {3:>18}'.format(
+                    'Page',
+                    'Offset (ms)',
+                    'Keyset (ms)',
+                    'Keyset+total (ms)'
+                )
+
+                page = 1
+                keyset_times = []
+
+                while (page - 1) * PER_PAGE < num_rows:
+                    offset_ms = _time_ms(
+                        lambda: query.order_by(
+                            models.Log.timestamp.desc(),
+                            models.Log.object_id.desc()
+                        ).paginate(page, PER_PAGE, False).items # pylint: disable=cell-var-from-loop
+                    )
+
+                    cursor = None
+
+                    if page > 1:
+                        # The last entry on the previous page
+                        cursor = pagination.make_cursor(
+                            LOG_ORDER,
+                            query.order_by(
+                                models.Log.timestamp.desc(),
+                                models.Log.object_id.desc()
+                            ).offset((page - 1) * PER_PAGE - 1).first(),
+                            True
+                        )
+
+                    keyset_ms = _time_ms(
+                        lambda: pagination.paginate(
+                            query, LOG_ORDER, cursor, PER_PAGE, # pylint: disable=cell-var-from-loop
+                            descending=True
+                        )
+                    )
+
+                    if cursor is not None:
+                        keyset_times.append(keyset_ms)
+
+                    total_ms = _time_ms(
+                        lambda: pagination.paginate(
+                            query, LOG_ORDER, cursor, PER_PAGE, # pylint: disable=cell-var-from-loop
+                            descending=True, with_total=True
+                        )
+                    )
+
+                    print '{0:>10} {1:>12.1f} {2:>12.1f} {3:>18.1f}'.format(
+                        page,
+                        offset_ms,
+                        keyset_ms,
+                        total_ms
+                    )
+
+                    page *= 10
+
+                if (keyset_times and
+                        keyset_times[-1] > keyset_times[0] * MAX_SLOWDOWN):
+                    print 'FAILED: keyset pagination slows down on deep pages'
+                    sys.exit(1)
+
+                print 'OK'
+            finally:
+                if scratch_file is not None:
+                    os.remove(scratch_file)
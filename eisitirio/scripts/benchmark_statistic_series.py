@@ -0,0 +1,144 @@
+# coding: utf-8
+"""Script to check that reading statistics for graphs stays flat over time."""
+
+from __future__ import unicode_literals
+from __future__ import division
+
+import datetime
+import os
+import sys
+import time
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+from eisitirio.helpers import benchmark
+from eisitirio.helpers import statistic_rollup
+
+APP = app.APP
+DB = db.DB
+
+GROUP = 'total_ticket_sales'
+STATISTICS = ['Ordered', 'Cancelled', 'Unpaid', 'Paid', 'Collected', 'Entered']
+SNAPSHOTS_PER_DAY = 72
+CHECKPOINT_DAYS = 15
+REPEATS = 3
+
+def record_day(day_start):
+    """Record a day's worth of statistics, as the cron job would."""
+    DB.session.execute(
+        models.Statistic.__table__.insert(),
+        [
+            {
+                'timestamp': day_start + datetime.timedelta(minutes=20 * index),
+                'group': GROUP,
+                'statistic': statistic,
+                'value': index,
+                'resolution': 'raw',
+            }
+            for index in xrange(SNAPSHOTS_PER_DAY)
+            for statistic in STATISTICS
+        ]
+    )
+    DB.session.commit()
+
+def _time_read_ms():
+    """Get the best time to read the series for the group in milliseconds.
+
+    Returns:
+        (float, int) the time, and the number of rows read.
+    """
+    best = None
+    rows = 0
+
+    for _ in xrange(REPEATS):
+        start = time.time()
+        rows = len(statistic_rollup.get_series(GROUP).all())
+        elapsed = (time.time() - start) * 1000
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, rows
+
+class BenchmarkStatisticSeriesCommand(script.Command):
+    """Flask-Script command for checking graph data reads over a season."""
+
+    help = 'Check that reading statistics for graphs stays flat over a season'
+
+    option_list = (
+        script.Option('--days', dest='days', type=int, default=120,
+                      help='Number of days of statistics to simulate'),
+        script.Option('--database', '-d', dest='database_uri', default=None,
+                      help=(
+                          'URI of an empty scratch database to use. Defaults '
+                          'to a temporary SQLite file'
+                      )),
+    )
+
+    @staticmethod
+    def run(days, database_uri):
+        """Record and compact statistics day by day, timing reads as it goes.
+
+        Fails if the number of rows read for a graph keeps growing once the
+        hourly resolution is full.
+        """
+        with APP.app_context():
+            scratch_file = benchmark.use_scratch_database(database_uri)
+
+            try:
+                start = datetime.datetime(2017, 1, 1)
+                hourly_full_day = max(
+                    (keep + datetime.timedelta(days=1)).days
+                    for _, _, keep, _ in statistic_rollup.get_tiers()
+                )
+                hourly_full_rows = None
+                compact_ms = 0.0
+
+                print '{0:>5} {1:>12} {2:>10} {3:>10} {4:>12}'.format(
+                    'Day',
+                    'Recorded',
+                    'Stored',
+                    'Read (ms)',
+                    'Compact (ms)'
+                )
+
+                for day in xrange(1, days + 1):
+                    record_day(start + datetime.timedelta(days=day - 1))
+
+                    compact_start = time.time()
+                    statistic_rollup.compact(
+                        start + datetime.timedelta(days=day)
+                    )
+                    compact_ms = max(compact_ms,
+                                     (time.time() - compact_start) * 1000)
+
+                    if day % CHECKPOINT_DAYS and day != days:
+                        continue
+
+                    read_ms, rows = _time_read_ms()
+
+                    if hourly_full_rows is None and day >= hourly_full_day:
+                        hourly_full_rows = rows
+
+                    print '{0:>5} {1:>12} {2:>10} {3:>10.1f} {4:>12.1f}'.format(
+                        day,
+                        day * SNAPSHOTS_PER_DAY * len(STATISTICS),
+                        rows,
+                        read_ms,
+                        compact_ms
+                    )
+
+                    compact_ms = 0.0
+
+                if hourly_full_rows is not None and rows > 2 * hourly_full_rows:
+                    print 'FAILED: rows read for a graph keep growing'
+                    sys.exit(1)
+
+                print 'OK'
+            finally:
+                if scratch_file is not None:
+                    os.remove(scratch_file)
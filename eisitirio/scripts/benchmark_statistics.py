@@ -0,0 +1,98 @@
+# coding: utf-8
+"""Script to benchmark statistics generation against a seeded database."""
+
+from __future__ import unicode_literals
+
+import os
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import models
+from eisitirio.database import static
+from eisitirio.helpers import benchmark
+from eisitirio.helpers import statistics
+
+APP = app.APP
+
+class BenchmarkStatisticsCommand(script.Command):
+    """Flask-Script command for benchmarking statistics generation."""
+
+    help = 'Benchmark statistics generation against a seeded scratch database'
+
+    option_list = (
+        script.Option('--tickets', '-t', dest='num_tickets', type=int,
+                      default=50000, help='Number of tickets to seed'),
+        script.Option('--database', '-d', dest='database_uri', default=None,
+                      help=(
+                          'URI of an empty scratch database to seed. Defaults '
+                          'to a temporary SQLite file'
+                      )),
+        script.Option('--repeat', '-r', dest='repeat', type=int, default=3,
+                      help='Number of runs to take the best time from'),
+    )
+
+    @staticmethod
+    def run(num_tickets, database_uri, repeat):
+        """Seed the scratch database and time each statistics group.
+
+        Each group is timed counting from scratch, followed by taking all of
+        the groups from the statistic counters as the cron job does.
+        """
+        with APP.app_context():
+            scratch_file = benchmark.use_scratch_database(database_uri)
+
+            try:
+                print 'Seeding {0} tickets...'.format(num_tickets)
+                benchmark.seed_database(num_tickets)
+
+                # Seeding bypasses the session, so the counters aren't set
+                models.StatisticCounter.rebuild()
+
+                groups = [
+                    (group, lambda group=group: statistics.get(group))
+                    for group in static.STATISTIC_GROUPS
+                ]
+                groups.append(('revenue', statistics.get_revenue))
+                groups.append((
+                    'snapshot (all groups)',
+                    lambda: [
+                        statistics.get_snapshot(group, counters)
+                        for counters in [models.StatisticCounter.get_values()]
+                        for group in static.STATISTIC_GROUPS
+                    ]
+                ))
+
+                print '{0:<25} {1:>8} {2:>12}'.format('Group', 'Queries',
+                                                      'Best (ms)')
+
+                total_queries = 0
+                total_time = 0.0
+
+                for name, function in groups:
+                    profiles = []
+
+                    for _ in xrange(repeat):
+                        with benchmark.Profile() as profile:
+                            function()
+
+                        profiles.append(profile)
+
+                    best = min(profiles, key=lambda profile: profile.elapsed)
+
+                    total_queries += best.queries
+                    total_time += best.elapsed_ms
+
+                    print '{0:<25} {1:>8} {2:>12.1f}'.format(
+                        name,
+                        best.queries,
+                        best.elapsed_ms
+                    )
+
+                print '{0:<25} {1:>8} {2:>12.1f}'.format('Total',
+                                                         total_queries,
+                                                         total_time)
+            finally:
+                if scratch_file is not None:
+                    os.remove(scratch_file)
@@ -0,0 +1,142 @@
+# coding: utf-8
+"""Script to check announcement recipients against the Python filter."""
+
+from __future__ import unicode_literals
+
+import itertools
+import os
+import sys
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+from eisitirio.helpers import benchmark
+
+APP = app.APP
+DB = db.DB
+
+CRITERIA = [
+    'has_tickets',
+    'holds_ticket',
+    'is_waiting',
+    'has_collected',
+    'has_uncollected',
+]
+
+def get_filters():
+    """Get the announcement criteria to check.
+
+    Each criterion is checked on its own, as the recipient query combines them
+    with AND just as the Python filter does, and checking every combination
+    would mean hundreds of passes over the users.
+
+    Yields:
+        (dict) keyword arguments for the Announcement constructor.
+    """
+    yield {}
+
+    for criterion, value in itertools.product(CRITERIA, [True, False]):
+        yield {criterion: value}
+
+    for college in models.College.query.all():
+        yield {'college': college}
+
+    for affiliation in models.Affiliation.query.all():
+        yield {'affiliation': affiliation}
+
+def check_filter(users, **kwargs):
+    """Compare the recipients selected in SQL and in Python for one filter.
+
+    Args:
+        users: (list(models.User)) all users.
+        kwargs: criteria to pass to the Announcement constructor.
+
+    Returns:
+        (set(int), set(int)) IDs of users only selected in SQL, and only
+        selected in Python.
+    """
+    announcement = models.Announcement('Check', 'Check', None, False,
+                                       **kwargs)
+
+    try:
+        # The announcement may have been cascaded into the session through the
+        # college or affiliation backref, but mustn't be flushed
+        with DB.session.no_autoflush:
+            in_sql = set(
+                object_id
+                for object_id, in announcement.get_recipient_query(
+                ).with_entities(models.User.object_id)
+            )
+            in_python = set(
+                recipient.object_id
+                for recipient in users
+                if announcement.matches(recipient)
+            )
+    finally:
+        if announcement in DB.session:
+            DB.session.rollback()
+
+    return in_sql - in_python, in_python - in_sql
+
+class CheckAnnouncementRecipientsCommand(script.Command):
+    """Flask-Script command for checking announcement recipient selection."""
+
+    help = (
+        'Check that the announcement recipient query selects the same users '
+        'as filtering in Python'
+    )
+
+    option_list = (
+        script.Option('--scratch', '-s', dest='num_tickets', type=int,
+                      default=None,
+                      help=(
+                          'Check against a temporary database seeded with this '
+                          'many tickets rather than the configured database'
+                      )),
+    )
+
+    @staticmethod
+    def run(num_tickets):
+        """Check each criterion on its own and report any differences."""
+        with APP.app_context():
+            scratch_file = None
+
+            if num_tickets is not None:
+                scratch_file = benchmark.use_scratch_database()
+                benchmark.seed_database(num_tickets)
+
+            try:
+                users = models.User.query.all()
+                mismatches = 0
+                checked = 0
+
+                for kwargs in get_filters():
+                    only_sql, only_python = check_filter(users, **kwargs)
+                    checked += 1
+
+                    if only_sql or only_python:
+                        mismatches += 1
+                        print (
+                            '{0}: {1} only in SQL, {2} only in Python'
+                        ).format(
+                            kwargs,
+                            sorted(only_sql),
+                            sorted(only_python)
+                        )
+
+                print (
+                    'Checked {0} filters against {1} users, {2} differ'
+                ).format(
+                    checked,
+                    len(users),
+                    mismatches
+                )
+            finally:
+                if scratch_file is not None:
+                    os.remove(scratch_file)
+
+            if mismatches:
+                sys.exit(1)
@@ -0,0 +1,85 @@
+# coding: utf-8
+"""Script to check the statistic counters against a full recompute."""
+
+from __future__ import unicode_literals
+
+import sys
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import models
+from eisitirio.database import static
+from eisitirio.helpers import statistics
+
+APP = app.APP
+
+def compare_statistics():
+    """Compare the statistics from the counters with those counted from scratch.
+
+    Returns:
+        (list((str, str, int, int))) the group, name, value from the counters
+        and value counted from scratch of each statistic which differs.
+    """
+    counters = models.StatisticCounter.get_values()
+
+    differences = []
+
+    for group in static.STATISTIC_GROUPS:
+        snapshot = statistics.get_snapshot(group, counters)
+        actual = statistics.get(group)
+
+        for name in actual:
+            if snapshot.get(name) != actual[name]:
+                differences.append((group, name, snapshot.get(name),
+                                    actual[name]))
+
+    return differences
+
+class CheckStatisticsCommand(script.Command):
+    """Flask-Script command for checking the statistic counters."""
+
+    help = 'Check the statistic counters against a full recompute'
+
+    option_list = (
+        script.Option('--fix', '-f', dest='fix', action='store_true',
+                      default=False,
+                      help='Rebuild the counters if they are wrong'),
+    )
+
+    @staticmethod
+    def run(fix):
+        """Report any statistics which differ, and optionally fix them."""
+        with APP.app_context():
+            differences = compare_statistics()
+
+            if not differences:
+                print 'All statistics match a full recompute.'
+                return
+
+            for group, name, snapshot, actual in differences:
+                print '{0}/{1}: counters give {2}, recompute gives {3}'.format(
+                    group,
+                    name,
+                    snapshot,
+                    actual
+                )
+
+            if not fix:
+                print 'Run with --fix to rebuild the counters.'
+                sys.exit(1)
+
+            changed = models.StatisticCounter.rebuild()
+
+            for (category, name), (old, new) in sorted(changed.iteritems()):
+                print 'Corrected {0}/{1}: {2} -> {3}'.format(
+                    category,
+                    name,
+                    old,
+                    new
+                )
+
+            if compare_statistics():
+                print 'Statistics still differ after rebuilding the counters.'
+                sys.exit(1)
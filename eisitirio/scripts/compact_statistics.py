@@ -0,0 +1,30 @@
+# coding: utf-8
+"""Script to downsample old statistics into coarser resolutions."""
+
+from __future__ import unicode_literals
+
+import datetime
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.helpers import statistic_rollup
+
+APP = app.APP
+
+class CompactStatisticsCommand(script.Command):
+    """Flask-Script command for compacting old statistics."""
+
+    help = 'Downsample old statistics into hourly and daily resolutions'
+
+    @staticmethod
+    def run():
+        """Compact the statistics, and report how many were removed."""
+        with APP.app_context():
+            kept, deleted = statistic_rollup.compact(datetime.datetime.utcnow())
+
+            print (
+                'Compacted statistics: kept {0} at a coarser resolution, '
+                'deleted {1}'
+            ).format(kept, deleted)
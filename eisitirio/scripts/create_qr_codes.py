@@ -1,72 +1,145 @@
 # coding: utf-8
+"""Script to generate QR code tickets and send them out to ball goers.
+
+Sending runs as a pipeline: the QR codes are rendered in a pool of processes
+while the emails are composed and added to the outbox in batches, and the
+outbox is then sent over a pool of SMTP connections. The outbox is sent under
+the same lock file as cron sends it under, and is left to cron if it's already
+being sent. Tickets without a barcode are given one in the same transaction as
+their email is added to the outbox, so an interrupted run never leaves a ticket
+with a new barcode but no email.
+
+The IDs of tickets whose emails have been added to the outbox are written to a
+checkpoint file as each batch is committed, so an interrupted run can be
+restarted without sending duplicate tickets. The checkpoint is removed once
+every ticket has been queued.
+"""
+
 from __future__ import unicode_literals
+from __future__ import division
 
-import pyqrcode
-import base64
-import io
+import collections
 import logging
+import multiprocessing
+import os
+import time
+
 import flask_script as script
 # from flask.ext import script
 from eisitirio import app
 from eisitirio.database import db
 from eisitirio.database import models
 from eisitirio.logic.custom_logic import ticket_logic
+from eisitirio.helpers import outbox
+from eisitirio.helpers import qr_codes
 from eisitirio.helpers import util
-from time import sleep
+from eisitirio.scripts import cron
+from eisitirio.scripts import send_outbox
 
 APP = app.APP
 DB = db.DB
 LOG = logging.getLogger(__name__)
 
+QUEUE_BATCH_SIZE = 100
+
+CHECKPOINT_FILE = './{0}_qr_tickets_checkpoint.txt'
+
 
 class CreateQRCodes(script.Command):
     """Generates ticket QR codes for tickets, and sends them out to ball goers"""
     help = 'Create and send QR codes for ball entrence'
 
+    option_list = (
+        script.Option('--new-only', '-n', dest='send_only_new',
+                      action='store_true', default=False,
+                      help='Only send tickets which have no barcode yet'),
+        script.Option('--processes', '-p', dest='processes', type=int,
+                      default=None,
+                      help=(
+                          'Number of processes to render QR codes with. '
+                          'Defaults to the number of CPUs'
+                      )),
+        script.Option('--connections', '-c', dest='connections', type=int,
+                      default=4, help='Number of SMTP connections to use'),
+        script.Option('--checkpoint', dest='checkpoint', default=None,
+                      help='Path of the checkpoint file for resuming'),
+    )
+
     @staticmethod
-    def run():
+    def run(send_only_new, processes, connections, checkpoint):
         with app.APP.app_context():
-            send_claim_codes(send_only_new=False)
+            send_claim_codes(send_only_new, processes, connections,
+                             checkpoint)
 
-def generate_barcodes(send_only_new):
-    """Given a ticket, generate a 20 character long unique ID for each ticket.
-    This will then be used in the QR code that we generate.
+def get_tickets_to_send(send_only_new):
+    """Get the tickets to send QR codes for.
 
-    This returns the tickets that will then be used by 'send_claim_codes'.
+    Every paid, uncancelled ticket with a holder is sent a QR code.
 
+    Args:
+        send_only_new: (bool) whether to only get tickets which don't have a
+            barcode yet, rather than all tickets with a holder.
+
+    Returns:
+        (list((int, str, str, bool))) the ID, barcode (or None), type and
+        whether each ticket has been used for entry, in order of ID.
     """
-    # Get all the tickets that need to have barcodes added to them
-    tickets = []
+    query = DB.session.query(
+        models.Ticket.object_id,
+        models.Ticket.barcode,
+        models.Ticket.ticket_type,
+        models.Ticket.entered
+    ).filter(
+        # Ticket has a holder
+        models.Ticket.holder_id != None,
+        # The ticket is paid for.
+        models.Ticket.paid,
+        # The ticket has not been cancelled.
+        models.Ticket.cancelled == False
+    )
+
     if send_only_new:
-        tickets = models.Ticket.query.filter(
-            # We have not sent them an email yet (it has not been "claimed")
-            models.Ticket.barcode == None,
-            # Ticket has a holder
-            models.Ticket.holder_id != None,
-            # The ticket is paid for.
-            models.Ticket.paid,
-            # The ticket has not been cancelled.
-            models.Ticket.cancelled == False
-        ).all()
-    else:
-        tickets = models.Ticket.query.filter(
-            # Ticket has a holder
-            models.Ticket.holder_id != None,
-            # The ticket is paid for.
-            models.Ticket.paid,
-            # The ticket has not been cancelled.
-            models.Ticket.cancelled == False
-        ).all()
-
-    for ticket in tickets:
-        if not ticket.barcode: # Need to generate a bar code
-            # Generate a unique key for this ticket.
-            key = util.generate_key(20).decode('utf-8')
-            # and add it
-            ticket.barcode = key
-            DB.session.commit()
-    # Return the tickets
-    return tickets
+        query = query.filter(models.Ticket.barcode == None) # pylint: disable=singleton-comparison
+
+    return query.order_by(
+        models.Ticket.object_id
+    ).all()
+
+def save_barcodes(new_barcodes):
+    """Save the barcodes generated for a batch of tickets.
+
+    The tickets are updated in bulk, and the statistics adjusted to match, in
+    the current transaction.
+
+    Args:
+        new_barcodes: (list((int, str, str, bool))) the ID, new barcode, type
+            and whether each ticket has been used for entry.
+    """
+    if not new_barcodes:
+        return
+
+    deltas = collections.defaultdict(int)
+
+    for _, _, ticket_type, entered in new_barcodes:
+        deltas[models.StatisticCounter.ticket_state_key(
+            ticket_type, False, True, False, entered
+        )] -= 1
+        deltas[models.StatisticCounter.ticket_state_key(
+            ticket_type, False, True, True, entered
+        )] += 1
+
+    DB.session.bulk_update_mappings(models.Ticket, [
+        {'object_id': object_id, 'barcode': barcode}
+        for object_id, barcode, _, _ in new_barcodes
+    ])
+    # The bulk update bypasses the session, so adjust the statistics here
+    models.StatisticCounter.adjust(deltas)
+
+def _render_qr_task(task):
+    """Get a QR code in a pool process, see qr_codes.get_qr."""
+    ticket_id, barcode = task
+
+    return ticket_id, qr_codes.get_qr(ticket_id, barcode)
 
 def generate_ticket_qr(ticket):
     """
@@ -77,74 +150,167 @@ def generate_ticket_qr(ticket):
     the ticket 'object_id'. This way, people can't go and make their own ticket
     QR codes.
     """
-    qrcode_img = pyqrcode.create('{0},{1}'.format(ticket.object_id,
-                                                  ticket.barcode))
-    buffer = io.BytesIO()
-    qrcode_img.png(buffer, scale=20)
-    return buffer.getvalue()
-
-def send_claim_code(user):
-    """Send qr code to user that holds ticket"""
-    if not user.held_ticket:
-        LOG.info("Not generating for user {0} since they don't hold a ticket".format(user.full_name.encode('utf-8')))
-        return False
-    elif user.held_ticket.barcode is None:
-        LOG.error("User {0} has a held ticket, but unable to send it to them since there is no barcode for ticket {1}".format(user.full_name.encode('utf-8'), user.held_ticket.object_id))
-        return False
-    else:
-        qr_code = generate_ticket_qr(user.held_ticket)
-        if qr_code is None:
-            LOG.error("User {0} has a held ticket, but QR generation failed for {1}".format(
-                user.full_name.encode('utf-8'), user.held_ticket.object_id ))
-            return False
-        else:
-            APP.email_manager.send_image_html(
-                user.email,
-                'Your Ball Entrance Ticket',
-                'ball_ticket.email',
-                qr_code,
-                user=user
-            )
-            LOG.info("Sent ticket to {0} holding ticket {1}----{2}".format(user.full_name.encode('utf-8'), user.held_ticket.object_id, user.held_ticket.barcode))
-        return True
-
-def send_chunk(tickets):
-    successes = 0
-    failures = 0
-
-    for ticket in tickets:
-        try:
-            if send_claim_code(ticket.holder):
-                successes = successes + 1
-                print '[Sent: {0}]'.format(ticket.object_id)
-                LOG.info('[{0}] sent QR code to: {1}'.format(ticket.object_id, ticket.holder.full_name.encode('utf-8')))
-            else:
-                ticket.barcode = None
-                DB.session.commit()
-                LOG.error("Failed to send ticket to {0}".format(ticket.holder.full_name.encode('utf-8')))
-                print '[Failed to Send: {0}]'.format(ticket.object_id)
-                failures = failures + 1
-        except:
-            # We've failed to send this one out, so mark it for review
-            ticket.barcode = None
-            DB.session.commit()
-            failures = failures + 1
-            LOG.error("[EXCEPTION] Possibly failed to send ticket to: {0}".format(ticket.holder.full_name.encode('utf-8')))
-        sleep(0.5)
-
-    print "All done sending claim codes. Total #codes that we should have sent: {0}".format(len(tickets))
-    print "Total that were sent successfully: {0}".format(successes)
-    print "Total that we failed to send successfully: {0}".format(failures)
-
-def send_claim_codes(send_only_new=True):
-    """Generate barcodes, and send claim codes to all users.
-    NOTE: We keep track of the tickets that we have sent out already via
-        barcode generation. Thus, if we generate barcodes and don't send then
-        we won't send those we generated barcodes for.
-    NOTE: if send_only_new is False, then we will send an email with a claim
-        code to _all_ users that hold a ticket, whether or not they have previously
-        been sent one. Be careful!!
+    return qr_codes.get_qr(ticket.object_id, ticket.barcode)
+
+def read_checkpoint(checkpoint):
+    """Get the IDs of tickets already queued by an interrupted run."""
+    if not os.path.exists(checkpoint):
+        return set()
+
+    with open(checkpoint, 'r') as file_handle:
+        return set(int(line) for line in file_handle if line.strip())
+
+def queue_tickets(to_send, processes, checkpoint):
+    """Render the QR codes for tickets and add the emails to the outbox.
+
+    Tickets without a barcode are given one, which is saved in the same
+    transaction as the batch of emails it's sent in.
+
+    Args:
+        to_send: (list((int, str, str, bool))) the tickets to send, as
+            returned by get_tickets_to_send.
+        processes: (int or None) number of processes to render QR codes with.
+        checkpoint: (str) path of the checkpoint file to record progress in.
+
+    Returns:
+        (int) the number of tickets queued.
     """
-    tickets = generate_barcodes(send_only_new)
+    ticket_ids = [ticket[0] for ticket in to_send]
+
+    # Barcodes are generated up front so the QR codes can be rendered ahead of
+    # the emails being queued, but only saved with each batch
+    barcodes = {}
+    new_barcodes = {}
+
+    for object_id, barcode, ticket_type, entered in to_send:
+        if not barcode:
+            barcode = util.generate_key(20).decode('utf-8')
+            new_barcodes[object_id] = (object_id, barcode, ticket_type,
+                                       entered)
+
+        barcodes[object_id] = barcode
+
+    tickets = {
+        ticket.object_id: ticket
+        for ticket in models.Ticket.query.filter(
+            models.Ticket.object_id.in_(ticket_ids)
+        ).options(
+            DB.joinedload(models.Ticket.holder)
+        )
+    } if ticket_ids else {}
+
+    start = time.time()
+    queued = []
+    checkpointed = 0
+
+    pool = multiprocessing.Pool(processes)
+
+    try:
+        with open(checkpoint, 'a') as checkpoint_file:
+            for ticket_id, qr_code in pool.imap(
+                    _render_qr_task,
+                    [(ticket_id, barcodes[ticket_id])
+                     for ticket_id in ticket_ids],
+                    chunksize=16
+            ):
+                holder = tickets[ticket_id].holder
+
+                APP.email_manager.queue_message(
+                    APP.email_manager.compose_image_html(
+                        holder.email,
+                        'Your Ball Entrance Ticket',
+                        'ball_ticket.email',
+                        qr_code,
+                        user=holder
+                    ),
+                    commit=False
+                )
+
+                queued.append(ticket_id)
+
+                if (
+                        len(queued) % QUEUE_BATCH_SIZE == 0 or
+                        len(queued) == len(ticket_ids)
+                ):
+                    save_barcodes([
+                        new_barcodes[object_id]
+                        for object_id in queued[checkpointed:]
+                        if object_id in new_barcodes
+                    ])
+
+                    DB.session.commit()
+
+                    checkpoint_file.write(''.join(
+                        '{0}\n'.format(object_id)
+                        for object_id in queued[checkpointed:]
+                    ))
+                    checkpoint_file.flush()
+                    checkpointed = len(queued)
+
+                    elapsed = time.time() - start
+
+                    print 'Queued {0}/{1} tickets ({2:.1f}/s)'.format(
+                        len(queued),
+                        len(ticket_ids),
+                        len(queued) / elapsed if elapsed else 0
+                    )
+    finally:
+        pool.terminate()
+
+    return len(queued)
+
+def send_claim_codes(send_only_new=True, processes=None, connections=4,
+                     checkpoint=None):
+    """Generate barcodes, and send QR code tickets to all ticket holders.
+
+    NOTE: if send_only_new is False, then we will send an email with a QR
+        code to _all_ users that hold a ticket, whether or not they have
+        previously been sent one (unless a checkpoint from an interrupted run
+        says they have). Be careful!!
+
+    Args:
+        send_only_new: (bool) whether to only send tickets which didn't have a
+            barcode yet.
+        processes: (int or None) number of processes to render QR codes with.
+            Defaults to the number of CPUs.
+        connections: (int) number of SMTP connections to send with.
+        checkpoint: (str or None) path of the checkpoint file. Defaults to
+            CHECKPOINT_FILE for the environment, in the current directory.
+    """
+    if checkpoint is None:
+        checkpoint = os.path.abspath(
+            CHECKPOINT_FILE.format(APP.config['ENVIRONMENT'])
+        )
+
+    already_queued = read_checkpoint(checkpoint)
+
+    if already_queued:
+        print 'Resuming, {0} tickets were already queued'.format(
+            len(already_queued)
+        )
+
+    to_send = [
+        ticket
+        for ticket in get_tickets_to_send(send_only_new)
+        if ticket[0] not in already_queued
+    ]
+
+    LOG.info('Queueing QR code tickets for %d tickets', len(to_send))
+
+    queue_tickets(to_send, processes, checkpoint)
+
+    # Every ticket is in the outbox, so a rerun should start afresh
+    os.remove(checkpoint)
+
+    # Cron sends the outbox too, and two workers sending it at once could send
+    # the same emails twice
+    lockfile = cron.get_outbox_lock_file()
+
+    if os.path.exists(lockfile):
+        print 'The outbox is already being sent, the tickets will be sent with it'
+        return
+
+    with cron.file_lock(lockfile):
+        stats = outbox.OutboxWorker(APP.email_manager, connections).drain()
 
-    send_chunk(tickets)
+    send_outbox.print_stats(stats)
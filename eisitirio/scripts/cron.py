@@ -7,6 +7,7 @@ import contextlib
 import datetime
 import os
 import sys
+import time
 
 
 import flask_script as script
@@ -18,7 +19,9 @@ from eisitirio.database import db
 from eisitirio.database import models
 from eisitirio.database import static
 from eisitirio.helpers import email_manager
+from eisitirio.helpers import outbox
 from eisitirio.helpers import statistic_plots
+from eisitirio.helpers import statistic_rollup
 from eisitirio.helpers import statistics
 from eisitirio.logic import purchase_logic
 
@@ -41,6 +44,12 @@ def file_lock(lock_file):
         finally:
             os.remove(lock_file)
 
+def get_outbox_lock_file():
+    """Get the path of the lock file held while the outbox is being sent."""
+    return os.path.abspath(
+        './{}.outbox.lock'.format(APP.config['ENVIRONMENT'])
+    )
+
 def get_last_run_time(timestamp_file):
     """Get the time at which the set of tasks was last run.
 
@@ -160,35 +169,81 @@ def remove_expired_secret_keys(now):
     DB.session.commit()
 
 def delete_old_statistics(now):
-    """Delete statistics which are older than the limit."""
+    """Delete statistics which are older than the limit.
+
+    Deleted a group at a time, so that the index on group and timestamp can be
+    used to find them.
+    """
     statistic_limit = now - APP.config['STATISTICS_KEEP']
 
-    models.Statistic.query.filter(
-        models.Statistic.timestamp < statistic_limit
-    ).delete()
+    for group in static.STATISTIC_GROUPS:
+        models.Statistic.query.filter(
+            models.Statistic.group == group
+        ).filter(
+            models.Statistic.timestamp < statistic_limit
+        ).delete()
 
     DB.session.commit()
 
 def generate_statistics():
-    """Generate statistics for all groups."""
+    """Record the current statistics for all groups from the counters."""
+    counters = models.StatisticCounter.get_values()
+
     for group in static.STATISTIC_GROUPS:
         DB.session.add_all(
             models.Statistic(
                 group,
                 name,
                 value
-            ) for name, value in statistics.get(group).iteritems()
+            ) for name, value in statistics.get_snapshot(
+                group,
+                counters
+            ).iteritems()
         )
 
-        DB.session.commit()
+    DB.session.commit()
 
 def draw_graphs():
-    """Generate graphs for all statistics groups."""
-    if not os.path.exists(APP.config['GRAPH_STORAGE_FOLDER']):
-        os.makedirs(APP.config['GRAPH_STORAGE_FOLDER'])
+    """Draw graphs for any statistics groups which have changed."""
+    start = time.time()
 
-    for group in static.STATISTIC_GROUPS:
-        statistic_plots.create_plot(group)
+    timings = statistic_plots.draw_graphs(
+        static.STATISTIC_GROUPS,
+        APP.config.get('GRAPH_RENDER_PROCESSES')
+    )
+
+    for group, elapsed in timings:
+        if elapsed is None:
+            print 'Graph {0}: unchanged'.format(group)
+        else:
+            print 'Graph {0}: rendered in {1:.0f}ms'.format(group, elapsed)
+
+    print 'Drew {0} of {1} graphs in {2:.0f}ms'.format(
+        sum(1 for _, elapsed in timings if elapsed is not None),
+        len(timings),
+        (time.time() - start) * 1000
+    )
+
+def send_outbox():
+    """Send the emails waiting in the outbox.
+
+    Skipped if the outbox is already being sent, e.g. by the send_outbox
+    command left running with --poll.
+    """
+    lockfile = get_outbox_lock_file()
+
+    if os.path.exists(lockfile):
+        return
+
+    with file_lock(lockfile):
+        stats = outbox.OutboxWorker(APP.email_manager).drain()
+
+    if stats.sent or stats.retrying or stats.failed:
+        print 'Sent {0} emails, {1} to retry, {2} failed'.format(
+            stats.sent,
+            stats.retrying,
+            stats.failed
+        )
 
 def run_5_minutely(now):
     """Run tasks which need to be run every 5 minutes.
@@ -214,6 +269,8 @@ def run_5_minutely(now):
 
     remove_expired_secret_keys(now)
 
+    send_outbox()
+
 def run_20_minutely(now):
     """Run tasks which need to be run every 20 minutes.
 
@@ -233,6 +290,8 @@ def run_20_minutely(now):
 
     delete_old_statistics(now)
 
+    statistic_rollup.compact(now)
+
     generate_statistics()
 
     draw_graphs()
@@ -0,0 +1,128 @@
+# coding: utf-8
+"""Script to check that the hottest queries are served by an index."""
+
+from __future__ import unicode_literals
+
+import datetime
+import os
+import sys
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import models
+from eisitirio.helpers import benchmark
+from eisitirio.helpers import statistic_rollup
+
+APP = app.APP
+
+def get_hot_queries(now):
+    """Get the queries run on every request or cron tick.
+
+    Returns:
+        (list((str, sqlalchemy.orm.Query))) description and query for each of
+        the queries which must be able to use an index.
+    """
+    return [
+        (
+            'Check-in barcode lookup',
+            models.Ticket.query.filter(
+                models.Ticket.barcode == 'ABCDEFGHIJKLMNOPQRST'
+            )
+        ),
+        (
+            'Login email lookup',
+            models.User.query.filter(
+                models.User.email == 'user@example.com'
+            )
+        ),
+        (
+            'Cron expired ticket sweep',
+            models.Ticket.query.filter(
+                models.Ticket.expires != None
+            ).filter(
+                models.Ticket.expires < now
+            ).filter(
+                models.Ticket.cancelled == False # pylint: disable=singleton-comparison
+            ).filter(
+                models.Ticket.paid == False # pylint: disable=singleton-comparison
+            )
+        ),
+        (
+            'Cron expired secret key sweep',
+            models.User.query.filter(
+                models.User.secret_key_expiry != None
+            ).filter(
+                models.User.secret_key_expiry < now
+            )
+        ),
+        (
+            'Ticket type availability count',
+            models.Ticket.query.filter(
+                models.Ticket.ticket_type == 'standard'
+            ).filter(
+                models.Ticket.cancelled == False # pylint: disable=singleton-comparison
+            )
+        ),
+        (
+            'Statistics graph series',
+            statistic_rollup.get_series('total_ticket_sales')
+        ),
+        (
+            'Log search by time range',
+            models.Log.query.filter(
+                models.Log.timestamp >= now - datetime.timedelta(days=1)
+            ).order_by(
+                models.Log.timestamp.desc()
+            )
+        ),
+    ]
+
+class ExplainQueriesCommand(script.Command):
+    """Flask-Script command for checking query plans of hot queries."""
+
+    help = 'Check that the hottest queries use an index'
+
+    option_list = (
+        script.Option('--scratch', '-s', dest='scratch', action='store_true',
+                      default=False,
+                      help=(
+                          'Check against the schema in a temporary SQLite '
+                          'database rather than the configured database'
+                      )),
+    )
+
+    @staticmethod
+    def run(scratch):
+        """Explain each of the hot queries and report which indexes they use.
+
+        Exits with a non-zero status if any of the queries would require a
+        full table scan.
+        """
+        with APP.app_context():
+            scratch_file = None
+
+            if scratch:
+                scratch_file = benchmark.use_scratch_database()
+
+            try:
+                failures = 0
+
+                for description, query in get_hot_queries(
+                        datetime.datetime.utcnow()
+                ):
+                    indexes = benchmark.indexes_used(benchmark.explain(query))
+
+                    if indexes:
+                        print '[OK]   {0}: {1}'.format(description,
+                                                       ', '.join(indexes))
+                    else:
+                        print '[SCAN] {0}'.format(description)
+                        failures += 1
+            finally:
+                if scratch_file is not None:
+                    os.remove(scratch_file)
+
+            if failures:
+                sys.exit(1)
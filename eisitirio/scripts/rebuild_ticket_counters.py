@@ -0,0 +1,44 @@
+# coding: utf-8
+"""Script to rebuild the materialised ticket counters from the ticket table."""
+
+from __future__ import unicode_literals
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import models
+
+APP = app.APP
+
+class RebuildTicketCountersCommand(script.Command):
+    """Flask-Script command for rebuilding the ticket counters."""
+
+    help = 'Rebuild the ticket availability counters from the ticket table'
+
+    @staticmethod
+    def run():
+        """Rebuild the counters and report any which had drifted."""
+        with APP.app_context():
+            changed = models.TicketCounter.rebuild([
+                ticket_type.slug for ticket_type in APP.config['TICKET_TYPES']
+            ])
+
+            if not changed:
+                print 'All ticket counters were correct.'
+
+            for ticket_type, (active, cancelled) in sorted(
+                    changed.iteritems()
+            ):
+                counter = models.TicketCounter.get_by_ticket_type(ticket_type)
+
+                print (
+                    'Corrected {0}: active {1} -> {2}, '
+                    'cancelled {3} -> {4}'
+                ).format(
+                    ticket_type,
+                    active,
+                    counter.active,
+                    cancelled,
+                    counter.cancelled
+                )
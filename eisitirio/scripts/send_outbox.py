@@ -0,0 +1,68 @@
+# coding: utf-8
+"""Worker to send the emails waiting in the outbox.
+
+Cron sends the outbox every 5 minutes. This can be left running with --poll to
+send emails sooner.
+"""
+
+from __future__ import unicode_literals
+
+import time
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio import system # pylint: disable=unused-import
+from eisitirio.helpers import outbox
+from eisitirio.scripts import cron
+
+APP = app.APP
+
+def print_stats(stats):
+    """Print how many emails were sent and how quickly."""
+    print (
+        'Sent {0} emails in {1:.1f}s ({2:.1f}/s), {3} to retry, {4} failed'
+    ).format(
+        stats.sent,
+        stats.elapsed,
+        stats.sent / stats.elapsed if stats.elapsed else 0,
+        stats.retrying,
+        stats.failed
+    )
+
+class SendOutboxCommand(script.Command):
+    """Flask-Script command for sending the emails in the outbox."""
+
+    help = 'Send pending emails from the outbox'
+
+    option_list = (
+        script.Option('--connections', '-c', dest='num_connections', type=int,
+                      default=4, help='Number of SMTP connections to use'),
+        script.Option('--limit', '-l', dest='limit', type=int, default=None,
+                      help='Maximum number of emails to send'),
+        script.Option('--poll', '-p', dest='poll', type=int, default=None,
+                      help=(
+                          'Keep running, checking for new emails every this '
+                          'many seconds'
+                      )),
+    )
+
+    @staticmethod
+    def run(num_connections, limit, poll):
+        """Check the lock and drain the outbox."""
+        with cron.file_lock(cron.get_outbox_lock_file()):
+            with APP.app_context():
+                worker = outbox.OutboxWorker(APP.email_manager,
+                                             num_connections)
+
+                while True:
+                    stats = worker.drain(limit)
+
+                    if stats.sent or stats.retrying or stats.failed:
+                        print_stats(stats)
+
+                    if poll is None:
+                        break
+
+                    time.sleep(poll)
@@ -0,0 +1,160 @@
+# coding: utf-8
+"""Script to check that concurrent purchases can't oversell tickets."""
+
+from __future__ import unicode_literals
+
+import os
+import sys
+import tempfile
+import threading
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+from eisitirio.helpers import benchmark
+from eisitirio.logic import purchase_logic
+
+APP = app.APP
+DB = db.DB
+
+def _buy(barrier, ticket_type, number, results):
+    """Reserve and buy tickets as a single buyer would.
+
+    Args:
+        barrier: (threading.Event) event to wait on before buying, so that all
+            buyers start at once.
+        ticket_type: (TicketType) the type of ticket to buy.
+        number: (int) how many tickets to buy.
+        results: (list) list to append the outcome to.
+    """
+    with APP.app_context():
+        owner = models.User.query.first()
+
+        barrier.wait()
+
+        try:
+            if purchase_logic.reserve_tickets({ticket_type.slug: number}):
+                results.append('refused')
+                return
+
+            DB.session.add_all([
+                models.Ticket(owner, ticket_type.slug, ticket_type.price)
+                for _ in xrange(number)
+            ])
+            DB.session.commit()
+
+            results.append('bought')
+        except Exception as err: # pylint: disable=broad-except
+            DB.session.rollback()
+            results.append(repr(err))
+        finally:
+            DB.session.remove()
+
+class StressReservationsCommand(script.Command):
+    """Flask-Script command for stress testing ticket reservations."""
+
+    help = 'Check that concurrent buyers can\'t oversell guest tickets'
+
+    option_list = (
+        script.Option('--buyers', '-b', dest='num_buyers', type=int,
+                      default=200, help='Number of concurrent buyers'),
+        script.Option('--tickets', '-t', dest='tickets_per_buyer', type=int,
+                      default=2, help='Number of tickets each buyer orders'),
+        script.Option('--available', '-a', dest='available', type=int,
+                      default=100, help='Number of guest tickets available'),
+        script.Option('--database', '-d', dest='database_uri', default=None,
+                      help=(
+                          'URI of an empty scratch database to use. Defaults '
+                          'to a temporary SQLite file'
+                      )),
+    )
+
+    @staticmethod
+    def run(num_buyers, tickets_per_buyer, available, database_uri):
+        """Race the buyers against each other and check the totals."""
+        scratch_file = None
+
+        if database_uri is None:
+            handle, scratch_file = tempfile.mkstemp(suffix='.sqlite')
+            os.close(handle)
+            # Buyers queue on the SQLite write lock, so wait for it
+            database_uri = 'sqlite:///{0}?timeout=60'.format(scratch_file)
+
+        try:
+            with APP.app_context():
+                benchmark.use_scratch_database(database_uri)
+                benchmark.seed_database(0)
+
+            APP.config['GUEST_TICKETS_AVAILABLE'] = available
+
+            ticket_type = APP.config['TICKET_TYPES_BY_SLUG'][
+                APP.config['GUEST_TYPE_SLUGS'][0]
+            ]
+
+            barrier = threading.Event()
+            results = []
+
+            threads = [
+                threading.Thread(
+                    target=_buy,
+                    args=(barrier, ticket_type, tickets_per_buyer, results)
+                )
+                for _ in xrange(num_buyers)
+            ]
+
+            for thread in threads:
+                thread.start()
+
+            barrier.set()
+
+            for thread in threads:
+                thread.join()
+
+            with APP.app_context():
+                sold = models.Ticket.query.filter(
+                    models.Ticket.ticket_type.in_(
+                        APP.config['GUEST_TYPE_SLUGS']
+                    )
+                ).filter(
+                    models.Ticket.cancelled == False # pylint: disable=singleton-comparison
+                ).count()
+
+                counted = sum(
+                    count
+                    for slug, count in (
+                        models.TicketCounter.get_active_counts().iteritems()
+                    )
+                    if slug in APP.config['GUEST_TYPE_SLUGS']
+                )
+
+            errors = [
+                result
+                for result in results
+                if result not in ('bought', 'refused')
+            ]
+
+            print '{0} buyers bought, {1} refused, {2} failed'.format(
+                results.count('bought'),
+                results.count('refused'),
+                len(errors)
+            )
+            print '{0} of {1} guest tickets sold, counters say {2}'.format(
+                sold,
+                available,
+                counted
+            )
+
+            for error in sorted(set(errors)):
+                print '  {0}'.format(error)
+
+            if sold > available or sold != counted or errors:
+                print 'FAILED'
+                sys.exit(1)
+
+            print 'OK'
+        finally:
+            if scratch_file is not None:
+                os.remove(scratch_file)
@@ -0,0 +1,119 @@
+# coding: utf-8
+"""Script to check that the QR code served for every ticket reads correctly."""
+
+from __future__ import unicode_literals
+from __future__ import division
+
+import multiprocessing
+import sys
+import time
+
+import flask_script as script
+# from flask.ext import script
+
+from eisitirio import app
+from eisitirio.database import db
+from eisitirio.database import models
+from eisitirio.helpers import qr_codes
+
+APP = app.APP
+DB = db.DB
+
+PAGE_SIZE = 500
+
+def get_ticket_pages(page_size=PAGE_SIZE):
+    """Get the ID and barcode of every ticket with a QR code, a page at a time.
+
+    Pages are fetched by ticket ID rather than by offset, so each page costs
+    the same however far through the tickets it is.
+
+    Args:
+        page_size: (int) how many tickets to fetch at once.
+
+    Returns:
+        (generator(list((int, str)))) the pages of tickets.
+    """
+    last_id = 0
+
+    while True:
+        page = DB.session.query(
+            models.Ticket.object_id,
+            models.Ticket.barcode
+        ).filter(
+            models.Ticket.barcode != None, # pylint: disable=singleton-comparison
+            models.Ticket.holder_id != None, # pylint: disable=singleton-comparison
+            models.Ticket.object_id > last_id
+        ).order_by(
+            models.Ticket.object_id
+        ).limit(page_size).all()
+
+        if not page:
+            return
+
+        yield [(object_id, barcode) for object_id, barcode in page]
+
+        last_id = page[-1][0]
+
+def _verify_qr_task(task):
+    """Verify a QR code in a pool process, see qr_codes.verify_qr."""
+    ticket_id, barcode = task
+
+    return ticket_id, qr_codes.verify_qr(ticket_id, barcode)
+
+class VerifyQRCodesCommand(script.Command):
+    """Flask-Script command for checking every ticket's QR code."""
+
+    help = 'Check that the QR code served for every ticket reads correctly'
+
+    option_list = (
+        script.Option('--processes', '-p', dest='processes', type=int,
+                      default=None,
+                      help=(
+                          'Number of processes to check QR codes with. '
+                          'Defaults to the number of CPUs'
+                      )),
+        script.Option('--page-size', dest='page_size', type=int,
+                      default=PAGE_SIZE,
+                      help='Number of tickets to fetch at once'),
+    )
+
+    @staticmethod
+    def run(processes, page_size):
+        """Check each ticket's QR code and report any which are wrong."""
+        start = time.time()
+        checked = 0
+        failures = []
+
+        pool = multiprocessing.Pool(processes)
+
+        try:
+            with APP.app_context():
+                for page in get_ticket_pages(page_size):
+                    for ticket_id, error in pool.imap(
+                            _verify_qr_task,
+                            page,
+                            chunksize=16
+                    ):
+                        if error is not None:
+                            failures.append((ticket_id, error))
+
+                    checked += len(page)
+
+                    print 'Checked {0} QR codes ({1:.1f}/s)'.format(
+                        checked,
+                        checked / (time.time() - start)
+                    )
+        finally:
+            pool.terminate()
+
+        print '{0} of {1} QR codes failed in {2:.1f}s'.format(
+            len(failures),
+            checked,
+            time.time() - start
+        )
+
+        for ticket_id, error in failures:
+            print '  Ticket {0}: {1}'.format(ticket_id, error)
+
+        if failures:
+            sys.exit(1)
@@ -41,14 +41,20 @@ def check_for_maintenance():
 
     Created as early as possible to ensure it is called before
     login_manager.login_user
+
+    The config is only loaded once per process, so MAINTENANCE_MODE is set
+    from the file on every request, and goes back off when it's removed.
     """
-    if os.path.exists(APP.config['MAINTENANCE_FILE_PATH']):
-        APP.config['MAINTENANCE_MODE'] = True
-        if (
-                'maintenance' not in flask.request.path and
-                'static' not in flask.request.path
-        ):
-            return flask.redirect(flask.url_for('maintenance'))
+    APP.config['MAINTENANCE_MODE'] = os.path.exists(
+        APP.config['MAINTENANCE_FILE_PATH']
+    )
+
+    if (
+            APP.config['MAINTENANCE_MODE'] and
+            'maintenance' not in flask.request.path and
+            'static' not in flask.request.path
+    ):
+        return flask.redirect(flask.url_for('maintenance'))
 
 log_manager.LogManager(APP)
 email_manager.EmailManager(APP)
@@ -3,9 +3,6 @@
 
 from __future__ import unicode_literals
 
-import csv
-import StringIO
-
 from dateutil import parser
 import flask_login as login
 # from flask.ext import login
@@ -14,7 +11,11 @@ import flask
 from eisitirio import app
 from eisitirio.database import db
 from eisitirio.database import models
+from eisitirio.helpers import log_archive
 from eisitirio.helpers import login_manager
+from eisitirio.helpers import pagination
+from eisitirio.helpers import reference_data
+from eisitirio.helpers import unicode_csv
 from eisitirio.helpers import util
 
 APP = app.APP
@@ -22,11 +23,13 @@ DB = db.DB
 
 ADMIN = flask.Blueprint('admin', __name__)
 
+LOG_ORDER = [models.Log.timestamp, models.Log.object_id]
+
 @ADMIN.route('/admin', methods=['GET', 'POST'])
-@ADMIN.route('/admin/page/<int:page>', methods=['GET', 'POST'])
+@ADMIN.route('/admin/results/<cursor>', methods=['GET', 'POST'])
 @login.login_required
 @login_manager.admin_required
-def admin_home(page=1):
+def admin_home(cursor=None):
     """Admin homepage, search for users, tickets or log entries.
 
     Displays a form with lots of filters on users, tickets and log entries. On
@@ -39,8 +42,8 @@ def admin_home(page=1):
         return flask.render_template(
             'admin/admin_home.html',
             form={},
-            colleges=models.College.query.all(),
-            affiliations=models.Affiliation.query.all(),
+            colleges=reference_data.get_colleges(),
+            affiliations=reference_data.get_affiliations(),
             results=None,
             category=None
         )
@@ -251,8 +254,6 @@ def admin_home(page=1):
         )
         has_log_filter = True
 
-    log_query = log_query.order_by(models.Log.timestamp.desc())
-
     query = None
     model = None
     category = None
@@ -279,6 +280,8 @@ def admin_home(page=1):
         query = user_query
         model = models.User
         category = 'User'
+        sort_key = [models.User.object_id]
+        descending = False
     elif flask.request.form['search'] == 'ticket':
         if has_user_filter:
             ticket_query = ticket_query.join(
@@ -295,6 +298,8 @@ def admin_home(page=1):
         query = ticket_query
         model = models.Ticket
         category = 'Ticket'
+        sort_key = [models.Ticket.object_id]
+        descending = False
     elif flask.request.form['search'] == 'log':
         if has_user_filter:
             if flask.request.form['log_user'] == 'Actor':
@@ -317,32 +322,40 @@ def admin_home(page=1):
         query = log_query
         model = models.Log
         category = 'Log'
+        sort_key = LOG_ORDER
+        descending = True
 
     if (
             'action' in flask.request.form and
             flask.request.form['action'] == 'Export'
     ):
-        csvdata = StringIO.StringIO()
-        csvwriter = csv.writer(csvdata)
-
-        model.write_csv_header(csvwriter)
-
-        for result in query.all():
-            result.write_csv_row(csvwriter)
-
-        csvdata.seek(0)
-
-        return flask.send_file(csvdata, mimetype='text/csv', cache_timeout=0,
-                               attachment_filename="search_results.csv",
-                               as_attachment=True)
+        return unicode_csv.csv_response(
+            unicode_csv.iter_csv(
+                pagination.iterate(
+                    query.options(*model.csv_export_options()),
+                    sort_key,
+                    unicode_csv.BATCH_SIZE,
+                    descending
+                ),
+                model.write_csv_row,
+                model.write_csv_header
+            ),
+            filename='search_results.csv'
+        )
     else:
         return flask.render_template(
             'admin/admin_home.html',
             form=flask.request.form,
-            colleges=models.College.query.all(),
-            affiliations=models.Affiliation.query.all(),
-            results=query.paginate(page,
-                                   int(flask.request.form['num_results'])),
+            colleges=reference_data.get_colleges(),
+            affiliations=reference_data.get_affiliations(),
+            results=pagination.paginate(
+                query,
+                sort_key,
+                cursor,
+                int(flask.request.form['num_results']),
+                descending=descending,
+                with_total=True
+            ),
             category=category
         )
 
@@ -358,21 +371,74 @@ def view_log(entry_id):
         log=log
     )
 
+@ADMIN.route('/admin/log/archive')
+@ADMIN.route('/admin/log/archive/<month>')
+@login.login_required
+@login_manager.admin_required
+def view_log_archive(month=None):
+    """View log entries which have been archived, a month at a time.
+
+    Entries can be filtered by the user, ticket, transaction or purchase group
+    they relate to, given in the query string.
+    """
+    filters = {
+        key: flask.request.args.get(key, type=int)
+        for key in [
+            'user_id',
+            'ticket_id',
+            'transaction_id',
+            'purchase_group_id',
+        ]
+        if flask.request.args.get(key, type=int) is not None
+    }
+
+    entries = None
+    users = {}
+
+    if month is not None:
+        entries = log_archive.read_month(month, **filters)
+
+        user_ids = set()
+
+        for entry in entries or []:
+            user_ids.update([entry.actor_id, entry.user_id])
+
+        user_ids.discard(None)
+
+        if user_ids:
+            users = {
+                user.object_id: user
+                for user in models.User.query.filter(
+                    models.User.object_id.in_(user_ids)
+                )
+            }
+
+    return flask.render_template(
+        'admin/view_log_archive.html',
+        months=log_archive.get_archived_months(),
+        month=month,
+        entries=entries,
+        users=users,
+        filters=filters
+    )
+
 @ADMIN.route('/admin/transaction/<int:transaction_id>/view')
 @ADMIN.route(
-    '/admin/transaction/<int:transaction_id>/view/page/<int:events_page>'
+    '/admin/transaction/<int:transaction_id>/view/events/<events_cursor>'
 )
 @login.login_required
 @login_manager.admin_required
-def view_transaction(transaction_id, events_page=1):
+def view_transaction(transaction_id, events_cursor=None):
     """View a card transaction object."""
     transaction = models.Transaction.get_by_id(transaction_id)
 
     if transaction:
-        events = transaction.events.paginate(
-            events_page,
+        events = pagination.paginate(
+            transaction.events,
+            LOG_ORDER,
+            events_cursor,
             10,
-            True
+            descending=True
         )
     else:
         events = None
@@ -380,8 +446,7 @@ def view_transaction(transaction_id, events_page=1):
     return flask.render_template(
         'admin/view_transaction.html',
         transaction=transaction,
-        events=events,
-        events_page=events_page
+        events=events
     )
 
 @ADMIN.route('/admin/eway_transaction/<int:eway_transaction_id>/view')
@@ -421,19 +486,21 @@ def delete_waiting(entry_id):
 
 @ADMIN.route('/admin/purchase_group/<int:group_id>/view')
 @ADMIN.route(
-    '/admin/purchase_group/<int:group_id>/view/page/<int:events_page>'
+    '/admin/purchase_group/<int:group_id>/view/events/<events_cursor>'
 )
 @login.login_required
 @login_manager.admin_required
-def view_purchase_group(group_id, events_page=1):
+def view_purchase_group(group_id, events_cursor=None):
     """View a ticket object."""
     purchase_group = models.PurchaseGroup.get_by_id(group_id)
 
     if purchase_group:
-        events = purchase_group.events.paginate(
-            events_page,
+        events = pagination.paginate(
+            purchase_group.events,
+            LOG_ORDER,
+            events_cursor,
             10,
-            True
+            descending=True
         )
     else:
         events = None
@@ -441,6 +508,5 @@ def view_purchase_group(group_id, events_page=1):
     return flask.render_template(
         'admin/view_purchase_group.html',
         purchase_group=purchase_group,
-        events=events,
-        events_page=events_page
+        events=events
     )
@@ -11,6 +11,7 @@ from eisitirio import app
 from eisitirio.database import db
 from eisitirio.database import models
 from eisitirio.helpers import login_manager
+from eisitirio.helpers import reference_data
 
 APP = app.APP
 DB = db.DB
@@ -132,6 +133,7 @@ def announcements(page=1):
             )
 
             DB.session.add(announcement)
+            announcement.add_recipients()
             DB.session.commit()
 
             flask.flash(
@@ -143,8 +145,8 @@ def announcements(page=1):
 
     return flask.render_template(
         'admin_announcements/announcements.html',
-        colleges=models.College.query.all(),
-        affiliations=models.Affiliation.query.all(),
+        colleges=reference_data.get_colleges(),
+        affiliations=reference_data.get_affiliations(),
         announcements=models.Announcement.query.paginate(page, 10, False),
         form=form
     )
@@ -3,9 +3,7 @@
 
 from __future__ import unicode_literals
 
-import csv
 import os
-import StringIO
 
 import flask_login as login
 # from flask.ext import login
@@ -16,7 +14,10 @@ from eisitirio.database import db
 from eisitirio.database import models
 from eisitirio.database import static
 from eisitirio.helpers import login_manager
+from eisitirio.helpers import pagination
+from eisitirio.helpers import statistic_rollup
 from eisitirio.helpers import statistics
+from eisitirio.helpers import unicode_csv
 
 APP = app.APP
 DB = db.DB
@@ -43,7 +44,9 @@ def view_statistics():
         ).filter(
             models.Postage.postage_type !=
             APP.config['GRADUAND_POSTAGE_OPTION'].name
-        ).count()
+        ).count(),
+        email_latency=APP.email_manager.latency.get_rows(),
+        latency_buckets=APP.email_manager.latency.BUCKETS_MS
     )
 
 @ADMIN_DATA.route('/admin/graphs/<group>')
@@ -69,16 +72,16 @@ def data(group):
 
     Exports the statistics used to render the graphs as a CSV file.
     """
-    stats = models.Statistic.query.filter(
-        models.Statistic.group == group.title()
-    ).order_by(
-        models.Statistic.timestamp
-    ).all()
-
-    csvdata = StringIO.StringIO()
-    csvwriter = csv.writer(csvdata)
+    stats = pagination.iterate(
+        statistic_rollup.get_series(group).add_columns(
+            models.Statistic.object_id
+        ),
+        [models.Statistic.timestamp, models.Statistic.object_id],
+        unicode_csv.BATCH_SIZE
+    )
 
-    for stat in stats:
+    def write_row(stat, csvwriter):
+        """Write a row for a statistic."""
         csvwriter.writerow(
             [
                 stat.timestamp.strftime('%c'),
@@ -87,32 +90,32 @@ def data(group):
             ]
         )
 
-    csvdata.seek(0)
-    return flask.send_file(csvdata, mimetype='text/csv', cache_timeout=900)
+    return unicode_csv.csv_response(
+        unicode_csv.iter_csv(stats, write_row),
+        cache_timeout=900
+    )
 
 @ADMIN_DATA.route('/admin/dietary_requirements')
 @login.login_required
 @login_manager.admin_required
 def dietary_requirements():
     """Export dietary requirements as a csv."""
-    requirements = models.DietaryRequirements.query.all()
-
-    csvdata = StringIO.StringIO()
-    csvwriter = csv.writer(csvdata)
-
-    csvwriter.writerow([
-        'Pescetarian',
-        'Vegetarian',
-        'Vegan',
-        'Gluten free',
-        'Nut free',
-        'Dairy free',
-        'Egg free',
-        'Seafood free',
-        'Other',
-    ])
-
-    for requirement in requirements:
+    def write_header(csvwriter):
+        """Write the header row."""
+        csvwriter.writerow([
+            'Pescetarian',
+            'Vegetarian',
+            'Vegan',
+            'Gluten free',
+            'Nut free',
+            'Dairy free',
+            'Egg free',
+            'Seafood free',
+            'Other',
+        ])
+
+    def write_row(requirement, csvwriter):
+        """Write a row for a user's dietary requirements."""
         csvwriter.writerow([
             'Yes' if requirement.pescetarian else 'No',
             'Yes' if requirement.vegetarian else 'No',
@@ -125,5 +128,15 @@ def dietary_requirements():
             requirement.other
         ])
 
-    csvdata.seek(0)
-    return flask.send_file(csvdata, mimetype='text/csv', cache_timeout=900)
+    return unicode_csv.csv_response(
+        unicode_csv.iter_csv(
+            pagination.iterate(
+                models.DietaryRequirements.query,
+                [models.DietaryRequirements.object_id],
+                unicode_csv.BATCH_SIZE
+            ),
+            write_row,
+            write_header
+        ),
+        cache_timeout=900
+    )
@@ -63,10 +63,11 @@ def reject_photo(photo_id):
     else:
         photo.verified = False
 
-        APP.email_manager.send_template(
+        APP.email_manager.queue_template(
             photo.user.email,
             'Your photo has been rejected',
             'rejected_photo.email',
+            commit=False,
             name=photo.user.forenames,
             url=flask.url_for('dashboard.profile', _external=True)
         )
@@ -3,8 +3,6 @@
 
 from __future__ import unicode_literals
 
-import StringIO
-
 import flask_login as login
 # from flask.ext import login
 import flask
@@ -13,6 +11,7 @@ from eisitirio import app
 from eisitirio.database import db
 from eisitirio.database import models
 from eisitirio.helpers import login_manager
+from eisitirio.helpers import pagination
 from eisitirio.helpers import unicode_csv
 
 APP = app.APP
@@ -101,22 +100,24 @@ def export_postage(unposted_only, postage_type=None):
 
     Exports the statistics used to render the graphs as a CSV file.
     """
-    csvdata = StringIO.StringIO()
-    csvwriter = unicode_csv.UnicodeWriter(csvdata)
-
-    csvwriter.writerow(
-        [
-            'user_id',
-            'user_name',
-            'postage_type',
-            'address',
-            'status',
-            'num_tickets',
-            'ticket_ids',
-        ]
-    )
+    def write_header(csvwriter):
+        """Write the header row."""
+        csvwriter.writerow(
+            [
+                'user_id',
+                'user_name',
+                'postage_type',
+                'address',
+                'status',
+                'num_tickets',
+                'ticket_ids',
+            ]
+        )
+
+    def write_row(postage, csvwriter):
+        """Write a row for a postage entry."""
+        ticket_ids = [ticket.object_id for ticket in postage.tickets]
 
-    for postage in get_postage_query(postage_type, unposted_only == 'unposted'):
         csvwriter.writerow(
             [
                 postage.owner.object_id,
@@ -124,10 +125,36 @@ def export_postage(unposted_only, postage_type=None):
                 postage.postage_type,
                 postage.address if postage.address is not None else 'N/A',
                 '{0}Posted/Packed'.format('' if postage.posted else 'Not '),
-                postage.tickets.count(),
-                ';'.join(str(ticket.object_id) for ticket in postage.tickets),
+                len(ticket_ids),
+                ';'.join(str(ticket_id) for ticket_id in ticket_ids),
             ]
         )
 
-    csvdata.seek(0)
-    return flask.send_file(csvdata, mimetype='text/csv', cache_timeout=900)
+    return unicode_csv.csv_response(
+        unicode_csv.iter_csv(
+            pagination.iterate(
+                get_postage_query(
+                    postage_type,
+                    unposted_only == 'unposted'
+                ).options(
+                    DB.contains_eager(models.Postage.owner)
+                ),
+                [
+                    models.Postage.postage_type,
+                    models.User.surname,
+                    models.User.forenames,
+                    models.Postage.object_id,
+                ],
+                unicode_csv.BATCH_SIZE,
+                key=lambda postage: [
+                    postage.postage_type,
+                    postage.owner.surname,
+                    postage.owner.forenames,
+                    postage.object_id,
+                ]
+            ),
+            write_row,
+            write_header
+        ),
+        cache_timeout=900
+    )
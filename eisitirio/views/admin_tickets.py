@@ -6,35 +6,40 @@ from __future__ import unicode_literals
 import flask_login as login
 # from flask.ext import login
 import flask
-import base64
 
 from eisitirio import app
 from eisitirio.database import db
 from eisitirio.database import models
 from eisitirio.helpers import login_manager
+from eisitirio.helpers import pagination
+from eisitirio.helpers import qr_codes
 from eisitirio.logic import cancellation_logic
-from eisitirio.scripts import create_qr_codes
+from eisitirio.logic import door_logic
 
 APP = app.APP
 DB = db.DB
 
 ADMIN_TICKETS = flask.Blueprint('admin_tickets', __name__)
 
+LOG_ORDER = [models.Log.timestamp, models.Log.object_id]
+
 @ADMIN_TICKETS.route('/admin/ticket/<int:ticket_id>/view')
 @ADMIN_TICKETS.route(
-    '/admin/ticket/<int:ticket_id>/view/page/<int:events_page>'
+    '/admin/ticket/<int:ticket_id>/view/events/<events_cursor>'
 )
 @login.login_required
 @login_manager.admin_required
-def view_ticket(ticket_id, events_page=1):
+def view_ticket(ticket_id, events_cursor=None):
     """View a ticket object."""
     ticket = models.Ticket.get_by_id(ticket_id)
 
     if ticket:
-        events = ticket.events.paginate(
-            events_page,
+        events = pagination.paginate(
+            ticket.events,
+            LOG_ORDER,
+            events_cursor,
             10,
-            True
+            descending=True
         )
     else:
         events = None
@@ -42,8 +47,7 @@ def view_ticket(ticket_id, events_page=1):
     return flask.render_template(
         'admin_tickets/view_ticket.html',
         ticket=ticket,
-        events=events,
-        events_page=events_page
+        events=events
     )
 
 @ADMIN_TICKETS.route('/admin/ticket/<int:ticket_id>/note',
@@ -60,13 +64,15 @@ def note_ticket(ticket_id):
 
     if ticket:
         ticket.note = flask.request.form['notes']
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Updated notes',
-            tickets=[ticket]
+            tickets=[ticket],
+            commit=False
         )
 
+        DB.session.commit()
+
         flask.flash(
             'Notes set successfully.',
             'success'
@@ -95,13 +101,15 @@ def mark_ticket_paid(ticket_id):
 
     if ticket:
         ticket.paid = True
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Marked as paid',
-            tickets=[ticket]
+            tickets=[ticket],
+            commit=False
         )
 
+        DB.session.commit()
+
         flask.flash(
             'Ticket successfully marked as paid.',
             'success'
@@ -163,13 +171,15 @@ def cancel_ticket(ticket_id):
 
     if ticket:
         ticket.cancelled = True
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Marked ticket as cancelled',
-            tickets=[ticket]
+            tickets=[ticket],
+            commit=False
         )
 
+        DB.session.commit()
+
         flask.flash(
             'Ticket cancelled successfully.',
             'success'
@@ -199,13 +209,15 @@ def uncollect_ticket(ticket_id):
 
     if ticket:
         ticket.barcode = None
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Marked ticket as uncollected',
-            tickets=[ticket]
+            tickets=[ticket],
+            commit=False
         )
 
+        DB.session.commit()
+
         flask.flash(
             u'Ticket marked as uncollected.',
             'success'
@@ -271,46 +283,86 @@ def validate_ticket():
 @login.login_required
 @login_manager.admin_required
 def check_ticket(ticket_id, barcode):
-    ticket = models.Ticket.get_by_id(ticket_id)
+    """Check a ticket scanned at the door, see door_logic.check_in."""
+    valid, message, photo = door_logic.check_in(ticket_id, barcode)
 
-    valid = None
-    message = None
-    photo = None
+    return flask.jsonify(ticketvalid=valid, message=message, photourl=photo)
 
-    if not ticket:
-        valid = False
-        message = 'No such ticket with barcode {0}'.format(barcode)
-        # XXX : Need to return a non-null image here
-    elif ticket.entered:
-        valid = False
-        message = (
-            'Ticket has already been used for '
-            'entry. Check ID against {0} (owned by {1})'
-        ).format(
-            ticket.holder.full_name.encode('utf-8'),
-            ticket.owner.full_name.encode('utf-8')
-        )
-        photo = ticket.holder.photo.thumb_url
-    elif not ticket.holder:
-        valid = False
-        message = (
-            'Ticket has not been claimed. Owner is {0}'
-            ).format(ticket.owner.full_name.encode('utf-8'))
-        photo = ticket.owner.photo.thumb_url
-    elif not ticket.barcode or (ticket.barcode and ticket.barcode != barcode):
-        valid = False
-        message = 'Found ticket, barcode doesnt match {0}'.format(barcode)
-        photo = ticket.holder.photo.thumb_url
-    else:
-        ticket.entered = True
-        DB.session.commit()
+@ADMIN_TICKETS.route('/admin/ticket/check-in', methods=['POST'])
+@login.login_required
+@login_manager.admin_required
+def check_in():
+    """Check in a ticket scanned at the door.
 
-        valid = True
-        message = 'Permit entry for {0}'.format(ticket.holder.full_name.encode('utf-8'))
-        photo = ticket.holder.photo.thumb_url
+    Expects a JSON object with the ticket's ID and barcode, or the contents of
+    the ticket's QR code as "code", and returns whether to permit entry along
+    with a message and the URL of the holder's photo.
+    """
+    data = flask.request.get_json(silent=True) or {}
+
+    try:
+        if 'code' in data:
+            ticket_id, barcode = data['code'].split(',', 1)
+        else:
+            ticket_id, barcode = data['ticket_id'], data['barcode']
+
+        ticket_id = int(ticket_id)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return flask.jsonify(ticketvalid=False, message='Invalid scan',
+                             photourl=None), 400
+
+    valid, message, photo = door_logic.check_in(ticket_id, barcode)
 
     return flask.jsonify(ticketvalid=valid, message=message, photourl=photo)
 
+@ADMIN_TICKETS.route('/admin/ticket/door')
+@login.login_required
+@login_manager.admin_required
+def door_scanner():
+    """Scan tickets at the door against a downloaded manifest.
+
+    Scans are validated by the browser without contacting the server, and the
+    entries are synced back in batches whenever the scanner is online.
+    """
+    return flask.render_template('admin_tickets/door_scanner.html')
+
+@ADMIN_TICKETS.route('/admin/ticket/door/manifest')
+@login.login_required
+@login_manager.admin_required
+def door_manifest():
+    """Download the manifest of tickets for a door scanner."""
+    return flask.jsonify(**door_logic.build_manifest())
+
+@ADMIN_TICKETS.route('/admin/ticket/door/sync', methods=['POST'])
+@login.login_required
+@login_manager.admin_required
+def door_sync():
+    """Record a batch of entries from a door scanner.
+
+    Expects a JSON object with the signature of the scanner's manifest and the
+    IDs of the tickets scanned, and returns which entries were accepted, which
+    conflicted with an earlier entry, which tickets are no longer valid, and
+    the IDs of all tickets which have entered the ball.
+    """
+    data = flask.request.get_json(silent=True) or {}
+
+    if not door_logic.check_signature(data.get('signature', '')):
+        return flask.jsonify(error='Manifest is invalid or out of date'), 403
+
+    try:
+        ticket_ids = [int(ticket_id) for ticket_id in data.get('entries', [])]
+    except (TypeError, ValueError):
+        return flask.jsonify(error='Invalid ticket IDs'), 400
+
+    accepted, conflicts, invalid = door_logic.record_entries(ticket_ids)
+
+    return flask.jsonify(
+        accepted=accepted,
+        conflicts=conflicts,
+        invalid=invalid,
+        entered=door_logic.get_entered_ids()
+    )
+
 
 ###########################################################################
 
@@ -318,25 +370,36 @@ def check_ticket(ticket_id, barcode):
 @login.login_required
 @login_manager.admin_required
 def check_ticket_qr():
-    """A simple little view to make sure all the qrs are working correctly"""
+    """A simple little view to make sure all the qrs are working correctly
 
-    tickets = models.Ticket.query.filter(
-        models.Ticket.barcode != None,
-        models.Ticket.holder_id != None
-    ).all()
-
-    index = -1
+    Steps through the tickets in order of ID, fetching only the next ticket
+    after the one last shown. The verify_qr_codes command checks every ticket
+    in one go.
+    """
+    last_ticket_id = 0
 
     if flask.request.method == 'POST':
-        index = int(flask.request.form['current_ticket_index'])
-        if len(tickets) <= index + 1:
-            return "Done"
+        last_ticket_id = int(flask.request.form['current_ticket_id'])
+
+    ticket = models.Ticket.query.filter(
+        models.Ticket.barcode != None,
+        models.Ticket.holder_id != None,
+        models.Ticket.object_id > last_ticket_id
+    ).order_by(
+        models.Ticket.object_id
+    ).first()
+
+    if ticket is None:
+        return "Done"
 
-    ticket = tickets[index + 1]
     return flask.render_template(
             'admin_tickets/check_ticket_qrs.html',
-            idx=index + 1,
-            barcode=base64.b64encode(create_qr_codes.generate_ticket_qr(ticket))
+            ticket_id=ticket.object_id,
+            qr_url=flask.url_for(
+                'dashboard.ticket_qr',
+                ticket_id=ticket.object_id,
+                key=qr_codes.get_key(ticket.object_id, ticket.barcode)
+            )
         )
 
 
@@ -12,6 +12,7 @@ from eisitirio.database import db
 from eisitirio.database import models
 from eisitirio.forms import admin_users
 from eisitirio.helpers import login_manager
+from eisitirio.helpers import pagination
 from eisitirio.helpers import util
 from eisitirio.logic import affiliation_logic
 
@@ -20,51 +21,54 @@ DB = db.DB
 
 ADMIN_USERS = flask.Blueprint('admin_users', __name__)
 
+LOG_ORDER = [models.Log.timestamp, models.Log.object_id]
+
 @ADMIN_USERS.route('/admin/user/<int:user_id>/view')
 @ADMIN_USERS.route(
-    '/admin/user/<int:user_id>/view/page/selfactions/<int:self_actions_page>'
+    '/admin/user/<int:user_id>/view/selfactions/<self_actions_cursor>'
 )
 @ADMIN_USERS.route(
-    '/admin/user/<int:user_id>/view/page/actions/<int:actions_page>'
+    '/admin/user/<int:user_id>/view/actions/<actions_cursor>'
 )
 @ADMIN_USERS.route(
-    '/admin/user/<int:user_id>/view/page/events/<int:events_page>'
+    '/admin/user/<int:user_id>/view/events/<events_cursor>'
 )
 @login.login_required
 @login_manager.admin_required
-def view_user(user_id, self_actions_page=1, actions_page=1, events_page=1):
+def view_user(user_id, self_actions_cursor=None, actions_cursor=None,
+              events_cursor=None):
     """Display a user's information."""
     user = models.User.get_by_id(user_id)
 
     if user:
-        self_actions = user.actions.filter(
-            models.Log.actor_id == models.Log.user_id
-        ).order_by(
-            models.Log.timestamp.desc()
-        ).paginate(
-            self_actions_page,
+        self_actions = pagination.paginate(
+            user.actions.filter(
+                models.Log.actor_id == models.Log.user_id
+            ),
+            LOG_ORDER,
+            self_actions_cursor,
             10,
-            True
+            descending=True
         )
 
-        other_actions = user.actions.filter(
-            models.Log.actor_id != models.Log.user_id
-        ).order_by(
-            models.Log.timestamp.desc()
-        ).paginate(
-            actions_page,
+        other_actions = pagination.paginate(
+            user.actions.filter(
+                models.Log.actor_id != models.Log.user_id
+            ),
+            LOG_ORDER,
+            actions_cursor,
             10,
-            True
+            descending=True
         )
 
-        events = user.events.filter(
-            models.Log.actor_id != models.Log.user_id
-        ).order_by(
-            models.Log.timestamp.desc()
-        ).paginate(
-            events_page,
+        events = pagination.paginate(
+            user.events.filter(
+                models.Log.actor_id != models.Log.user_id
+            ),
+            LOG_ORDER,
+            events_cursor,
             10,
-            True
+            descending=True
         )
     else:
         self_actions = None
@@ -76,10 +80,7 @@ def view_user(user_id, self_actions_page=1, actions_page=1, events_page=1):
         user=user,
         self_actions=self_actions,
         other_actions=other_actions,
-        events=events,
-        self_actions_page=self_actions_page,
-        actions_page=actions_page,
-        events_page=events_page
+        events=events
     )
 
 @ADMIN_USERS.route('/admin/user/<int:user_id>/impersonate')
@@ -182,16 +183,18 @@ def give_user(user_id):
             ticket.add_note(note)
 
         DB.session.add_all(tickets)
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Gave {0} tickets'.format(
                 num_tickets
             ),
             tickets=tickets,
-            user=user
+            user=user,
+            commit=False
         )
 
+        DB.session.commit()
+
         flask.flash(
             'Gave {0} {1} tickets'.format(
                 user.forenames,
@@ -224,13 +227,15 @@ def note_user(user_id):
 
     if user:
         user.note = flask.request.form['notes']
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Updated notes',
-            user=user
+            user=user,
+            commit=False
         )
 
+        DB.session.commit()
+
         flask.flash(
             'Notes set successfully.',
             'success'
@@ -260,13 +265,15 @@ def verify_user(user_id):
 
     if user:
         user.verified = True
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Verified email',
-            user=user
+            user=user,
+            commit=False
         )
 
+        DB.session.commit()
+
         flask.flash(
             'User marked as verified.',
             'success'
@@ -291,13 +298,15 @@ def demote_user(user_id):
 
     if user:
         user.demote()
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Demoted user',
-            user=user
+            user=user,
+            commit=False
         )
 
+        DB.session.commit()
+
         flask.flash(
             'User demoted.',
             'success'
@@ -322,13 +331,15 @@ def promote_user(user_id):
 
     if user:
         user.promote()
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Promoted user',
-            user=user
+            user=user,
+            commit=False
         )
 
+        DB.session.commit()
+
         flask.flash(
             'User promoted.',
             'success'
@@ -484,15 +495,18 @@ def charge_admin_fee(user_id):
         )
 
         DB.session.add(admin_fee)
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Created admin fee',
             user=login.current_user,
-            admin_fee=admin_fee
+            admin_fee=admin_fee,
+            commit=False
         )
 
-        APP.email_manager.send_template(
+        # Get the fee's ID for the email, which is committed with it
+        DB.session.flush()
+
+        APP.email_manager.queue_template(
             user.email,
             'Please pay an administration fee.',
             'admin_fee.email',
@@ -504,6 +518,8 @@ def charge_admin_fee(user_id):
             )
         )
 
+        DB.session.commit()
+
         flask.flash('Admin fee created.', 'success')
 
         return flask.redirect(
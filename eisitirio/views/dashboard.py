@@ -8,21 +8,24 @@ import datetime
 import flask_login as login
 # from flask.ext import login
 import flask
-import base64
 
 from eisitirio import app
 from eisitirio.database import db
 from eisitirio.database import models
 from eisitirio.helpers import photos
+from eisitirio.helpers import qr_codes
+from eisitirio.helpers import reference_data
 from eisitirio.helpers import util
 from eisitirio.logic import affiliation_logic
-from eisitirio.scripts import create_qr_codes
 
 APP = app.APP
 DB = db.DB
 
 DASHBOARD = flask.Blueprint('dashboard', __name__)
 
+# Time for browsers to cache QR codes for, in seconds
+QR_CACHE_TIMEOUT = 365 * 24 * 60 * 60
+
 @DASHBOARD.route('/dashboard')
 @login.login_required
 def dashboard_home():
@@ -34,10 +37,50 @@ def dashboard_home():
     if login.current_user.held_ticket and login.current_user.held_ticket.barcode:
         ticket = login.current_user.held_ticket
         return flask.render_template('dashboard/dashboard_home.html',
-            barcode=base64.b64encode(create_qr_codes.generate_ticket_qr(ticket)))
+            qr_url=flask.url_for(
+                'dashboard.ticket_qr',
+                ticket_id=ticket.object_id,
+                key=qr_codes.get_key(ticket.object_id, ticket.barcode)
+            ))
     else:
         return flask.render_template('dashboard/dashboard_home.html')
 
+@DASHBOARD.route('/dashboard/ticket/<int:ticket_id>/qr/<key>.png')
+@login.login_required
+def ticket_qr(ticket_id, key):
+    """Serve the QR code for a ticket.
+
+    The URL includes a hash of the ticket's barcode, so the image at a given URL
+    never changes and browsers can cache it for as long as they like. If the
+    barcode has changed, the old URL no longer works.
+    """
+    ticket = models.Ticket.get_by_id(ticket_id)
+
+    if (
+            ticket is None or
+            not ticket.barcode or
+            qr_codes.get_key(ticket.object_id, ticket.barcode) != key or
+            (
+                ticket.holder_id != login.current_user.object_id and
+                not login.current_user.is_admin
+            )
+    ):
+        flask.abort(404)
+
+    if flask.request.if_none_match.contains(key):
+        response = flask.Response(status=304)
+    else:
+        response = flask.make_response(
+            qr_codes.get_qr(ticket.object_id, ticket.barcode)
+        )
+        response.mimetype = 'image/png'
+
+    response.set_etag(key)
+    response.cache_control.private = True
+    response.cache_control.max_age = QR_CACHE_TIMEOUT
+
+    return response
+
 @DASHBOARD.route('/dashboard/profile', methods=['GET', 'POST'])
 @login.login_required
 def profile():
@@ -48,8 +91,8 @@ def profile():
 
     return flask.render_template(
         'dashboard/profile.html',
-        colleges=models.College.query.all(),
-        affiliations=models.Affiliation.query.all()
+        colleges=reference_data.get_colleges(),
+        affiliations=reference_data.get_affiliations()
     )
 
 @DASHBOARD.route('/dashboard/profile/update', methods=['GET', 'POST'])
@@ -136,13 +179,14 @@ def update_profile():
         models.Affiliation.get_by_id(flask.request.form['affiliation'])
     )
 
-    DB.session.commit()
-
     APP.log_manager.log_event(
         'Updated Details',
-        user=login.current_user
+        user=login.current_user,
+        commit=False
     )
 
+    DB.session.commit()
+
     flask.flash(
         'Your details have been updated',
         'success'
@@ -190,13 +234,14 @@ def update_dietary_requirements():
     else:
         dietary_requirements.other = None
 
-    DB.session.commit()
-
     APP.log_manager.log_event(
         'Updated dietary requirements',
-        user=login.current_user
+        user=login.current_user,
+        commit=False
     )
 
+    DB.session.commit()
+
     flask.flash(
         'Your dietary requirements have been updated',
         'success'
@@ -242,6 +287,12 @@ def update_photo():
         DB.session.delete(old_photo)
         DB.session.add(new_photo)
 
+        APP.log_manager.log_event(
+            'Updated photo',
+            user=login.current_user,
+            commit=False
+        )
+
         DB.session.commit()
 
         # We don't want to delete the photo from S3 until after the DB has
@@ -249,11 +300,6 @@ def update_photo():
         if old_photo is not None:
             photos.delete_photo(old_photo)
 
-        APP.log_manager.log_event(
-            'Updated photo',
-            user=login.current_user
-        )
-
         flask.flash(
             'Your photo has been updated',
             'success'
@@ -307,10 +353,11 @@ def update_email():
         login.current_user.secret_key_expiry = (
             datetime.datetime.utcnow() + datetime.timedelta(days=7))
 
-        APP.email_manager.send_template(
+        APP.email_manager.queue_template(
             flask.request.form['email'],
             'Confirm your Email Address',
             'email_change_confirm.email',
+            commit=False,
             name=login.current_user.forenames,
             confirmurl=flask.url_for(
                 'front.confirm_email',
@@ -329,12 +376,13 @@ def update_email():
             'info'
         )
 
-        DB.session.commit()
-
         APP.log_manager.log_event(
             'Updated email address',
-            user=login.current_user
+            user=login.current_user,
+            commit=False
         )
+
+        DB.session.commit()
     else:
         flask.flash('Your email has not been changed.', 'info')
 
@@ -392,13 +440,14 @@ def update_password():
 
     login.current_user.set_password(flask.request.form['password'])
 
-    DB.session.commit()
-
     APP.log_manager.log_event(
         'Updated password',
-        user=login.current_user
+        user=login.current_user,
+        commit=False
     )
 
+    DB.session.commit()
+
     flask.flash(
         'Your password has been updated',
         'success'
@@ -475,7 +524,8 @@ def claim_ticket():
         APP.log_manager.log_event(
             'Claimed ticket',
             user=login.current_user,
-            tickets=[ticket]
+            tickets=[ticket],
+            commit=False
         )
 
         DB.session.commit()
@@ -13,6 +13,7 @@ from eisitirio import app
 from eisitirio.database import db
 from eisitirio.database import models
 from eisitirio.helpers import photos
+from eisitirio.helpers import reference_data
 from eisitirio.helpers import util
 from eisitirio.logic import affiliation_logic
 
@@ -29,8 +30,8 @@ def home():
     """
     return flask.render_template(
         'front/home.html',
-        colleges=models.College.query.all(),
-        affiliations=models.Affiliation.query.all(),
+        colleges=reference_data.get_colleges(),
+        affiliations=reference_data.get_affiliations(),
         form={}
     )
 
@@ -186,8 +187,8 @@ def register():
         return flask.render_template(
             'front/home.html',
             form=flask.request.form,
-            colleges=models.College.query.all(),
-            affiliations=models.Affiliation.query.all()
+            colleges=reference_data.get_colleges(),
+            affiliations=reference_data.get_affiliations()
         )
 
     if APP.config['REQUIRE_USER_PHOTO']:
@@ -210,14 +211,17 @@ def register():
     )
 
     DB.session.add(user)
-    DB.session.commit()
 
     APP.log_manager.log_event(
         'Registered',
-        user=user
+        user=user,
+        commit=False
     )
 
-    APP.email_manager.send_template(
+    # Get the user's ID for the email, which is committed with them
+    DB.session.flush()
+
+    APP.email_manager.queue_template(
         flask.request.form['email'],
         'Confirm your Email Address',
         'email_confirm.email',
@@ -236,6 +240,8 @@ def register():
         )
     )
 
+    DB.session.commit()
+
     flask.flash('Your user account has been registered', 'success')
     flask.flash(
         (
@@ -269,13 +275,14 @@ def confirm_email(user_id, secret_key):
             user.email = user.new_email
             user.new_email = None
 
-        DB.session.commit()
-
         APP.log_manager.log_event(
             'Confirmed email',
-            user=user
+            user=user,
+            commit=False
         )
 
+        DB.session.commit()
+
         if login.current_user.is_anonymous:
             flask.flash(
                 'Your email address has been verified. You can now log in',
@@ -314,23 +321,18 @@ def email_confirm():
                 )
             )
 
-            APP.email_manager.send_template(
+            APP.email_manager.queue_template(
                 flask.request.form['email'],
                 'Attempted Account Access',
                 'email_confirm_fail.email'
             )
+
+            DB.session.commit()
         else:
             user.secret_key = util.generate_key(64)
             user.secret_key_expiry = None
 
-            DB.session.commit()
-
-            APP.log_manager.log_event(
-                'Requested email confirm',
-                user=user
-            )
-
-            APP.email_manager.send_template(
+            APP.email_manager.queue_template(
                 flask.request.form['email'],
                 'Confirm your Email Address',
                 'email_confirm.email',
@@ -349,6 +351,14 @@ def email_confirm():
                 )
             )
 
+            APP.log_manager.log_event(
+                'Requested email confirm',
+                user=user,
+                commit=False
+            )
+
+            DB.session.commit()
+
         flask.flash(
             (
                 'An email has been sent to {0} with detailing what to do '
@@ -391,11 +401,13 @@ def password_reset():
                 )
             )
 
-            APP.email_manager.send_template(
+            APP.email_manager.queue_template(
                 flask.request.form['email'],
                 'Attempted Account Access',
                 'password_reset_fail.email'
             )
+
+            DB.session.commit()
         else:
             user.secret_key = util.generate_key(64)
             user.secret_key_expiry = (
@@ -403,14 +415,7 @@ def password_reset():
                 datetime.timedelta(minutes=30)
             )
 
-            DB.session.commit()
-
-            APP.log_manager.log_event(
-                'Started password reset',
-                user=user
-            )
-
-            APP.email_manager.send_template(
+            APP.email_manager.queue_template(
                 flask.request.form['email'],
                 'Confirm Password Reset',
                 'password_reset_confirm.email',
@@ -423,6 +428,14 @@ def password_reset():
                 )
             )
 
+            APP.log_manager.log_event(
+                'Started password reset',
+                user=user,
+                commit=False
+            )
+
+            DB.session.commit()
+
         flask.flash(
             (
                 'An email has been sent to {0} with detailing what to do '
@@ -484,13 +497,14 @@ def reset_password(user_id, secret_key):
             user.secret_key = None
             user.secret_key_expiry = None
 
-            DB.session.commit()
-
             APP.log_manager.log_event(
                 'Completed password reset',
-                user=user
+                user=user,
+                commit=False
             )
 
+            DB.session.commit()
+
             flask.flash('Your password has been reset, please log in.',
                         'success')
 
@@ -529,16 +543,18 @@ def destroy_account(user_id, secret_key):
 
             DB.session.delete(user)
             DB.session.delete(user.photo)
-            DB.session.commit()
-
-            photos.delete_photo(user.photo)
 
             APP.log_manager.log_event(
                 'Deleted account with email address {0}'.format(
                     user.email
-                )
+                ),
+                commit=False
             )
 
+            DB.session.commit()
+
+            photos.delete_photo(user.photo)
+
             flask.flash('The account has been deleted.', 'info')
         else:
             APP.log_manager.log_event(
@@ -573,7 +589,7 @@ def logout():
             user=login.current_user
         )
 
-        actor = models.User.get_by_id(flask.session['actor_id'])
+        actor = models.User.get_actor()
 
         flask.session.pop('actor_id', None)
 
@@ -3,6 +3,8 @@
 
 from __future__ import unicode_literals
 
+import collections
+
 import flask_login as login
 # from flask.ext import login
 import flask
@@ -42,14 +44,16 @@ def create():
         group = models.PurchaseGroup(login.current_user)
 
         DB.session.add(group)
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Created Purchase Group',
             user=login.current_user,
-            purchase_group=group
+            purchase_group=group,
+            commit=False
         )
 
+        DB.session.commit()
+
     return flask.redirect(flask.url_for('group_purchase.dashboard'))
 
 @GROUP_PURCHASE.route('/purchase/group/join', methods=['GET', 'POST'])
@@ -73,13 +77,15 @@ def join():
         if group:
             if login.current_user.can_join_group(group):
                 group.members.append(login.current_user)
-                DB.session.commit()
 
                 APP.log_manager.log_event(
                     'Joined Purchase Group',
                     user=login.current_user,
-                    purchase_group=group
+                    purchase_group=group,
+                    commit=False
                 )
+
+                DB.session.commit()
             else:
                 flask.flash(
                     (
@@ -111,14 +117,15 @@ def disband():
         group.disbanded = True
         group.members = []
 
-        DB.session.commit()
-
         APP.log_manager.log_event(
             'Disbanded Purchase Group',
             user=login.current_user,
-            purchase_group=group
+            purchase_group=group,
+            commit=False
         )
 
+        DB.session.commit()
+
     return flask.redirect(flask.url_for('group_purchase.dashboard'))
 
 @GROUP_PURCHASE.route('/purchase/group/leave')
@@ -144,7 +151,8 @@ def leave():
         APP.log_manager.log_event(
             'Left Purchase Group',
             user=login.current_user,
-            purchase_group=group
+            purchase_group=group,
+            commit=False
         )
 
         DB.session.commit()
@@ -197,14 +205,15 @@ def update_request():
                 login.current_user
             ))
 
-    DB.session.commit()
-
     APP.log_manager.log_event(
         'Updated Group Purchase Request',
         user=login.current_user,
-        purchase_group=login.current_user.purchase_group
+        purchase_group=login.current_user.purchase_group,
+        commit=False
     )
 
+    DB.session.commit()
+
     flask.flash('Your ticket request has been updated.', 'success')
 
     return flask.redirect(flask.url_for('group_purchase.dashboard'))
@@ -278,6 +287,22 @@ def checkout():
     if flask.request.method != 'POST':
         return flask.render_template('group_purchase/checkout.html')
 
+    num_tickets = collections.defaultdict(int)
+
+    for request in login.current_user.purchase_group.requests:
+        num_tickets[request.ticket_type.slug] += request.number_requested
+
+    # Holds the capacity until the tickets are committed below
+    flashes = purchase_logic.reserve_tickets(num_tickets)
+
+    if flashes:
+        flask.flash('No tickets are available for your group.', 'info')
+
+        for msg in flashes:
+            flask.flash(msg, 'warning')
+
+        return flask.redirect(flask.url_for('dashboard.dashboard_home'))
+
     tickets = [
         models.Ticket(
             request.requester,
@@ -292,13 +317,12 @@ def checkout():
 
     login.current_user.purchase_group.purchased = True
 
-    DB.session.commit()
-
     APP.log_manager.log_event(
         'Completed Group Purchase',
         user=login.current_user,
         tickets=tickets,
-        purchase_group=login.current_user.purchase_group
+        purchase_group=login.current_user.purchase_group,
+        commit=False
     )
 
     expiry_time = util.format_timedelta(APP.config['TICKET_EXPIRY_TIME'])
@@ -308,16 +332,19 @@ def checkout():
             for request in login.current_user.purchase_group.requests
             if request.requester != login.current_user
     ):
-        APP.email_manager.send_template(
+        APP.email_manager.queue_template(
             user.email,
             'Group Purchase Completed - Complete Payment Now!',
             'group_purchase_completed.email',
+            commit=False,
             name=user.forenames,
             group_leader=login.current_user.full_name,
             url=flask.url_for('purchase.complete_payment', _external=True),
             expiry_time=expiry_time
         )
 
+    DB.session.commit()
+
     flask.flash('The tickets for your group have been reserved', 'success')
     flask.flash('You can now proceed to pay for your own tickets.', 'info')
     flask.flash(
@@ -3,6 +3,8 @@
 
 from __future__ import unicode_literals
 
+import json
+
 import flask_login as login
 # from flask.ext import login
 import flask
@@ -17,6 +19,7 @@ from eisitirio.logic import cancellation_logic
 from eisitirio.logic import realex_logic
 from eisitirio.logic import purchase_logic
 from eisitirio.logic import payment_logic
+from eisitirio.logic import queue_logic
 from eisitirio.logic.custom_logic import ticket_logic
 
 APP = app.APP
@@ -58,6 +61,9 @@ def purchase_home():
             )
             return flask.redirect(flask.url_for('dashboard.dashboard_home'))
 
+    if not queue_logic.is_admitted(login.current_user.object_id):
+        return flask.redirect(flask.url_for('purchase.queue'))
+
     ticket_info = purchase_logic.get_ticket_info(
         login.current_user
     )
@@ -116,6 +122,10 @@ def purchase_home():
 
         postage, address = purchase_logic.check_postage(flashes)
 
+        if not flashes:
+            # Holds the capacity until the tickets are committed below
+            flashes = purchase_logic.reserve_tickets(num_tickets)
+
         if flashes:
             flask.flash(
                 (
@@ -166,14 +176,16 @@ def purchase_home():
 
 
         DB.session.add_all(tickets)
-        DB.session.commit()
 
         APP.log_manager.log_event(
             'Purchased Tickets',
             tickets=tickets,
-            user=login.current_user
+            user=login.current_user,
+            commit=False
         )
 
+        DB.session.commit()
+
         # return flask.render_template(
         #    'purchase/purchase_home.html',
         #    num_tickets=num_tickets,
@@ -193,6 +205,46 @@ def purchase_home():
             ticket_info=ticket_info
         )
 
+@PURCHASE.route('/purchase/queue')
+@login.login_required
+def queue():
+    """Give the user a place in the queue for the purchase page."""
+    if queue_logic.is_admitted(login.current_user.object_id):
+        return flask.redirect(flask.url_for('purchase.purchase_home'))
+
+    place = queue_logic.get_place(login.current_user.object_id)
+
+    if place is None:
+        place = queue_logic.join_queue(login.current_user)
+
+    return flask.render_template(
+        'purchase/queue.html',
+        place=place,
+        ahead=max(0, place - queue_logic.admitted_places())
+    )
+
+@PURCHASE.route('/purchase/queue/status')
+def queue_status():
+    """Report the user's progress through the queue.
+
+    Polled by the queue page, so the user is identified by the ID in their
+    session rather than loaded with login.current_user, and the status is
+    worked out from the admission token alone without touching the database.
+    Anyone not logged in has no place, and is sent on to the purchase page to
+    log in.
+    """
+    user_id = queue_logic.get_session_user_id()
+    place = queue_logic.get_place(user_id)
+    admitted_places = queue_logic.admitted_places()
+
+    response = {
+        'place': place,
+        'ahead': None if place is None else max(0, place - admitted_places),
+        'admitted': queue_logic.is_admitted(user_id),
+    }
+
+    return flask.Response(json.dumps(response), mimetype='text/json')
+
 @PURCHASE.route('/upgrade', methods=['GET', 'POST'])
 def upgrade_ticket_redirect():
     return flask.redirect(flask.url_for('purchase.upgrade_ticket'))
@@ -236,7 +288,8 @@ def upgrade_ticket():
         APP.log_manager.log_event(
             'Upgraded Tickets: {0}'.format(', '.join(selected_tickets)),
             admin_fee=admin_fee,
-            user=login.current_user
+            user=login.current_user,
+            commit=False
         )
 
         DB.session.add(admin_fee)
@@ -300,15 +353,17 @@ def wait():
             num_tickets
         )
     )
-    DB.session.commit()
 
     APP.log_manager.log_event(
         'Joined waiting list for {0} tickets'.format(
             num_tickets
         ),
-        user=login.current_user
+        user=login.current_user,
+        commit=False
     )
 
+    DB.session.commit()
+
     flask.flash(
         (
             'You have been added to the waiting list for {0} ticket{1}.'
@@ -440,9 +495,8 @@ def resell():
                 found_uncancelled = True
 
         DB.session.add_all(new_tickets)
-        DB.session.commit()
 
-        APP.email_manager.send_template(
+        APP.email_manager.queue_template(
             resell_to.email,
             'You have been resold tickets',
             'resale.email',
@@ -455,15 +509,19 @@ def resell():
         APP.log_manager.log_event(
             'Cancelled tickets for resale',
             tickets=tickets,
-            user=login.current_user
+            user=login.current_user,
+            commit=False
         )
 
         APP.log_manager.log_event(
             'Created tickets from resale',
             tickets=new_tickets,
-            user=resell_to
+            user=resell_to,
+            commit=False
         )
 
+        DB.session.commit()
+
         if found_uncancelled:
             flask.flash('The resale was partially successful.', 'success')
             flask.flash(
@@ -0,0 +1,34 @@
+"""Add indexes for hot ticket, user, log and statistic columns
+
+Revision ID: 071212872059
+Revises: c9df432a747a
+Create Date: 2026-10-18 10:12:31.215402
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '071212872059'
+down_revision = 'c9df432a747a'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_ticket_ticket_type_cancelled_paid', 'ticket',
+                    ['ticket_type', 'cancelled', 'paid'], unique=False)
+    op.create_index('ix_ticket_cancelled_paid_expires', 'ticket',
+                    ['cancelled', 'paid', 'expires'], unique=False)
+    op.create_index('ix_user_secret_key_expiry', 'user',
+                    ['secret_key_expiry'], unique=False)
+    op.create_index('ix_log_timestamp', 'log', ['timestamp'], unique=False)
+    op.create_index('ix_statistic_group_timestamp', 'statistic',
+                    ['group', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_statistic_group_timestamp', table_name='statistic')
+    op.drop_index('ix_log_timestamp', table_name='log')
+    op.drop_index('ix_user_secret_key_expiry', table_name='user')
+    op.drop_index('ix_ticket_cancelled_paid_expires', table_name='ticket')
+    op.drop_index('ix_ticket_ticket_type_cancelled_paid', table_name='ticket')
@@ -0,0 +1,37 @@
+"""Add materialised ticket counters
+
+Revision ID: 4f1c6e0b9a27
+Revises: 071212872059
+Create Date: 2026-10-18 11:02:47.831020
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4f1c6e0b9a27'
+down_revision = '071212872059'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('ticket_counter',
+    sa.Column('object_id', sa.Integer(), nullable=False),
+    sa.Column('ticket_type', sa.Unicode(length=50), nullable=False),
+    sa.Column('active', sa.Integer(), nullable=False),
+    sa.Column('cancelled', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('object_id'),
+    sa.UniqueConstraint('ticket_type')
+    )
+
+    op.execute(
+        'INSERT INTO ticket_counter (ticket_type, active, cancelled) '
+        'SELECT ticket_type, '
+        'SUM(CASE WHEN cancelled = 0 THEN 1 ELSE 0 END), '
+        'SUM(CASE WHEN cancelled = 1 THEN 1 ELSE 0 END) '
+        'FROM ticket GROUP BY ticket_type'
+    )
+
+
+def downgrade():
+    op.drop_table('ticket_counter')
@@ -0,0 +1,39 @@
+"""Add email outbox
+
+Revision ID: 5b7e2f9d3c18
+Revises: a3d9e58c1f04
+Create Date: 2026-10-18 16:40:12.503117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2f9d3c18'
+down_revision = 'a3d9e58c1f04'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('outbox_email',
+    sa.Column('object_id', sa.Integer(), nullable=False),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('sender', sa.Unicode(length=120), nullable=False),
+    sa.Column('recipients', sa.UnicodeText(), nullable=False),
+    sa.Column('subject', sa.Unicode(length=255), nullable=False),
+    sa.Column('message', sa.Text(length=16777215), nullable=False),
+    sa.Column('pending', sa.Boolean(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt', sa.DateTime(), nullable=False),
+    sa.Column('sent', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Unicode(length=255), nullable=True),
+    sa.PrimaryKeyConstraint('object_id')
+    )
+    op.create_index('ix_outbox_email_pending_next_attempt', 'outbox_email',
+                    ['pending', 'next_attempt'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbox_email_pending_next_attempt',
+                  table_name='outbox_email')
+    op.drop_table('outbox_email')
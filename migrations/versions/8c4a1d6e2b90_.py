@@ -0,0 +1,22 @@
+"""Add delivery cursor to announcements
+
+Revision ID: 8c4a1d6e2b90
+Revises: 5b7e2f9d3c18
+Create Date: 2026-10-18 18:12:44.208163
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8c4a1d6e2b90'
+down_revision = '5b7e2f9d3c18'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('announcement', sa.Column('email_cursor', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('announcement', 'email_cursor')
@@ -0,0 +1,29 @@
+"""Add release-time purchase queue
+
+Revision ID: a3d9e58c1f04
+Revises: 4f1c6e0b9a27
+Create Date: 2026-10-18 13:21:09.415862
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a3d9e58c1f04'
+down_revision = '4f1c6e0b9a27'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('queue_entry',
+    sa.Column('object_id', sa.Integer(), nullable=False),
+    sa.Column('joined', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.object_id'], ),
+    sa.PrimaryKeyConstraint('object_id'),
+    sa.UniqueConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('queue_entry')
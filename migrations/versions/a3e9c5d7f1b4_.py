@@ -0,0 +1,88 @@
+"""Add statistic counters
+
+Revision ID: a3e9c5d7f1b4
+Revises: 8c4a1d6e2b90
+Create Date: 2026-10-18 20:41:09.513260
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a3e9c5d7f1b4'
+down_revision = '8c4a1d6e2b90'
+
+from alembic import op
+import sqlalchemy as sa
+
+DIETARY_REQUIREMENTS = [
+    ('vegan', 'vegan = 1'),
+    ('vegetarian', 'vegan = 0 AND vegetarian = 1'),
+    ('pescetarian', 'vegan = 0 AND vegetarian = 0 AND pescetarian = 1'),
+    ('gluten_free', 'gluten_free = 1'),
+    ('nut_free', 'nut_free = 1'),
+    ('dairy_free', 'dairy_free = 1'),
+    ('egg_free', 'egg_free = 1'),
+    ('seafood_free', 'seafood_free = 1'),
+    ('other', 'other IS NOT NULL'),
+]
+
+
+def upgrade():
+    op.create_table('statistic_counter',
+    sa.Column('object_id', sa.Integer(), nullable=False),
+    sa.Column('category', sa.Unicode(length=50), nullable=False),
+    sa.Column('name', sa.Unicode(length=50), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('object_id'),
+    sa.UniqueConstraint('category', 'name')
+    )
+
+    op.execute(
+        'INSERT INTO statistic_counter (category, name, value) '
+        'SELECT \'ticket_states\', CONCAT(ticket_type, \'/\', CASE '
+        'WHEN cancelled = 1 THEN \'cancelled\' '
+        'WHEN paid = 0 THEN \'unpaid\' '
+        'WHEN barcode IS NULL THEN \'paid\' '
+        'WHEN entered = 0 THEN \'collected\' '
+        'ELSE \'entered\' END) AS state, COUNT(*) '
+        'FROM ticket GROUP BY state'
+    )
+
+    op.execute(
+        'INSERT INTO statistic_counter (category, name, value) '
+        'SELECT \'college_users\', CAST(college_id AS CHAR), COUNT(*) '
+        'FROM `user` GROUP BY college_id'
+    )
+
+    op.execute(
+        'INSERT INTO statistic_counter (category, name, value) '
+        'SELECT \'paid_ticket_items\', `transaction`.payment_method, COUNT(*) '
+        'FROM ticket_transaction_item '
+        'JOIN transaction_item '
+        'ON transaction_item.object_id = ticket_transaction_item.object_id '
+        'JOIN `transaction` '
+        'ON `transaction`.object_id = transaction_item.transaction_id '
+        'WHERE `transaction`.paid = 1 '
+        'GROUP BY `transaction`.payment_method'
+    )
+
+    op.execute(
+        'INSERT INTO statistic_counter (category, name, value) '
+        'SELECT \'waiting\', \'users\', COUNT(*) FROM waiting'
+    )
+
+    op.execute(
+        'INSERT INTO statistic_counter (category, name, value) '
+        'SELECT \'waiting\', \'tickets\', COALESCE(SUM(waiting_for), 0) '
+        'FROM waiting'
+    )
+
+    for name, condition in DIETARY_REQUIREMENTS:
+        op.execute(
+            'INSERT INTO statistic_counter (category, name, value) '
+            'SELECT \'dietary_requirements\', \'{0}\', COUNT(*) '
+            'FROM dietary_requirements WHERE {1}'.format(name, condition)
+        )
+
+
+def downgrade():
+    op.drop_table('statistic_counter')
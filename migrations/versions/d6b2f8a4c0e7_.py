@@ -0,0 +1,22 @@
+"""Add resolution to statistics
+
+Revision ID: d6b2f8a4c0e7
+Revises: a3e9c5d7f1b4
+Create Date: 2026-10-18 21:27:53.402118
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd6b2f8a4c0e7'
+down_revision = 'a3e9c5d7f1b4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('statistic', sa.Column('resolution', sa.Enum('raw', 'hourly', 'daily'), server_default='raw', nullable=False))
+
+
+def downgrade():
+    op.drop_column('statistic', 'resolution')
@@ -0,0 +1,24 @@
+"""Add release to purchase queue entries
+
+Revision ID: e4a7c1b9d352
+Revises: d6b2f8a4c0e7
+Create Date: 2026-10-18 23:02:41.736915
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7c1b9d352'
+down_revision = 'd6b2f8a4c0e7'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('queue_entry', sa.Column('release', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_queue_entry_release'), 'queue_entry', ['release'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_queue_entry_release'), table_name='queue_entry')
+    op.drop_column('queue_entry', 'release')
@@ -5,6 +5,7 @@ from __future__ import unicode_literals
 
 import logging
 import os
+import signal
 import site
 import sys
 
@@ -18,9 +19,12 @@ from newrelic import agent
 
 from eisitirio import app
 from eisitirio import system # pylint: disable=unused-import
+from eisitirio.helpers import config_loader
 
 APP = app.APP
 
+CONFIG_LOADER = config_loader.ConfigLoader(APP)
+
 agent.initialize(os.path.join(VENV_DIR, 'newrelic.ini'))
 
 # boto and requests are a bit noisy, so we set their level to tone them down
@@ -31,12 +35,24 @@ logging.getLogger('requests').setLevel(logging.WARNING)
 # the messages reaching the root logger and being duplicated
 logging.getLogger('newrelic').propagate = False
 
+# The config file is reloaded when it changes, or when the process is sent
+# SIGUSR2. Some servers don't let applications install signal handlers, in which
+# case touching the file is the only way to reload it.
+try:
+    signal.signal(signal.SIGUSR2, CONFIG_LOADER.request_reload)
+except ValueError:
+    pass
+
 @agent.wsgi_application()
 def application(req_environ, start_response):
-    """Wrapper around actual application to load config based on environment."""
+    """Wrapper around actual application to load config based on environment.
+
+    The config file is only loaded on the first request to each process, and
+    again if it changes.
+    """
     if (
             'EISITIRIO_CONFIG' not in req_environ or
-            not APP.config.from_pyfile(req_environ['EISITIRIO_CONFIG'])
+            not CONFIG_LOADER.load(req_environ['EISITIRIO_CONFIG'])
     ):
         start_response(b'500 Internal Server Error',
                        [(b'Content-Type', b'text/plain')])